@@ -34,6 +34,72 @@ class Settings(BaseSettings):
     DB_PASSWORD: str
     DB_NAME: str
 
+    # Connection pool (per engine, per worker process)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+
+    # Request / SQL metrics (core/core/metrics.py, GET /metrics)
+    METRICS_ENABLED: bool = True
+
+    # N+1 query detector (core/core/nplusone.py), development aid
+    NPLUSONE_DETECT: Optional[bool] = None          # None = on when DEBUG
+    NPLUSONE_THRESHOLD: int = 5                     # identical statements in one request before it is logged
+
+    # Slow request / slow query log (core/core/slowlog.py)
+    SLOW_REQUEST_SECONDS: float = 1                 # 0 = slow log off
+    SLOW_QUERY_SECONDS: float = 0.2                 # a statement this slow logs its request too
+    SLOW_LOG_FILE: str = "logs/slow.ndjson"
+    SLOW_LOG_MAX_BYTES: int = 10 * 1024 * 1024      # rotation size
+    SLOW_LOG_BACKUPS: int = 5
+    SLOW_LOG_MAX_STATEMENTS: int = 200              # statements listed per request entry
+    SLOW_LOG_BODY_BYTES: int = 2048                 # start of the request body kept per entry
+    SLOW_EXPLAIN_SAMPLE_RATE: float = 0.1           # share of slow statements explained again; 0 = never
+    SLOW_EXPLAIN_MAX_PER_MINUTE: int = 6            # per worker process
+    SLOW_EXPLAIN_TIMEOUT_SECONDS: float = 5         # statement_timeout of EXPLAIN ANALYZE
+
+    # Duplicate scan pre-check (per worker process)
+    DEDUP_ENABLED: bool = True
+    DEDUP_BLOOM_CAPACITY: int = 1_000_000   # stored product codes before the filter is resized
+    DEDUP_BLOOM_FP_RATE: float = 0.001
+    DEDUP_RECENT_SIZE: int = 10_000         # recently scanned codes kept for instant "duplicate" answers
+    DEDUP_RECENT_TTL_SECONDS: float = 30
+
+    # Grid provisioning limits (POST /create, /create/bulk, PUT /{grid_id})
+    GRID_MAX_WIDTH: int = 20
+    GRID_MAX_HEIGHT: int = 20
+    GRID_BULK_MAX_GRIDS: int = 500     # grids per /create/bulk request
+
+    # Empty-cell allocation (grid_management/allocation.py)
+    ALLOCATION_STRATEGY: str = "fill_grid_first"  # nearest_station, balance_grids, reserve_large
+    ALLOCATION_STATION_X: int = 0           # packing station position, in cells of the first grid
+    ALLOCATION_STATION_Y: int = 0
+    ALLOCATION_GRID_SPACING: int = 25       # walk between neighbouring grids, in cells
+    ALLOCATION_LARGE_ORDER_TOTAL: int = 5   # reserve_large: orders with this many products or more
+    ALLOCATION_LARGE_CELL_ROWS: int = 1     # reserve_large: first rows of each grid hold large cells
+
+    # Shipped products archive (shipped_products, monthly partitions on PostgreSQL)
+    ARCHIVE_RETENTION_DAYS: int = 365                 # 0 = keep forever
+    ARCHIVE_PARTITIONS_AHEAD: int = 2                 # future monthly partitions kept ready
+    ARCHIVE_MAINTENANCE_INTERVAL_SECONDS: float = 3600  # 0 = only via python -m grid_management.archive
+    ARCHIVE_COMPACTION_BATCH: int = 500               # legacy history rows converted per transaction
+
+    # Cell history write-behind (grid_management/history.py)
+    HISTORY_WRITE_BEHIND: bool = False              # False = history rows are written in the cell's transaction
+    HISTORY_SPOOL_DIR: str = "spool"                # local crash spool of unflushed rows
+    HISTORY_SPOOL_FSYNC: bool = False               # fsync the spool every flush interval (host crash loses at most one interval)
+    HISTORY_FLUSH_INTERVAL_SECONDS: float = 1
+    HISTORY_FLUSH_BATCH: int = 1000                 # rows per INSERT; a full batch is flushed early
+
+    # Response cache of grid/cell views (grid_management/cache.py)
+    CACHE_BACKEND: str = "local"                    # local (per-process LRU), redis, off
+    CACHE_REDIS_URL: str = "redis://localhost:6379/0"
+    CACHE_MAX_ENTRIES: int = 2000                   # local: LRU size limits
+    CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    CACHE_TTL_SECONDS: float = 60                   # bounds staleness from missed events
+
     # AWS S3 Settings
     AWS_ACCESS_KEY_ID: str
     AWS_SECRET_ACCESS_KEY: str
@@ -60,6 +126,10 @@ class Settings(BaseSettings):
 
     @property
     def DATABASE_URL(self) -> str:
-        return f"postgresql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+        return f"postgresql+psycopg2://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+
+    @property
+    def ASYNC_DATABASE_URL(self) -> str:
+        return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
 
 settings = Settings()
\ No newline at end of file
@@ -1,23 +1,58 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from . import metrics, nplusone, slowlog
 from .config import settings
+from .pool_metrics import PoolStats, instrument_engine, instrumented_pool_class
+
+sync_pool_stats = PoolStats("sync")
+async_pool_stats = PoolStats("async")
 
 # Create PostgreSQL engine with connection pooling
 engine = create_engine(
     settings.DATABASE_URL,
-    pool_size=5,
-    max_overflow=10,
-    pool_timeout=30,
-    pool_recycle=1800,
-    pool_pre_ping=True,
-    poolclass=QueuePool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    poolclass=instrumented_pool_class(QueuePool, sync_pool_stats),
+    echo=settings.DEBUG,
+)
+instrument_engine(engine, sync_pool_stats)
+if settings.METRICS_ENABLED:
+    metrics.instrument_engine(engine, "sync")
+if nplusone.enabled():
+    nplusone.instrument_engine(engine)
+if slowlog.enabled():
+    slowlog.instrument_engine(engine)
+
+# Async engine (asyncpg) used by the API handlers
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    poolclass=instrumented_pool_class(AsyncAdaptedQueuePool, async_pool_stats),
     echo=settings.DEBUG,
 )
+instrument_engine(async_engine.sync_engine, async_pool_stats)
+if settings.METRICS_ENABLED:
+    metrics.instrument_engine(async_engine.sync_engine, "async")
+if nplusone.enabled():
+    nplusone.instrument_engine(async_engine.sync_engine)
+if slowlog.enabled():
+    slowlog.instrument_engine(async_engine.sync_engine)
 
-# Create session factory
+# Create session factories
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Objects stay loaded after commit: response models are built outside the
+# session's greenlet, where expired attributes could not be reloaded
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 # Create base class for models
 Base = declarative_base()
@@ -34,4 +69,89 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    """
+    Get async database session with automatic closing.
+    Usage:
+        @app.get("/users")
+        async def get_users(db: AsyncSession = Depends(get_async_db)):
+            ...
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def session_factory_for(db: Session) -> sessionmaker:
+    """
+    Session factory on db's engine: SessionLocal for the app's engine, a new
+    factory for another one (a benchmark's or a script's database). Lets
+    in-memory structures rebuilt from db reload from the same database later.
+    """
+    bind = db.get_bind()
+    bind = getattr(bind, "engine", bind)
+    if bind is engine:
+        return SessionLocal
+    return sessionmaker(autocommit=False, autoflush=False, bind=bind)
+
+def before_commit(db: Session, callback):
+    """
+    Run callback(db) right before the session's current transaction commits,
+    inside that transaction (e.g. to flush aggregated writes in one statement).
+    Pending ORM changes are flushed first, so rows the callback locks (hot
+    counters) are held only for the final statement(s) before COMMIT.
+    """
+    db.info.setdefault("before_commit", []).append(callback)
+
+def on_commit(db: Session, callback):
+    """
+    Run callback once the session's current transaction has committed.
+    Callbacks are dropped if the transaction rolls back, so in-process
+    state (caches, indexes) never reflects changes that were not persisted.
+    Callbacks must not use the session.
+    """
+    db.info.setdefault("on_commit", []).append(callback)
+
+def on_rollback(db: Session, callback):
+    """Run callback if the session's current transaction ends without committing"""
+    db.info.setdefault("on_rollback", []).append(callback)
+
+def transaction_info(db: Session) -> dict:
+    """Scratch dict scoped to the session's current transaction"""
+    return db.info.setdefault("transaction_info", {})
+
+def insert_for(db):
+    """Dialect insert() construct (with on_conflict_do_update) for a Session or Connection"""
+    dialect = db.get_bind().dialect.name if isinstance(db, Session) else db.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Upsert is not supported on {dialect}")
+    return insert
+
+@event.listens_for(Session, "before_commit")
+def _run_before_commit_callbacks(session):
+    callbacks = session.info.pop("before_commit", [])
+    if callbacks:
+        session.flush()
+    for callback in callbacks:
+        callback(session)
+
+@event.listens_for(Session, "after_commit")
+def _run_on_commit_callbacks(session):
+    session.info.pop("on_rollback", None)
+    callbacks = session.info.pop("on_commit", [])
+    for callback in callbacks:
+        callback()
+
+@event.listens_for(Session, "after_transaction_end")
+def _end_transaction_callbacks(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("before_commit", None)
+        session.info.pop("on_commit", None)
+        session.info.pop("transaction_info", None)
+        callbacks = session.info.pop("on_rollback", [])
+        for callback in callbacks:
+            callback()
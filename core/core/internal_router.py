@@ -0,0 +1,32 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from . import metrics, pool_metrics
+
+router = APIRouter(
+    prefix="/internal",
+    tags=["Internal - Diagnostics"]
+)
+
+# Served at the root (GET /metrics), where Prometheus scrapes by default
+metrics_router = APIRouter(tags=["Internal - Diagnostics"])
+
+@router.get("/pool")
+async def get_pool_stats():
+    """
+    Connection pool telemetry of THIS worker process
+    - checked_out / overflow: live pool usage
+    - wait_ms: time spent waiting for a connection (cumulative histogram, ms)
+    - timeouts: checkouts that gave up after DB_POOL_TIMEOUT
+    """
+    return pool_metrics.report()
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus metrics of THIS worker process
+    - http_request_*: latency, SQL statements, DB time and rows per route template
+    - sql_*: statements and DB time per engine (requests and background work)
+    - db_pool_*: connection pool usage and checkout waits
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,266 @@
+"""
+Per-route request and SQL metrics (per worker process), Prometheus text format
+
+- MetricsMiddleware times every HTTP request and labels it with the route
+  template (/v1/cell/{cell_id}/detail, not the raw path) once routing matched
+- Engine cursor events count the SQL statements, DB time and rows
+  (cursor.rowcount: rows returned by a SELECT, affected by a DML) of the
+  request being served; the request is found through a context variable, so
+  statements of background threads count only in the per-engine totals
+- render() turns everything, plus the pool telemetry of pool_metrics, into the
+  Prometheus exposition format served by GET /metrics
+
+The per-request cost is a few perf_counter() calls and one locked update of
+the route's counters, so METRICS_ENABLED can stay on in production. Numbers
+are per process: scrape every worker (or run one worker per container).
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import pool_metrics
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 20, 50, 100)
+
+UNMATCHED_ROUTE = "(unmatched)"
+
+class Histogram:
+    """Bucket counts, sum and count (buckets are cumulated when rendered)"""
+
+    __slots__ = ("bounds", "buckets", "count", "sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+class RequestMetrics:
+    """SQL work of the request being served (context variable)"""
+
+    __slots__ = ("statements", "db_seconds", "rows")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+
+class RouteStats:
+    def __init__(self):
+        self.responses: Dict[int, int] = {}
+        self.latency = Histogram(LATENCY_BUCKETS_SECONDS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.db_seconds = 0.0
+        self.rows = 0
+
+class EngineStats:
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+        self.errors = 0
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[Tuple[str, str], RouteStats] = {}
+        self._engines: Dict[str, EngineStats] = {}
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, request: RequestMetrics):
+        with self._lock:
+            stats = self._routes.get((method, route))
+            if stats is None:
+                stats = self._routes[(method, route)] = RouteStats()
+            stats.responses[status] = stats.responses.get(status, 0) + 1
+            stats.latency.observe(seconds)
+            stats.statements.observe(request.statements)
+            stats.db_seconds += request.db_seconds
+            stats.rows += request.rows
+
+    def record_statement(self, engine: str, seconds: float):
+        with self._lock:
+            stats = self._engines[engine]
+            stats.statements += 1
+            stats.seconds += seconds
+
+    def record_error(self, engine: str):
+        with self._lock:
+            self._engines[engine].errors += 1
+
+    def add_engine(self, name: str):
+        with self._lock:
+            self._engines.setdefault(name, EngineStats())
+
+    def render(self) -> str:
+        with self._lock:
+            lines = []
+            _header(lines, "http_requests_total", "counter", "HTTP responses by route template and status code")
+            for (method, route), stats in self._routes.items():
+                for status, count in sorted(stats.responses.items()):
+                    lines.append(f'http_requests_total{{method="{method}",route="{_escape(route)}",status="{status}"}} {count}')
+            _header(lines, "http_request_duration_seconds", "histogram", "Request latency until the response body was sent")
+            for (method, route), stats in self._routes.items():
+                _histogram(lines, "http_request_duration_seconds", f'method="{method}",route="{_escape(route)}"', stats.latency)
+            _header(lines, "http_request_sql_statements", "histogram", "SQL statements executed per request")
+            for (method, route), stats in self._routes.items():
+                _histogram(lines, "http_request_sql_statements", f'method="{method}",route="{_escape(route)}"', stats.statements)
+            _header(lines, "http_request_sql_seconds_total", "counter", "Time spent executing SQL statements of requests")
+            for (method, route), stats in self._routes.items():
+                lines.append(f'http_request_sql_seconds_total{{method="{method}",route="{_escape(route)}"}} {_number(stats.db_seconds)}')
+            _header(lines, "http_request_sql_rows_total", "counter", "Rows returned or affected by SQL statements of requests")
+            for (method, route), stats in self._routes.items():
+                lines.append(f'http_request_sql_rows_total{{method="{method}",route="{_escape(route)}"}} {stats.rows}')
+
+            _header(lines, "sql_statements_total", "counter", "SQL statements executed per engine (requests and background work)")
+            for name, stats in self._engines.items():
+                lines.append(f'sql_statements_total{{engine="{name}"}} {stats.statements}')
+            _header(lines, "sql_seconds_total", "counter", "Time spent executing SQL statements per engine")
+            for name, stats in self._engines.items():
+                lines.append(f'sql_seconds_total{{engine="{name}"}} {_number(stats.seconds)}')
+            _header(lines, "sql_errors_total", "counter", "SQL statements that raised per engine")
+            for name, stats in self._engines.items():
+                lines.append(f'sql_errors_total{{engine="{name}"}} {stats.errors}')
+
+        _render_pools(lines)
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+def current_request() -> Optional[RequestMetrics]:
+    """SQL counters of the request being served (None outside a request)"""
+    return _current.get()
+
+def instrument_engine(engine: Engine, name: str):
+    """Count the statements of engine (name = the engine label, as in pool_metrics)"""
+    registry.add_engine(name)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["metrics_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info.pop("metrics_started", time.perf_counter())
+        registry.record_statement(name, seconds)
+        request = _current.get()
+        if request is not None:
+            request.statements += 1
+            request.db_seconds += seconds
+            if cursor.rowcount > 0:
+                request.rows += cursor.rowcount
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        registry.record_error(name)
+        request = _current.get()
+        if request is not None:
+            request.statements += 1
+            started = context.connection.info.pop("metrics_started", None) if context.connection is not None else None
+            if started is not None:
+                request.db_seconds += time.perf_counter() - started
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (no BaseHTTPMiddleware: streaming responses pass through untouched)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request = RequestMetrics()
+        token = _current.set(request)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            registry.record_request(
+                scope["method"],
+                route_template(scope),
+                status,
+                time.perf_counter() - started,
+                request
+            )
+
+def route_template(scope) -> str:
+    """
+    Path template of the route that served scope, with the prefixes it was
+    included under (FastAPI versions that include routers without copying their
+    routes leave the prefix out of route.path: it is recovered from the path)
+    """
+    route = scope.get("route")
+    template = getattr(route, "path_format", None) or getattr(route, "path", None)
+    if not template:
+        return UNMATCHED_ROUTE
+    path = scope.get("path", "")
+    concrete = template
+    for name, value in scope.get("path_params", {}).items():
+        concrete = concrete.replace("{" + name + "}", str(value))
+    if path != concrete and path.endswith(concrete):
+        return path[:-len(concrete)] + template
+    return template
+
+def render() -> str:
+    return registry.render()
+
+def _render_pools(lines: List[str]):
+    pools = pool_metrics.report()["pools"]
+    _header(lines, "db_pool_checked_out", "gauge", "Connections checked out of the pool")
+    for name, data in pools.items():
+        lines.append(f'db_pool_checked_out{{pool="{name}"}} {data["pool"]["checked_out"] or 0}')
+    _header(lines, "db_pool_overflow", "gauge", "Overflow connections open beyond the pool size")
+    for name, data in pools.items():
+        lines.append(f'db_pool_overflow{{pool="{name}"}} {max(data["pool"]["overflow"] or 0, 0)}')
+    _header(lines, "db_pool_timeouts_total", "counter", "Checkouts that gave up after DB_POOL_TIMEOUT")
+    for name, data in pools.items():
+        lines.append(f'db_pool_timeouts_total{{pool="{name}"}} {data["timeouts"]}')
+    _header(lines, "db_pool_checkout_wait_seconds", "histogram", "Time spent waiting for a connection")
+    for name, data in pools.items():
+        wait = data["wait_ms"]
+        for bound, cumulative in wait["buckets"].items():
+            le = bound if bound == "+Inf" else _number(float(bound) / 1000)
+            lines.append(f'db_pool_checkout_wait_seconds_bucket{{pool="{name}",le="{le}"}} {cumulative}')
+        lines.append(f'db_pool_checkout_wait_seconds_sum{{pool="{name}"}} {_number(wait["sum"] / 1000)}')
+        lines.append(f'db_pool_checkout_wait_seconds_count{{pool="{name}"}} {wait["count"]}')
+
+def _header(lines: List[str], name: str, kind: str, help_text: str):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+def _histogram(lines: List[str], name: str, labels: str, histogram: Histogram):
+    cumulative = 0
+    for bound, count in zip(list(histogram.bounds) + ["+Inf"], histogram.buckets):
+        cumulative += count
+        le = bound if bound == "+Inf" else _number(bound)
+        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {_number(histogram.sum)}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+def _number(value: float) -> str:
+    return repr(float(value))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
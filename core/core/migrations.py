@@ -0,0 +1,111 @@
+"""
+Versioned schema migrations
+
+Each migration runs once, in version order, and is recorded in schema_migrations.
+On PostgreSQL a session advisory lock serialises concurrent starts (several
+uvicorn workers booting at once), so only one process applies pending versions.
+
+Migrations with transactional=False run in autocommit mode, which is required
+for statements such as CREATE INDEX CONCURRENTLY. They must be idempotent
+(IF NOT EXISTS) since a failure part way through cannot be rolled back.
+"""
+import logging
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex, Index
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary constant shared by every process running migrations
+MIGRATION_LOCK_KEY = 727_001
+
+_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+    transactional: bool = True
+
+def run_migrations(engine: Engine, migrations: List[Migration]) -> List[int]:
+    """Apply pending migrations; returns the versions applied by this call"""
+    applied_now = []
+    is_postgres = engine.dialect.name == "postgresql"
+
+    with engine.connect() as lock_conn:
+        if is_postgres:
+            lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            lock_conn.commit()
+        try:
+            with engine.begin() as conn:
+                schema_migrations.create(conn, checkfirst=True)
+                applied = set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+            for migration in sorted(migrations, key=lambda m: m.version):
+                if migration.version in applied:
+                    continue
+                logger.info("Applying migration %s_%s", migration.version, migration.name)
+                if migration.transactional:
+                    with engine.begin() as conn:
+                        migration.upgrade(conn)
+                        _record(conn, migration)
+                else:
+                    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                        migration.upgrade(conn)
+                        _record(conn, migration)
+                applied_now.append(migration.version)
+        finally:
+            if is_postgres:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+                lock_conn.commit()
+
+    return applied_now
+
+def create_index_online(conn: Connection, index: Index):
+    """
+    Create a declared index if missing, without blocking writes on PostgreSQL
+    (CREATE INDEX CONCURRENTLY). Needs an autocommit connection there.
+    An INVALID index left behind by an interrupted concurrent build is dropped first.
+    """
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect))
+    if conn.dialect.name == "postgresql":
+        is_valid = conn.execute(
+            text(
+                "SELECT i.indisvalid FROM pg_index i "
+                "JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = :name"
+            ),
+            {"name": index.name}
+        ).scalar()
+        if is_valid is False:
+            conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"')
+        ddl = ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+    conn.exec_driver_sql(ddl)
+
+def drop_index_online(conn: Connection, name: str):
+    """
+    Drop an index if present, without blocking reads or writes on PostgreSQL
+    (DROP INDEX CONCURRENTLY). Needs an autocommit connection there.
+    """
+    concurrently = " CONCURRENTLY" if conn.dialect.name == "postgresql" else ""
+    conn.exec_driver_sql(f'DROP INDEX{concurrently} IF EXISTS "{name}"')
+
+def _record(conn: Connection, migration: Migration):
+    conn.execute(
+        schema_migrations.insert().values(
+            version=migration.version,
+            name=migration.name,
+            applied_at=datetime.utcnow()
+        )
+    )
@@ -0,0 +1,119 @@
+"""
+N+1 query detector (development aid, NPLUSONE_DETECT)
+
+A lazy load inside a loop (a response model walking grid.cells without a
+selectinload) runs the same SQL text once per parent object, only the bound
+parameters differ. While a request is served its statements are counted by
+text; when one runs NPLUSONE_THRESHOLD times or more the request is logged as
+an N+1 suspect with its route, the statement, the repeat count and the
+application line that issued the first repeat:
+
+    N+1 suspect in GET /v1/api/grid/{grid_id} (27 statements):
+      25x SELECT products.id, ... WHERE %(param_1)s = products.cell_id (first repeat at grid_management/router.py:88 in get_grid)
+
+Detection keeps every statement text of the request and walks the stack on
+repeats, so it follows DEBUG by default and is meant for development and
+staging. core.core.testing turns the same counting into query budget
+assertions for tests.
+"""
+import logging
+import os
+import sys
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .config import settings
+from .metrics import route_template
+
+logger = logging.getLogger(__name__)
+
+# Frames of these directories are skipped when locating the code that issued a statement
+_SKIPPED_DIRS = tuple({
+    os.path.dirname(os.path.dirname(sqlalchemy.__file__)),  # site-packages
+    os.path.dirname(os.__file__),                           # standard library
+    os.path.dirname(__file__),                              # core.core plumbing (sessions, this detector, testing)
+})
+
+class StatementLog:
+    """Statements executed in a scope (a request, a test block), counted by SQL text"""
+
+    def __init__(self, locate: bool = True):
+        self.locate = locate
+        self.counts: Counter = Counter()
+        self.origins: Dict[str, str] = {}
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def record(self, statement: str):
+        self.counts[statement] += 1
+        if self.locate and self.counts[statement] == 2:
+            self.origins[statement] = caller()
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """(statement, count) of statements executed threshold times or more, most repeated first"""
+        return [(statement, count) for statement, count in self.counts.most_common() if count >= threshold]
+
+    def describe(self, threshold: int = 2, width: int = 200) -> str:
+        """Repeated statements, one per line (for log and assertion messages)"""
+        return "\n".join(
+            f"  {count}x {_shorten(statement, width)}"
+            + (f" (first repeat at {self.origins[statement]})" if statement in self.origins else "")
+            for statement, count in self.repeated(threshold)
+        )
+
+_current: ContextVar[Optional[StatementLog]] = ContextVar("nplusone_statements", default=None)
+
+def enabled() -> bool:
+    return settings.DEBUG if settings.NPLUSONE_DETECT is None else settings.NPLUSONE_DETECT
+
+def instrument_engine(engine: Engine):
+    """Feed the statements of engine to the request being served"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        log = _current.get()
+        if log is not None:
+            log.record(statement)
+
+class NPlusOneMiddleware:
+    """Logs requests that repeated an identical statement NPLUSONE_THRESHOLD times or more"""
+
+    def __init__(self, app, threshold: Optional[int] = None):
+        self.app = app
+        self.threshold = threshold or settings.NPLUSONE_THRESHOLD
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        log = StatementLog()
+        token = _current.set(log)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            if log.repeated(self.threshold):
+                logger.warning(
+                    "N+1 suspect in %s %s (%d statements):\n%s",
+                    scope["method"], route_template(scope), log.total, log.describe(self.threshold)
+                )
+
+def caller() -> str:
+    """file:line in function of the innermost application frame on the stack"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.startswith(_SKIPPED_DIRS) and not filename.startswith("<"):
+            return f"{os.path.relpath(filename)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+def _shorten(statement: str, width: int) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= width else statement[:width - 3] + "..."
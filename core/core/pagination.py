@@ -0,0 +1,121 @@
+"""
+Keyset (cursor) pagination and NDJSON streaming for list endpoints
+
+keyset_page() orders a select() by a unique key, e.g. (created_at, id), and
+continues strictly after the last row of the previous page. Deep pages cost
+the same as the first one, because the database seeks into the index instead
+of skipping OFFSET rows. The cursor is an opaque url-safe token holding the
+key of that last row.
+
+stream_ndjson() walks the same keyset in batches, each batch a short query in
+a fresh session, and writes one JSON object per line, so memory stays flat no
+matter how many rows match. No transaction or cursor stays open while the
+client reads.
+"""
+import base64
+import json
+from datetime import date, datetime
+from typing import Any, List, Optional, Sequence, Type
+
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import BigInteger, Integer, Select, SmallInteger, tuple_
+
+from .database import AsyncSessionLocal
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+STREAM_BATCH_SIZE = 500
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    payload = [value.isoformat() if isinstance(value, (datetime, date)) else value for value in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, columns: Sequence) -> List[Any]:
+    """Key values of the cursor, converted back to the columns' Python types"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise InvalidCursor("Invalid cursor")
+
+    try:
+        return [_key_value(column, value) for column, value in zip(columns, values)]
+    except (ValueError, TypeError, OverflowError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+
+def _key_value(column, value) -> Any:
+    """value as the column's Python type; raises ValueError/TypeError when it cannot be one"""
+    if value is None or isinstance(value, (bool, dict, list)):
+        raise TypeError(f"{value!r} is not a key value")
+    python_type = column.type.python_type
+    if python_type in (datetime, date):
+        return python_type.fromisoformat(value)
+    value = python_type(value)
+    if isinstance(column.type, Integer):
+        # Out of the column's range: the database would reject the comparison
+        bits = 16 if isinstance(column.type, SmallInteger) else 64 if isinstance(column.type, BigInteger) else 32
+        if not -2 ** (bits - 1) <= value < 2 ** (bits - 1):
+            raise OverflowError(f"{value} is out of range")
+    return value
+
+def keyset_page(
+    statement: Select,
+    columns: Sequence,
+    cursor: Optional[str] = None,
+    descending: bool = False
+) -> Select:
+    """
+    Order statement by columns (last one must be unique, e.g. the primary key)
+    and keep only rows after the cursor. Key columns must be NOT NULL.
+    Raises InvalidCursor for a malformed cursor.
+    """
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        key = tuple_(*columns)
+        statement = statement.where(key < tuple_(*values) if descending else key > tuple_(*values))
+    return statement.order_by(*[column.desc() if descending else column.asc() for column in columns])
+
+def next_cursor(items: Sequence, columns: Sequence, limit: Optional[int]) -> Optional[str]:
+    """Cursor after the last item of a full page (None when this was the last page)"""
+    if not limit or len(items) < limit:
+        return None
+    last = items[-1]
+    return encode_cursor([getattr(last, column.key) for column in columns])
+
+def stream_ndjson(
+    statement: Select,
+    columns: Sequence,
+    schema: Type[BaseModel],
+    cursor: Optional[str] = None,
+    descending: bool = False,
+    batch_size: Optional[int] = None
+) -> StreamingResponse:
+    """
+    Stream the ORM rows of statement after cursor as NDJSON, serialized with
+    schema: keyset pages of batch_size rows (default STREAM_BATCH_SIZE), each
+    read by its own session, so at most one batch is held at a time.
+    Validate the cursor first (keyset_page): the stream has already started
+    when the first batch is read.
+    """
+    batch_size = batch_size or STREAM_BATCH_SIZE
+
+    async def lines():
+        following = cursor
+        while True:
+            async with AsyncSessionLocal() as db:
+                page = keyset_page(statement, columns, following, descending=descending).limit(batch_size)
+                items = (await db.execute(page)).scalars().all()
+                chunk = "".join(schema.model_validate(item).model_dump_json() + "\n" for item in items)
+            if chunk:
+                yield chunk
+            following = next_cursor(items, columns, batch_size)
+            if following is None:
+                return
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,150 @@
+"""
+Connection pool telemetry (per worker process)
+
+- Checkout wait time and timeouts are measured around the pool's internal
+  _do_get via a pool subclass (SQLAlchemy has no "waiting for a connection" event)
+- Checkouts, checkins, new connections and invalidations come from pool events
+- Live checked-out / overflow numbers are read from the pool itself
+
+Exposed by GET /v1/internal/pool to size pools against uvicorn worker counts.
+"""
+import os
+import threading
+import time
+from typing import Dict
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+
+# Upper bounds (ms) of the checkout wait histogram buckets
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+class PoolStats:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.wait_count = 0
+        self.wait_sum_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.timeouts = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.invalidations = 0
+
+    def observe_wait(self, seconds: float):
+        wait_ms = seconds * 1000
+        bucket = len(WAIT_BUCKETS_MS)
+        for index, bound in enumerate(WAIT_BUCKETS_MS):
+            if wait_ms <= bound:
+                bucket = index
+                break
+        with self._lock:
+            self.wait_buckets[bucket] += 1
+            self.wait_count += 1
+            self.wait_sum_ms += wait_ms
+            if wait_ms > self.wait_max_ms:
+                self.wait_max_ms = wait_ms
+
+    def record_timeout(self, seconds: float):
+        with self._lock:
+            self.timeouts += 1
+        self.observe_wait(seconds)
+
+    def count(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def snapshot(self, pool) -> dict:
+        with self._lock:
+            buckets = list(self.wait_buckets)
+            wait_count = self.wait_count
+            wait_sum_ms = self.wait_sum_ms
+            data = {
+                "timeouts": self.timeouts,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+            }
+            wait_max_ms = self.wait_max_ms
+
+        cumulative = 0
+        histogram = {}
+        for bound, bucket_count in zip(list(WAIT_BUCKETS_MS) + ["+Inf"], buckets):
+            cumulative += bucket_count
+            histogram[str(bound)] = cumulative
+
+        return {
+            "pool": {
+                "size": _call(pool, "size"),
+                "checked_in": _call(pool, "checkedin"),
+                "checked_out": _call(pool, "checkedout"),
+                "overflow": _call(pool, "overflow"),
+                "max_overflow": getattr(pool, "_max_overflow", None),
+                "timeout": _call(pool, "timeout"),
+            },
+            **data,
+            "wait_ms": {
+                "count": wait_count,
+                "sum": round(wait_sum_ms, 3),
+                "max": round(wait_max_ms, 3),
+                "avg": round(wait_sum_ms / wait_count, 3) if wait_count else 0,
+                "p95_bucket": _quantile_bucket(buckets, wait_count, 0.95),
+                "p99_bucket": _quantile_bucket(buckets, wait_count, 0.99),
+                "buckets": histogram,
+            },
+        }
+
+class _InstrumentedPoolMixin:
+    stats: PoolStats
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record_timeout(time.perf_counter() - start)
+            raise
+        self.stats.observe_wait(time.perf_counter() - start)
+        return connection
+
+_registry: Dict[str, tuple] = {}
+
+def instrumented_pool_class(base, stats: PoolStats):
+    """Subclass of a queue pool class that times checkouts into stats (survives pool.recreate())"""
+    return type(f"Instrumented{base.__name__}", (_InstrumentedPoolMixin, base), {"stats": stats})
+
+def instrument_engine(engine: Engine, stats: PoolStats):
+    """Register the engine for reporting and attach pool event counters"""
+    _registry[stats.name] = (engine, stats)
+    event.listen(engine, "checkout", lambda *args: stats.count("checkouts"))
+    event.listen(engine, "checkin", lambda *args: stats.count("checkins"))
+    event.listen(engine, "connect", lambda *args: stats.count("connects"))
+    event.listen(engine, "invalidate", lambda *args: stats.count("invalidations"))
+
+def report() -> dict:
+    return {
+        "pid": os.getpid(),
+        "pools": {
+            name: stats.snapshot(engine.pool)
+            for name, (engine, stats) in _registry.items()
+        },
+    }
+
+def _call(pool, method: str):
+    func = getattr(pool, method, None)
+    return func() if callable(func) else None
+
+def _quantile_bucket(buckets, total: int, quantile: float):
+    """Upper bound (ms) of the bucket containing the quantile"""
+    if not total:
+        return None
+    target = total * quantile
+    cumulative = 0
+    for bound, bucket_count in zip(list(WAIT_BUCKETS_MS) + ["+Inf"], buckets):
+        cumulative += bucket_count
+        if cumulative >= target:
+            return bound
+    return "+Inf"
@@ -0,0 +1,356 @@
+"""
+Slow request / slow query log with sampled EXPLAIN plans (SLOW_REQUEST_SECONDS)
+
+Every request keeps a light record of its SQL statements (text and duration).
+A request is logged when it took SLOW_REQUEST_SECONDS or longer, or ran a
+statement that took SLOW_QUERY_SECONDS or longer. The entry holds:
+- the route template, path parameters, query string and the start of the body
+- the status and duration
+- every statement with its duration; slow statements also get their parameters
+Slow statements outside requests (background threads) are logged on their own.
+
+A sample of the slow statements (SLOW_EXPLAIN_SAMPLE_RATE, at most
+SLOW_EXPLAIN_MAX_PER_MINUTE, each SQL text once per minute) is explained
+again by a background thread on its own connection. Plain SELECTs get
+EXPLAIN (ANALYZE, BUFFERS): they run again inside a transaction that is
+rolled back, under SLOW_EXPLAIN_TIMEOUT_SECONDS. Writes, locking reads
+(FOR UPDATE, advisory locks) and other side effects only get EXPLAIN, so
+nothing is written or locked twice. PostgreSQL only.
+
+Entries are JSON lines in SLOW_LOG_FILE:
+    {"type": "request", "id": ..., "route": ..., "duration_ms": ..., "statements": [...]}
+    {"type": "query", ...}      slow statement outside a request
+    {"type": "explain", "request_id": ..., "sql": ..., "plan": [...]}
+The file rotates at SLOW_LOG_MAX_BYTES, keeping SLOW_LOG_BACKUPS files. Every
+worker process appends to the same file; rotation happens under a file lock.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .config import settings
+from .metrics import route_template
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no cross-process rotation lock on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Cut-offs that bound the size of one entry
+MAX_SQL_CHARS = 4000
+MAX_PARAMS_CHARS = 2000
+EXPLAIN_QUEUE_SIZE = 100
+
+_DOLLAR_PARAM = re.compile(r"\$(\d+)")
+# Statements EXPLAIN ANALYZE must not run again: writes, row locks and functions
+# with effects a rollback does not undo (session advisory locks, sequences)
+_SIDE_EFFECTS = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|FOR\s+(NO\s+KEY\s+)?UPDATE|FOR\s+(KEY\s+)?SHARE"
+    r"|pg_(try_)?advisory\w*|pg_notify|pg_sleep|nextval|setval)\b",
+    re.IGNORECASE
+)
+
+class SharedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler for several processes appending to one file: writes
+    and rollovers happen under an flock on <file>.lock, and a process whose
+    file was rotated by another one reopens it first
+    """
+
+    def __init__(self, filename: str, **kwargs):
+        super().__init__(filename, **kwargs)
+        self._lock_file = open(self.baseFilename + ".lock", "a") if fcntl is not None else None
+
+    def emit(self, record):
+        if self._lock_file is None:
+            return super().emit(record)
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            if self.stream is not None and self._rotated():
+                self.stream.close()
+                self.stream = self._open()
+            super().emit(record)
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def close(self):
+        super().close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _rotated(self) -> bool:
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+class _Request:
+    """Statements of the request being served (context variable)"""
+
+    __slots__ = ("id", "statements", "dropped", "sql_seconds", "slow_statements")
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.statements: List[dict] = []
+        self.dropped = 0
+        self.sql_seconds = 0.0
+        self.slow_statements = 0
+
+_current: ContextVar[Optional[_Request]] = ContextVar("slowlog_request", default=None)
+
+class SlowLog:
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue(EXPLAIN_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()       # explain budget of the current minute
+        self._window = 0
+        self._window_explains = 0
+        self._window_statements: set = set()
+        self._engine: Optional[Engine] = None
+        self._output = logging.getLogger("slowlog")
+        self._handler: Optional[logging.Handler] = None
+        self.running = False
+        self.explained = 0
+        self.explain_failures = 0
+
+    def start(self, explain_engine: Optional[Engine] = None):
+        """Open SLOW_LOG_FILE and start the EXPLAIN thread (explain_engine: a psycopg2 engine)"""
+        if self.running or not enabled():
+            return
+        directory = os.path.dirname(settings.SLOW_LOG_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._handler = SharedRotatingFileHandler(
+            settings.SLOW_LOG_FILE,
+            maxBytes=settings.SLOW_LOG_MAX_BYTES,
+            backupCount=settings.SLOW_LOG_BACKUPS,
+            encoding="utf-8"
+        )
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+        self._output.addHandler(self._handler)
+        self._output.setLevel(logging.INFO)
+        self._output.propagate = False
+        if explain_engine is not None and explain_engine.dialect.name == "postgresql" and settings.SLOW_EXPLAIN_SAMPLE_RATE > 0:
+            self._engine = explain_engine
+            self._thread = threading.Thread(target=self._run, name="slowlog-explain", daemon=True)
+            self._thread.start()
+        self.running = True
+
+    def stop(self, timeout: float = 10):
+        """Stop the EXPLAIN thread (queued statements are dropped) and close the file"""
+        if not self.running:
+            return
+        self.running = False
+        if self._thread is not None:
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+        self._output.removeHandler(self._handler)
+        self._handler.close()
+        self._handler = None
+
+    def write(self, entry: dict):
+        if self.running:
+            self._output.info(json.dumps(entry, ensure_ascii=False, default=str))
+
+    def statement(self, statement: str, parameters, paramstyle: str, seconds: float, executemany: bool):
+        """A statement completed (engine hook)"""
+        if not self.running or threading.current_thread() is self._thread:
+            return
+        slow = seconds >= settings.SLOW_QUERY_SECONDS
+        request = _current.get()
+        if request is not None:
+            request.sql_seconds += seconds
+            if len(request.statements) < settings.SLOW_LOG_MAX_STATEMENTS:
+                entry = {"ms": round(seconds * 1000, 3), "sql": statement[:MAX_SQL_CHARS]}
+                if slow:
+                    entry["params"] = _params(parameters)
+                request.statements.append(entry)
+            else:
+                request.dropped += 1
+        if not slow:
+            return
+        if request is not None:
+            request.slow_statements += 1
+        else:
+            self.write({
+                "type": "query",
+                "time": _now(),
+                "duration_ms": round(seconds * 1000, 3),
+                "sql": statement[:MAX_SQL_CHARS],
+                "params": _params(parameters),
+            })
+        if not executemany and self._sample(statement):
+            try:
+                self._queue.put_nowait({
+                    "request_id": request.id if request is not None else None,
+                    "statement": statement,
+                    "parameters": parameters,
+                    "paramstyle": paramstyle,
+                    "duration_ms": round(seconds * 1000, 3),
+                })
+            except queue.Full:
+                pass
+
+    def report(self) -> dict:
+        return {
+            "running": self.running,
+            "explain_queue": self._queue.qsize(),
+            "explained": self.explained,
+            "explain_failures": self.explain_failures,
+        }
+
+    def _sample(self, statement: str) -> bool:
+        if self._thread is None or random.random() >= settings.SLOW_EXPLAIN_SAMPLE_RATE:
+            return False
+        with self._lock:
+            window = int(time.monotonic() // 60)
+            if window != self._window:
+                self._window, self._window_explains, self._window_statements = window, 0, set()
+            if self._window_explains >= settings.SLOW_EXPLAIN_MAX_PER_MINUTE or statement in self._window_statements:
+                return False
+            self._window_explains += 1
+            self._window_statements.add(statement)
+            return True
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                plan = self._explain(job)
+            except Exception as error:
+                self.explain_failures += 1
+                logger.warning("Slow log: EXPLAIN failed: %s", error)
+                continue
+            self.explained += 1
+            self.write({
+                "type": "explain",
+                "time": _now(),
+                "request_id": job["request_id"],
+                "duration_ms": job["duration_ms"],
+                "sql": job["statement"][:MAX_SQL_CHARS],
+                "plan": plan,
+            })
+
+    def _explain(self, job: dict):
+        statement, parameters = job["statement"], job["parameters"]
+        if job["paramstyle"] == "numeric_dollar":
+            # asyncpg ($1, $2) -> psycopg2 (%s)
+            statement, parameters = _to_format(statement, parameters)
+        analyze = statement.lstrip().upper().startswith(("SELECT", "WITH")) and not _SIDE_EFFECTS.search(statement)
+        options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+        with self._engine.connect() as conn:
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(settings.SLOW_EXPLAIN_TIMEOUT_SECONDS * 1000)}")
+            plan = conn.exec_driver_sql(f"EXPLAIN ({options}) {statement}", parameters or ()).scalar()
+            conn.rollback()
+        return json.loads(plan) if isinstance(plan, str) else plan
+
+slow_log = SlowLog()
+
+def enabled() -> bool:
+    return settings.SLOW_REQUEST_SECONDS > 0
+
+def instrument_engine(engine: Engine):
+    """Time the statements of engine for the slow log"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["slowlog_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("slowlog_started", None)
+        if started is not None:
+            slow_log.statement(statement, parameters, conn.dialect.paramstyle, time.perf_counter() - started, executemany)
+
+class SlowLogMiddleware:
+    """Logs requests slower than SLOW_REQUEST_SECONDS or with a slow statement"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not slow_log.running:
+            return await self.app(scope, receive, send)
+
+        request = _Request()
+        token = _current.set(request)
+        body = bytearray()
+        status = 500
+        started = time.perf_counter()
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request" and len(body) < settings.SLOW_LOG_BODY_BYTES:
+                body.extend(message.get("body", b"")[:settings.SLOW_LOG_BODY_BYTES - len(body)])
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            _current.reset(token)
+            seconds = time.perf_counter() - started
+            if seconds >= settings.SLOW_REQUEST_SECONDS or request.slow_statements:
+                slow_log.write({
+                    "type": "request",
+                    "id": request.id,
+                    "time": _now(),
+                    "method": scope["method"],
+                    "route": route_template(scope),
+                    "path": scope["path"],
+                    "path_params": scope.get("path_params", {}),
+                    "query": scope.get("query_string", b"").decode("latin-1"),
+                    "body": body.decode("utf-8", errors="replace"),
+                    "status": status,
+                    "duration_ms": round(seconds * 1000, 3),
+                    "sql_count": len(request.statements) + request.dropped,
+                    "sql_ms": round(request.sql_seconds * 1000, 3),
+                    "statements": request.statements,
+                    "statements_dropped": request.dropped,
+                })
+
+def _to_format(statement: str, parameters):
+    """$n placeholders -> %s (literal % escaped), parameters in placeholder order"""
+    values = list(parameters or ())
+    ordered = []
+
+    def replace(match):
+        ordered.append(values[int(match.group(1)) - 1])
+        return "%s"
+
+    return _DOLLAR_PARAM.sub(replace, statement.replace("%", "%%")), tuple(ordered)
+
+def _params(parameters) -> str:
+    return json.dumps(parameters, ensure_ascii=False, default=str)[:MAX_PARAMS_CHARS]
+
+def _now() -> str:
+    return datetime.utcnow().isoformat(timespec="milliseconds") + "Z"
@@ -0,0 +1,83 @@
+"""
+Query budget assertions for tests
+
+Lazy-load regressions (a handler or response model that lost its
+selectinload) show up as more SQL statements per call, usually the same
+statement repeated per row. These helpers count the statements a block
+executes and fail the test when it exceeds its budget:
+
+    from core.core.testing import assert_max_queries, query_budget
+
+    def test_grid_detail_endpoint(client, grid_id):     # fixtures of tests/
+        assert_max_queries(client, "GET", f"/v1/api/grid/{grid_id}", 3, max_repeats=1)
+
+    def test_get_grid_status(db, grid_id):
+        with query_budget(max_queries=3, max_repeats=1):
+            crud.get_grid_status(db, grid_id)
+
+client (TestClient of the app) and db (a session) come from tests/conftest.py;
+tests/test_query_budgets.py holds the budgets of the grid views.
+
+Statements are counted on the engines themselves (both app engines by
+default), not per request, so TestClient's portal thread is covered; other
+threads using the engines meanwhile (write-behind history flushes, archive
+maintenance) are counted too, so keep them off in tests. Cached views
+(CACHE_BACKEND) may answer without SQL: use CACHE_BACKEND=off or a fresh
+version when a test is about the database path.
+"""
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional, Sequence
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .nplusone import StatementLog
+
+@contextmanager
+def query_budget(
+    max_queries: Optional[int] = None,
+    max_repeats: Optional[int] = None,
+    engines: Optional[Sequence[Engine]] = None
+) -> Iterator[StatementLog]:
+    """
+    Fail (AssertionError) when the block executes more than max_queries SQL
+    statements, or any identical statement more than max_repeats times
+    (max_repeats=1: nothing repeated). Yields the StatementLog of the block.
+    """
+    if engines is None:
+        from .database import async_engine, engine
+
+        engines = (engine, async_engine.sync_engine)
+    log = StatementLog()
+    lock = threading.Lock()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        with lock:
+            log.record(statement)
+
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield log
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", record)
+
+    if max_queries is not None and log.total > max_queries:
+        raise AssertionError(
+            f"Expected at most {max_queries} SQL statements, got {log.total}"
+            + (f"; repeated:\n{log.describe()}" if log.repeated(2) else "")
+        )
+    if max_repeats is not None and log.repeated(max_repeats + 1):
+        raise AssertionError(
+            f"Statements repeated more than {max_repeats}x (N+1 lazy loads?):\n{log.describe(max_repeats + 1)}"
+        )
+
+def assert_max_queries(client, method: str, url: str, max_queries: int, max_repeats: Optional[int] = None, **kwargs):
+    """
+    client.request(method, url, **kwargs) within query_budget(max_queries, max_repeats);
+    returns the response (client: a TestClient or any client calling the app in this process)
+    """
+    with query_budget(max_queries, max_repeats):
+        return client.request(method, url, **kwargs)
@@ -8,11 +8,13 @@ setup(
         "fastapi>=0.68.0",
         "pydantic>=2.0.0",
         "pydantic-settings>=2.0.0",
-        "SQLAlchemy>=1.4.0",
+        "SQLAlchemy>=2.0.0",
         "python-jose[cryptography]>=3.3.0",
         "passlib[bcrypt]>=1.7.4",
         "python-dotenv>=0.19.0",
         "psycopg2-binary>=2.9.0",
+        "asyncpg>=0.27.0",
+        "greenlet>=2.0.0",
         "uvicorn>=0.15.0",
         "python-multipart>=0.0.5"
     ],
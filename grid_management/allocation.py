@@ -0,0 +1,122 @@
+"""
+Empty-cell allocation strategies
+
+When an order gets its first product, the occupancy index asks the configured
+strategy (ALLOCATION_STRATEGY) which free cell to take. The index keeps free
+cells in pools - one per grid and cell kind - ordered by the strategy's
+cell_key(), and the strategy ranks the pools by their best cell:
+- fill_grid_first: lowest grid id first, row by row (A1, A2, ..., B1...) - the original policy
+- nearest_station: the free cell with the shortest walk from the packing station
+- balance_grids: the grid with the largest share of free cells
+- reserve_large: orders of ALLOCATION_LARGE_ORDER_TOTAL or more products get
+  large cells (the first ALLOCATION_LARGE_CELL_ROWS rows of each grid, e.g. the
+  floor-level shelf); smaller orders only use them when no regular cell is left
+
+Strategies never touch the database, so tools/simulate_allocation.py can
+replay scan logs against each of them with the same occupancy index.
+"""
+from typing import Dict, NamedTuple, Optional, Type
+
+from core.core.config import settings
+
+REGULAR = "regular"
+LARGE = "large"
+
+class FreePool(NamedTuple):
+    grid_id: int
+    grid_rank: int      # position of the grid among active grids (grid id order)
+    kind: str           # REGULAR / LARGE
+    top: tuple          # cell_key() of the best free cell of the pool
+    free: int           # free cells in the pool
+    cells: int          # all cells of the grid
+
+def walk_distance(
+    grid_rank: int,
+    x: int,
+    y: int,
+    station_x: Optional[int] = None,
+    station_y: Optional[int] = None,
+    grid_spacing: Optional[int] = None
+) -> int:
+    """
+    Walk from the packing station to a cell, in cells. Grids stand side by side
+    in grid id order, grid_spacing cells apart; the station sits at
+    (station_x, station_y) of the first grid.
+    """
+    station_x = settings.ALLOCATION_STATION_X if station_x is None else station_x
+    station_y = settings.ALLOCATION_STATION_Y if station_y is None else station_y
+    grid_spacing = settings.ALLOCATION_GRID_SPACING if grid_spacing is None else grid_spacing
+    return grid_rank * grid_spacing + abs(x - station_x) + abs(y - station_y)
+
+class AllocationStrategy:
+    name = ""
+
+    def cell_kind(self, x: int, y: int) -> str:
+        """Pool of a cell inside its grid"""
+        return REGULAR
+
+    def cell_key(self, x: int, y: int) -> tuple:
+        """Order of the free cells inside a pool (smallest first)"""
+        return (y, x)
+
+    def rank(self, pool: FreePool, total: Optional[int]) -> Optional[tuple]:
+        """Sort key of a pool for an order of total products (smallest wins, None = never)"""
+        raise NotImplementedError
+
+class FillGridFirst(AllocationStrategy):
+    name = "fill_grid_first"
+
+    def rank(self, pool, total):
+        return (pool.grid_rank, pool.top)
+
+class NearestStation(AllocationStrategy):
+    name = "nearest_station"
+
+    def __init__(self, station_x: Optional[int] = None, station_y: Optional[int] = None, grid_spacing: Optional[int] = None):
+        self.station_x = settings.ALLOCATION_STATION_X if station_x is None else station_x
+        self.station_y = settings.ALLOCATION_STATION_Y if station_y is None else station_y
+        self.grid_spacing = settings.ALLOCATION_GRID_SPACING if grid_spacing is None else grid_spacing
+
+    def cell_key(self, x, y):
+        return (walk_distance(0, x, y, self.station_x, self.station_y, 0), y, x)
+
+    def rank(self, pool, total):
+        return (pool.grid_rank * self.grid_spacing + pool.top[0], pool.grid_rank, pool.top)
+
+class BalanceGrids(AllocationStrategy):
+    name = "balance_grids"
+
+    def rank(self, pool, total):
+        return (-pool.free / max(pool.cells, 1), pool.grid_rank, pool.top)
+
+class ReserveLarge(AllocationStrategy):
+    name = "reserve_large"
+
+    def __init__(self, large_order_total: Optional[int] = None, large_cell_rows: Optional[int] = None):
+        self.large_order_total = settings.ALLOCATION_LARGE_ORDER_TOTAL if large_order_total is None else large_order_total
+        self.large_cell_rows = settings.ALLOCATION_LARGE_CELL_ROWS if large_cell_rows is None else large_cell_rows
+
+    def is_large_order(self, total: Optional[int]) -> bool:
+        return total is not None and total >= self.large_order_total
+
+    def cell_kind(self, x, y):
+        return LARGE if y < self.large_cell_rows else REGULAR
+
+    def rank(self, pool, total):
+        preferred = LARGE if self.is_large_order(total) else REGULAR
+        return (pool.kind != preferred, pool.grid_rank, pool.top)
+
+STRATEGIES: Dict[str, Type[AllocationStrategy]] = {
+    strategy.name: strategy
+    for strategy in (FillGridFirst, NearestStation, BalanceGrids, ReserveLarge)
+}
+
+def create_strategy(name: Optional[str] = None) -> AllocationStrategy:
+    """Strategy by name (default ALLOCATION_STRATEGY), configured from settings"""
+    name = name or settings.ALLOCATION_STRATEGY
+    try:
+        return STRATEGIES[name]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown allocation strategy '{name}', expected one of: {', '.join(STRATEGIES)}"
+        ) from None
@@ -0,0 +1,332 @@
+"""
+Shipped products archive (shipped_products)
+
+clear_cell moves a cell's products into the archive instead of serialising
+them as JSON into cell_histories.products_data. On PostgreSQL the move is one
+statement: DELETE FROM products ... RETURNING feeds INSERT INTO
+shipped_products ... SELECT. Archive rows keep the product columns plus where
+and when they shipped, so a product code can be looked up across past
+shipments through ix_shipped_products_product_code.
+
+On PostgreSQL the table is range-partitioned by shipped_at, one partition per
+month (shipped_products_YYYY_MM). run_maintenance():
+- creates the partitions of the current and the next ARCHIVE_PARTITIONS_AHEAD months
+- applies ARCHIVE_RETENTION_DAYS by dropping whole partitions (a month goes
+  once all of it is past the cutoff); other databases delete rows
+- compacts legacy cell_histories.products_data JSON into archive rows
+Every worker runs it in the background (one at a time, advisory lock); it can
+also be run from cron: python -m grid_management.archive
+"""
+import asyncio
+import json
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import DateTime, delete, insert, literal, select, text, update
+from sqlalchemy.orm import Session
+
+from core.core.config import settings
+from core.core.database import SessionLocal, engine
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary constants: partition DDL and maintenance runs are serialised across workers
+PARTITION_LOCK_KEY = 727_003
+MAINTENANCE_LOCK_KEY = 727_004
+
+# Legacy archive rows have no products.id: product_id = -(history_id * LEGACY_ID_STRIDE + position)
+LEGACY_ID_STRIDE = 100_000
+
+PRODUCT_COLUMNS = (
+    "product_code",
+    "size",
+    "color",
+    "qr_data",
+    "number",
+    "total",
+    "production_area",
+    "size_code",
+    "order_number",
+    "product_number",
+    "order_date",
+)
+
+# Partitions this process has seen committed (skips the catalog lookup on every clear)
+_ready_partitions: Set[str] = set()
+_legacy_compacted = False
+_maintenance_task: Optional[asyncio.Task] = None
+
+def month_start(moment) -> date:
+    return date(moment.year, moment.month, 1)
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"shipped_products_{month.year:04d}_{month.month:02d}"
+
+def ensure_partition(db, moment: datetime) -> bool:
+    """
+    Create the monthly partition holding moment if it is missing, as part of
+    the caller's transaction (PostgreSQL only). db is a Session or Connection.
+    Returns True when the partition was created.
+    """
+    if _dialect_name(db) != "postgresql":
+        return False
+    month = month_start(moment)
+    name = partition_name(month)
+    if name in _ready_partitions:
+        return False
+    if db.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+        _ready_partitions.add(name)
+        return False
+    # Two workers creating the same partition at once would collide in the catalog
+    db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+    db.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF shipped_products '
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    ))
+    return True
+
+def create_upcoming_partitions(db, now: datetime) -> List[str]:
+    """Partitions for the current month and ARCHIVE_PARTITIONS_AHEAD months after it"""
+    created = []
+    for offset in range(settings.ARCHIVE_PARTITIONS_AHEAD + 1):
+        month = add_months(month_start(now), offset)
+        if ensure_partition(db, datetime.combine(month, time())):
+            created.append(partition_name(month))
+    return created
+
+def move_cell_products(db: Session, cell_ids: Iterable[int], shipped_at: datetime) -> Dict[int, List[str]]:
+    """
+    Move every product of the given cells into shipped_products.
+    Must run before the cells are reset: grid_id and full_order_key are read
+    from grid_cells. Returns the moved product codes per cell.
+    """
+    cell_ids = list(cell_ids)
+    products = models.Product.__table__
+    cells = models.GridCell.__table__
+    archive = models.ShippedProduct.__table__
+    on_postgres = _dialect_name(db) == "postgresql"
+    ensure_partition(db, shipped_at)
+
+    if on_postgres:
+        source = delete(products).where(products.c.cell_id.in_(cell_ids)).returning(*products.c).cte("moved")
+    else:
+        source = products
+    rows = select(
+        source.c.id,
+        literal(shipped_at, DateTime),
+        source.c.cell_id,
+        cells.c.grid_id,
+        cells.c.current_full_order_key,
+        *[source.c[name] for name in PRODUCT_COLUMNS],
+        source.c.created_at
+    ).join(cells, cells.c.id == source.c.cell_id)
+    if not on_postgres:
+        rows = rows.where(source.c.cell_id.in_(cell_ids))
+
+    statement = insert(archive).from_select(
+        ["product_id", "shipped_at", "cell_id", "grid_id", "full_order_key", *PRODUCT_COLUMNS, "scanned_at"],
+        rows
+    ).returning(archive.c.cell_id, archive.c.product_code)
+    if on_postgres:
+        # The data-modifying CTE must sit at the top level of the INSERT
+        statement = statement.add_cte(source)
+    moved = db.execute(statement).all()
+    if not on_postgres:
+        db.execute(delete(products).where(products.c.cell_id.in_(cell_ids)))
+
+    codes: Dict[int, List[str]] = {cell_id: [] for cell_id in cell_ids}
+    for cell_id, product_code in moved:
+        codes[cell_id].append(product_code)
+    return codes
+
+def run_maintenance(now: Optional[datetime] = None) -> dict:
+    """Partitions ahead, retention and legacy compaction; skipped while another process runs it"""
+    global _legacy_compacted
+    now = now or datetime.utcnow()
+    report = {
+        "skipped": False,
+        "partitions_created": [],
+        "partitions_dropped": [],
+        "rows_deleted": 0,
+        "histories_compacted": 0,
+        "products_compacted": 0,
+    }
+    is_postgres = engine.dialect.name == "postgresql"
+
+    with engine.connect() as lock_conn:
+        if is_postgres:
+            locked = lock_conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY}).scalar()
+            lock_conn.commit()
+            if not locked:
+                report["skipped"] = True
+                return report
+        try:
+            with SessionLocal() as db:
+                report["partitions_created"] = create_upcoming_partitions(db, now)
+                db.commit()
+                _apply_retention(db, now, report)
+                db.commit()
+                if not _legacy_compacted:
+                    _compact_legacy_histories(db, now, report)
+                    _legacy_compacted = True
+        finally:
+            if is_postgres:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+                lock_conn.commit()
+
+    return report
+
+def start_maintenance():
+    """Run maintenance now and every ARCHIVE_MAINTENANCE_INTERVAL_SECONDS (app lifespan)"""
+    global _maintenance_task
+    if settings.ARCHIVE_MAINTENANCE_INTERVAL_SECONDS > 0 and _maintenance_task is None:
+        _maintenance_task = asyncio.create_task(_maintenance_loop())
+
+async def stop_maintenance():
+    global _maintenance_task
+    if _maintenance_task is not None:
+        _maintenance_task.cancel()
+        try:
+            await _maintenance_task
+        except asyncio.CancelledError:
+            pass
+        _maintenance_task = None
+
+async def _maintenance_loop():
+    while True:
+        try:
+            report = await asyncio.to_thread(run_maintenance)
+            if report["partitions_created"] or report["partitions_dropped"] or report["rows_deleted"] or report["histories_compacted"]:
+                logger.info("Archive maintenance: %s", report)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Archive maintenance failed")
+        await asyncio.sleep(settings.ARCHIVE_MAINTENANCE_INTERVAL_SECONDS)
+
+def _apply_retention(db: Session, now: datetime, report: dict):
+    if settings.ARCHIVE_RETENTION_DAYS <= 0:
+        return
+    cutoff = now - timedelta(days=settings.ARCHIVE_RETENTION_DAYS)
+    if _dialect_name(db) != "postgresql":
+        report["rows_deleted"] = db.execute(
+            delete(models.ShippedProduct).where(models.ShippedProduct.shipped_at < cutoff)
+        ).rowcount
+        return
+
+    names = db.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'shipped_products'"
+    )).scalars().all()
+    for name in sorted(names):
+        try:
+            year, month = name.rsplit("_", 2)[-2:]
+            upper = add_months(date(int(year), int(month), 1), 1)
+        except ValueError:
+            # Not one of ours (e.g. attached by hand): leave it alone
+            continue
+        if datetime.combine(upper, time()) <= cutoff:
+            db.execute(text(f'DROP TABLE IF EXISTS "{name}"'))
+            _ready_partitions.discard(name)
+            report["partitions_dropped"].append(name)
+
+def _compact_legacy_histories(db: Session, now: datetime, report: dict):
+    """Convert cell_histories.products_data JSON (written before the archive existed) into archive rows"""
+    history = models.CellHistory
+    cutoff = now - timedelta(days=settings.ARCHIVE_RETENTION_DAYS) if settings.ARCHIVE_RETENTION_DAYS > 0 else None
+    last_id = 0
+    while True:
+        batch = db.execute(
+            select(
+                history.id,
+                history.cell_id,
+                history.order_date,
+                history.products_data,
+                history.created_at,
+                models.GridCell.grid_id
+            )
+            .outerjoin(models.GridCell, models.GridCell.id == history.cell_id)
+            .where(history.id > last_id, history.products_data.isnot(None))
+            .order_by(history.id)
+            .limit(settings.ARCHIVE_COMPACTION_BATCH)
+        ).all()
+        if not batch:
+            return
+        last_id = batch[-1].id
+
+        rows, compacted = [], []
+        for entry in batch:
+            try:
+                items = json.loads(entry.products_data)
+            except ValueError:
+                logger.warning("Cell history %s: unreadable products_data, left as is", entry.id)
+                continue
+            compacted.append(entry.id)
+            # Past retention: the archive would drop these rows anyway
+            if cutoff is None or entry.created_at >= cutoff:
+                rows.extend(_legacy_rows(entry, items))
+
+        for month in {month_start(row["shipped_at"]) for row in rows}:
+            ensure_partition(db, datetime.combine(month, time()))
+        if rows:
+            db.execute(insert(models.ShippedProduct.__table__), rows)
+        if compacted:
+            db.execute(update(history).where(history.id.in_(compacted)).values(products_data=None))
+        db.commit()
+        report["histories_compacted"] += len(compacted)
+        report["products_compacted"] += len(rows)
+
+def _legacy_rows(entry, items) -> List[dict]:
+    rows = []
+    for position, item in enumerate(items if isinstance(items, list) else []):
+        code = item.get("product_code")
+        if not code:
+            continue
+        parts = code.split("-")
+        parsed = len(parts) == 4
+        order_date = entry.order_date
+        try:
+            scanned_at = datetime.fromisoformat(item["created_at"]) if item.get("created_at") else None
+        except (TypeError, ValueError):
+            scanned_at = None
+        rows.append({
+            "product_id": -(entry.id * LEGACY_ID_STRIDE + position + 1),
+            "shipped_at": entry.created_at,
+            "cell_id": entry.cell_id,
+            "grid_id": entry.grid_id,
+            "full_order_key": f"{parts[0]}-{parts[1]}-{parts[2]}-{order_date}" if parsed and order_date else None,
+            "product_code": code,
+            "size": item.get("size"),
+            "color": item.get("color"),
+            "qr_data": item.get("qr_data"),
+            "number": _int_or_none(item.get("number")),
+            "total": _int_or_none(item.get("total")),
+            "production_area": parts[0] if parsed else None,
+            "size_code": parts[1] if parsed else None,
+            "order_number": parts[2] if parsed else None,
+            "product_number": _int_or_none(parts[3]) if parsed else None,
+            "order_date": order_date,
+            "scanned_at": scanned_at,
+        })
+    return rows
+
+def _int_or_none(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _dialect_name(db) -> str:
+    return db.get_bind().dialect.name if isinstance(db, Session) else db.dialect.name
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(run_maintenance(), indent=2))
@@ -0,0 +1,75 @@
+"""
+Async versions of the crud functions for AsyncSession (asyncpg)
+
+Each function runs the matching sync crud function through AsyncSession.run_sync:
+the business logic stays in one place, while every database round trip is
+awaited on asyncpg instead of blocking a threadpool worker.
+"""
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, models, schemas
+
+# Grid CRUD
+async def create_grid(db: AsyncSession, grid: schemas.GridCreate) -> models.Grid:
+    return await db.run_sync(crud.create_grid, grid)
+
+async def create_grids(db: AsyncSession, grids: List[schemas.GridCreate]) -> List[models.Grid]:
+    return await db.run_sync(crud.create_grids, grids)
+
+async def get_grid(db: AsyncSession, grid_id: int) -> Optional[models.Grid]:
+    return await db.run_sync(crud.get_grid, grid_id)
+
+async def get_grids(db: AsyncSession, skip: int = 0, limit: int = 100) -> List[models.Grid]:
+    return await db.run_sync(crud.get_grids, skip, limit)
+
+async def get_grid_with_cells(db: AsyncSession, grid_id: int) -> Optional[models.Grid]:
+    return await db.run_sync(crud.get_grid_with_cells, grid_id)
+
+async def update_grid(db: AsyncSession, grid_id: int, grid_update: schemas.GridUpdate) -> dict:
+    return await db.run_sync(crud.update_grid, grid_id, grid_update)
+
+# Product CRUD
+async def check_product_exists(db: AsyncSession, product_code: str) -> bool:
+    return await db.run_sync(crud.check_product_exists, product_code)
+
+async def assign_product_to_cell(db: AsyncSession, product_input: schemas.ProductInput) -> dict:
+    return await db.run_sync(crud.assign_product_to_cell, product_input)
+
+async def assign_products_bulk(db: AsyncSession, product_inputs: List[schemas.ProductInput]) -> List[dict]:
+    return await db.run_sync(crud.assign_products_bulk, product_inputs)
+
+# Cell CRUD
+async def update_cell_note(db: AsyncSession, cell_id: int, note: Optional[str]) -> bool:
+    return await db.run_sync(crud.update_cell_note, cell_id, note)
+
+async def clear_cells(
+    db: AsyncSession,
+    cell_ids: Optional[List[int]] = None,
+    grid_id: Optional[int] = None,
+    filled_before: Optional[datetime] = None
+) -> Optional[List[dict]]:
+    return await db.run_sync(crud.clear_cells, cell_ids, grid_id, filled_before)
+
+async def update_cell_status(db: AsyncSession, cell_id: int, new_status: str) -> Optional[dict]:
+    return await db.run_sync(crud.update_cell_status, cell_id, new_status)
+
+async def clear_cell(db: AsyncSession, cell_id: int) -> bool:
+    return await db.run_sync(crud.clear_cell, cell_id)
+
+async def get_grid_status(db: AsyncSession, grid_id: int) -> Optional[dict]:
+    return await db.run_sync(crud.get_grid_status, grid_id)
+
+async def get_grid_snapshot(db: AsyncSession, grid_id: int, columns: bool = False) -> Optional[dict]:
+    return await db.run_sync(crud.get_grid_snapshot, grid_id, columns)
+
+async def get_cell_products(db: AsyncSession, cell_id: int) -> Optional[List[models.Product]]:
+    return await db.run_sync(crud.get_cell_products, cell_id)
+
+async def get_shipped_products(db: AsyncSession, product_code: str) -> List[models.ShippedProduct]:
+    return await db.run_sync(crud.get_shipped_products, product_code)
+
+async def get_cell_histories(db: AsyncSession, cell_id: int, limit: Optional[int] = None) -> List[models.CellHistory]:
+    return await db.run_sync(crud.get_cell_histories, cell_id, limit)
@@ -0,0 +1,259 @@
+"""
+Read-through response cache for grid and cell views (CACHE_BACKEND)
+
+GET /{grid_id}, /{grid_id}/snapshot and /cell/{cell_id}/detail are cached as
+serialized JSON under a key that embeds version numbers:
+- ("grid", id): bumped by every change to the grid or one of its cells
+- ("cell", id): bumped by every change to the cell (scan, note, status, clear)
+- ("layout",): bumped by grid-level changes (create, resize, routing), which may
+  add or delete cells
+Crud mutations stage the bumps on the session (bump_cell_version /
+bump_grid_version); they are applied once the transaction commits, so a
+response built from data read before the commit is stored under a key nobody
+asks for afterwards. Entries are never invalidated in place, only orphaned.
+
+The versions also make the ETag: a request whose If-None-Match still matches
+gets 304 from the version lookup alone, without touching the database. The
+ETag also embeds the current CACHE_TTL_SECONDS time bucket, so neither a
+cached body nor a 304 outlives the TTL even if a version bump was missed.
+
+Backends:
+- local (default): per-process LRU bounded by CACHE_MAX_ENTRIES / CACHE_MAX_BYTES.
+  Versions are per process, prefixed with a random epoch so ETags of different
+  workers never collide; other workers' changes arrive as grid events
+  (apply_remote_events). When the listener reconnects (events may have been
+  missed) the process starts a new epoch, which changes every version.
+  CACHE_TTL_SECONDS bounds staleness meanwhile and when history is written behind.
+- redis: a Redis-compatible store (CACHE_REDIS_URL) shared by all workers;
+  versions are counters in one hash, prefixed with an epoch stored in the
+  same hash, so a flushed or evicted store starts a new epoch instead of
+  counting from 0 again; entries expire after CACHE_TTL_SECONDS.
+  Needs the redis package; any client with get/set/hmget/hget/hsetnx/hincrby
+  works (configure()).
+- off: no caching, no ETag.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from core.core.config import settings
+from core.core.database import on_commit, transaction_info
+
+VersionKey = Tuple
+
+LAYOUT: VersionKey = ("layout",)
+
+def grid_version(grid_id: int) -> VersionKey:
+    return ("grid", grid_id)
+
+def cell_version(cell_id: int) -> VersionKey:
+    return ("cell", cell_id)
+
+class LocalBackend:
+    """In-process LRU; versions live in this process only"""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._versions: Dict[VersionKey, int] = {}
+
+    def versions(self, keys: Sequence[VersionKey]) -> List[str]:
+        with self._lock:
+            return [f"{self.epoch}.{self._versions.get(key, 0)}" for key in keys]
+
+    def bump(self, keys: Iterable[VersionKey]):
+        with self._lock:
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+    def reset(self):
+        """New epoch: every version changes and cached entries are dropped (events were missed)"""
+        with self._lock:
+            self.epoch = uuid.uuid4().hex[:8]
+            self._versions.clear()
+            self._entries.clear()
+            self._bytes = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def report(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes}
+
+    def _drop(self, key: str):
+        # Caller holds the lock
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+class RedisBackend:
+    """Redis-compatible store shared by every worker (versions are global counters)"""
+
+    PREFIX = "grid_cache:"
+    VERSIONS = PREFIX + "versions"  # hash: one field per version key, plus EPOCH
+    EPOCH = "epoch"
+
+    def __init__(self, client, ttl: float):
+        self.client = client
+        self.ttl = max(int(ttl), 1)
+
+    def versions(self, keys: Sequence[VersionKey]) -> List[str]:
+        epoch, *values = self.client.hmget(self.VERSIONS, [self.EPOCH, *map(self._version_field, keys)])
+        if epoch is None:
+            # New or flushed/evicted store: the first worker to ask picks the epoch
+            candidate = uuid.uuid4().hex[:8]
+            self.client.hsetnx(self.VERSIONS, self.EPOCH, candidate)
+            epoch = self.client.hget(self.VERSIONS, self.EPOCH) or candidate
+        epoch = _text(epoch)
+        return [f"{epoch}.{_text(value) if value is not None else 0}" for value in values]
+
+    def bump(self, keys: Iterable[VersionKey]):
+        for key in keys:
+            self.client.hincrby(self.VERSIONS, self._version_field(key), 1)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self.PREFIX + key)
+
+    def set(self, key: str, value: bytes):
+        self.client.set(self.PREFIX + key, value, ex=self.ttl)
+
+    def report(self) -> dict:
+        return {}
+
+    def _version_field(self, key: VersionKey) -> str:
+        return ":".join(str(part) for part in key)
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+def create_backend(name: Optional[str] = None):
+    """Backend by name (default CACHE_BACKEND); None = caching off"""
+    name = name or settings.CACHE_BACKEND
+    if name == "off":
+        return None
+    if name == "local":
+        return LocalBackend(settings.CACHE_MAX_ENTRIES, settings.CACHE_MAX_BYTES, settings.CACHE_TTL_SECONDS)
+    if name == "redis":
+        import redis
+
+        return RedisBackend(redis.Redis.from_url(settings.CACHE_REDIS_URL), settings.CACHE_TTL_SECONDS)
+    raise ValueError(f"Unknown cache backend '{name}', expected one of: local, redis, off")
+
+class ResponseCache:
+    def __init__(self):
+        self.backend = None
+        self._configured = False
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def configure(self, backend=None):
+        """Use backend: a backend object, a backend name, or None for CACHE_BACKEND"""
+        self.backend = create_backend(backend) if backend is None or isinstance(backend, str) else backend
+        self._configured = True
+
+    def get_backend(self):
+        if not self._configured:
+            self.configure()
+        return self.backend
+
+    def etag(self, name: str, params: Sequence, version_keys: Sequence[VersionKey]) -> Optional[str]:
+        """Strong ETag of a view at the current versions (None when caching is off)"""
+        backend = self.get_backend()
+        if backend is None:
+            return None
+        versions = backend.versions(version_keys)
+        bucket = int(time.time() // max(backend.ttl, 1))
+        raw = "|".join([name, *map(str, params), *versions, str(bucket)])
+        return '"' + hashlib.blake2b(raw.encode(), digest_size=12).hexdigest() + '"'
+
+    def get(self, etag: str) -> Optional[bytes]:
+        body = self.backend.get(etag)
+        if body is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return body
+
+    def set(self, etag: str, body: bytes):
+        self.backend.set(etag, body)
+
+    def bump(self, keys: Iterable[VersionKey]):
+        backend = self.get_backend()
+        if backend is not None:
+            backend.bump(keys)
+
+    def report(self) -> dict:
+        backend = self.get_backend()
+        return {
+            "backend": type(backend).__name__ if backend is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            **(backend.report() if backend is not None else {}),
+        }
+
+response_cache = ResponseCache()
+
+def bump_cell_version(db: Session, grid_id: int, cell_id: int):
+    """Stage a cell change; its views' versions are bumped when db commits"""
+    _staged(db).update((cell_version(cell_id), grid_version(grid_id)))
+
+def bump_grid_version(db: Session, grid_id: int):
+    """Stage a grid-level change (cells may have been added or deleted)"""
+    _staged(db).update((grid_version(grid_id), LAYOUT))
+
+def _staged(db: Session) -> set:
+    info = transaction_info(db)
+    staged = info.get("cache_versions")
+    if staged is None:
+        staged = info["cache_versions"] = set()
+        on_commit(db, lambda: response_cache.bump(staged))
+    return staged
+
+def apply_remote_events(events: List[dict]):
+    """Changes committed by other workers (grid events listener); shared backends need nothing"""
+    backend = response_cache.get_backend()
+    if not isinstance(backend, LocalBackend):
+        return
+    keys = set()
+    for event in events:
+        if event.get("type") == "resync":
+            # Listening again after a disconnect: events may have been missed
+            backend.reset()
+            return
+        grid_id = event.get("grid_id")
+        if event.get("type") == "cell":
+            keys.update((cell_version(event["cell"]["id"]), grid_version(grid_id)))
+        elif event.get("type") == "grid":
+            keys.update((grid_version(grid_id), LAYOUT))
+    response_cache.bump(keys)
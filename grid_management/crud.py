@@ -1,10 +1,20 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import and_, case, exists, func, insert, select, text, update
 from typing import Optional, List
-import json
+import hashlib
 from datetime import datetime
+from types import SimpleNamespace
 
-from . import models, schemas
+from core.core.database import insert_for, on_commit
+from core.core.pagination import keyset_page
+from . import archive, models, schemas, stats
+from .cache import bump_cell_version, bump_grid_version
+from .dedup import product_codes, stage_code_added, stage_codes_removed
+from .history import history_row, write_histories
+from .events import CELL_STATE_COLUMNS, cell_state, emit_cell_changed, emit_grid_changed
+from .occupancy import occupancy_index, claim_empty_cell, stage_cell, stage_cell_removed
+from .routing import join_keys, routing_table, stage_grid
 
 def parse_product_code(product_code: str) -> dict:
     """
@@ -59,7 +69,8 @@ def log_cell_history(
     new_data: dict = None,
     products_data: str = None,
     product_count: int = None,
-    performed_by: str = "system"
+    performed_by: str = "system",
+    created_at: datetime = None
 ):
     """
     Log ALL activities to cell_histories
@@ -70,52 +81,133 @@ def log_cell_history(
     - note_updated: Note updated
     - cell_cleared: Cell cleared (shipped)
     """
-    history = models.CellHistory(
+    write_histories(db, [history_row(
         cell_id=cell_id,
         action_type=action_type,
         description=description,
         order_code=order_code,
         order_date=order_date,
-        old_data=json.dumps(old_data, ensure_ascii=False) if old_data else None,
-        new_data=json.dumps(new_data, ensure_ascii=False) if new_data else None,
+        old_data=old_data,
+        new_data=new_data,
         products_data=products_data,
         product_count=product_count,
-        performed_by=performed_by
-    )
-    db.add(history)
-    # Don't commit here - main transaction will commit
+        performed_by=performed_by,
+        created_at=created_at
+    )])
+    # Don't commit here - main transaction will commit (or the write-behind writer after it)
 
 # Grid CRUD
+def row_label(y: int) -> str:
+    """Spreadsheet-style row label: 0 -> A, 25 -> Z, 26 -> AA, 701 -> ZZ, 702 -> AAA"""
+    label = ""
+    y += 1
+    while y > 0:
+        y, remainder = divmod(y - 1, 26)
+        label = chr(65 + remainder) + label
+    return label
+
+def cell_name_for(x: int, y: int) -> str:
+    """Cell name: row label + column number (A1, B12, AA3...)"""
+    return f"{row_label(y)}{x + 1}"
+
+def _insert_cells(db: Session, positions: List[tuple]) -> int:
+    """
+    Create empty cells for (grid_id, x, y) positions in bulk instead of one ORM
+    object per cell: on PostgreSQL ONE INSERT ... SELECT FROM unnest() of column
+    arrays, elsewhere a driver-batched multi-row INSERT
+    """
+    if not positions:
+        return 0
+    now = datetime.utcnow()
+    table = models.GridCell.__table__
+    if db.get_bind().dialect.name == "postgresql":
+        rows = db.execute(
+            text(
+                "INSERT INTO grid_cells (grid_id, position_x, position_y, cell_name, "
+                "current_product_count, status, created_at, updated_at) "
+                "SELECT grid_id, x, y, name, 0, 'empty', :now, :now "
+                "FROM unnest(CAST(:grid_ids AS integer[]), CAST(:xs AS integer[]), "
+                "CAST(:ys AS integer[]), CAST(:names AS varchar[])) AS cell(grid_id, x, y, name) "
+                "RETURNING id, grid_id, position_x, position_y"
+            ),
+            {
+                "now": now,
+                "grid_ids": [grid_id for grid_id, _, _ in positions],
+                "xs": [x for _, x, _ in positions],
+                "ys": [y for _, _, y in positions],
+                "names": [cell_name_for(x, y) for _, x, y in positions]
+            }
+        ).all()
+    else:
+        rows = db.execute(
+            insert(table).returning(table.c.id, table.c.grid_id, table.c.position_x, table.c.position_y),
+            [
+                {
+                    "grid_id": grid_id,
+                    "position_x": x,
+                    "position_y": y,
+                    "cell_name": cell_name_for(x, y),
+                    "current_product_count": 0,
+                    "status": "empty",
+                    "created_at": now,
+                    "updated_at": now
+                }
+                for grid_id, x, y in positions
+            ]
+        ).all()
+    for row in rows:
+        stage_cell(db, SimpleNamespace(
+            id=row.id,
+            grid_id=row.grid_id,
+            position_x=row.position_x,
+            position_y=row.position_y,
+            status="empty",
+            current_full_order_key=None
+        ))
+    stats.bump(db, {"cells.total": len(rows), "cells.empty": len(rows)})
+    return len(rows)
+
 def create_grid(db: Session, grid: schemas.GridCreate) -> models.Grid:
     """Create new grid and auto-generate cells"""
-    db_grid = models.Grid(
-        name=grid.name,
-        width=grid.width,
-        height=grid.height,
-        total_cells=grid.width * grid.height
-    )
-    db.add(db_grid)
-    db.flush()  # To get grid.id
-    
-    # Auto-generate cells
-    cells = []
-    for y in range(grid.height):
-        for x in range(grid.width):
-            cell_name = f"{chr(65 + y)}{x + 1}"  # A1, A2, B1, B2...
-            cell = models.GridCell(
-                grid_id=db_grid.id,
-                position_x=x,
-                position_y=y,
-                cell_name=cell_name,
-                current_product_count=0,
-                status="empty"
-            )
-            cells.append(cell)
+    return create_grids(db, [grid])[0]
+
+def create_grids(db: Session, grids: List[schemas.GridCreate]) -> List[models.Grid]:
+    """Create many grids and all their cells in one transaction (bulk inserts)"""
+    now = datetime.utcnow()
+    table = models.Grid.__table__
+    grid_ids = db.execute(
+        insert(table).returning(table.c.id, sort_by_parameter_order=True),
+        [
+            {
+                "name": grid.name,
+                "width": grid.width,
+                "height": grid.height,
+                "total_cells": grid.width * grid.height,
+                "routing_keys": join_keys(grid.routing_keys),
+                "is_active": True,
+                "created_at": now,
+                "updated_at": now
+            }
+            for grid in grids
+        ]
+    ).scalars().all()
     
-    db.add_all(cells)
+    # Auto-generate cells: A1, A2, ..., B1, B2, ...
+    _insert_cells(db, [
+        (grid_id, x, y)
+        for grid_id, grid in zip(grid_ids, grids)
+        for y in range(grid.height)
+        for x in range(grid.width)
+    ])
+    stats.bump(db, {"grids.total": len(grid_ids)})
+    for grid_id, grid in zip(grid_ids, grids):
+        stage_grid(db, grid_id, join_keys(grid.routing_keys))
+        emit_grid_changed(db, grid_id, "grid_created")
+        bump_grid_version(db, grid_id)
     db.commit()
-    db.refresh(db_grid)
-    return db_grid
+    
+    created = {grid.id: grid for grid in db.query(models.Grid).filter(models.Grid.id.in_(grid_ids))}
+    return [created[grid_id] for grid_id in grid_ids]
 
 def get_grid(db: Session, grid_id: int) -> Optional[models.Grid]:
     """Get grid by ID"""
@@ -127,7 +219,9 @@ def get_grids(db: Session, skip: int = 0, limit: int = 100) -> List[models.Grid]
 
 def get_grid_with_cells(db: Session, grid_id: int) -> Optional[models.Grid]:
     """Get grid with all cells and products"""
-    return db.query(models.Grid).filter(models.Grid.id == grid_id).first()
+    return db.query(models.Grid).options(
+        selectinload(models.Grid.cells).selectinload(models.GridCell.products)
+    ).filter(models.Grid.id == grid_id).first()
 
 def update_grid(db: Session, grid_id: int, grid_update: schemas.GridUpdate) -> dict:
     """
@@ -142,6 +236,11 @@ def update_grid(db: Session, grid_id: int, grid_update: schemas.GridUpdate) -> d
     if grid_update.name is not None:
         grid.name = grid_update.name
     
+    # Update routing keys if provided ([] = accept any product)
+    if grid_update.routing_keys is not None:
+        grid.routing_keys = join_keys(grid_update.routing_keys)
+        stage_grid(db, grid.id, grid.routing_keys, grid.is_active)
+    
     # Update size if provided
     if grid_update.width is not None or grid_update.height is not None:
         new_width = grid_update.width if grid_update.width is not None else grid.width
@@ -172,28 +271,21 @@ def update_grid(db: Session, grid_id: int, grid_update: schemas.GridUpdate) -> d
             # Delete cells without products
             for cell in cells_to_delete:
                 db.delete(cell)
+                stage_cell_removed(db, cell.id)
+                stats.bump(db, {"cells.total": -1})
+                stats.bump_transition(db, "cells", cell.status, None)
         
         # If increasing size - create new cells
         if new_width > old_width or new_height > old_height:
-            existing_cells = {(cell.position_x, cell.position_y) for cell in grid.cells}
-            new_cells = []
-            
-            for y in range(new_height):
-                for x in range(new_width):
-                    if (x, y) not in existing_cells:
-                        cell_name = f"{chr(65 + y)}{x + 1}"  # A1, A2, B1, B2...
-                        cell = models.GridCell(
-                            grid_id=grid_id,
-                            position_x=x,
-                            position_y=y,
-                            cell_name=cell_name,
-                            current_product_count=0,
-                            status="empty"
-                        )
-                        new_cells.append(cell)
-            
-            if new_cells:
-                db.add_all(new_cells)
+            existing_cells = set(db.query(models.GridCell.position_x, models.GridCell.position_y).filter(
+                models.GridCell.grid_id == grid_id
+            ).all())
+            _insert_cells(db, [
+                (grid_id, x, y)
+                for y in range(new_height)
+                for x in range(new_width)
+                if (x, y) not in existing_cells
+            ])
         
         # Update grid info
         grid.width = new_width
@@ -201,6 +293,8 @@ def update_grid(db: Session, grid_id: int, grid_update: schemas.GridUpdate) -> d
         grid.total_cells = new_width * new_height
     
     grid.updated_at = datetime.utcnow()
+    emit_grid_changed(db, grid_id, "grid_updated")
+    bump_grid_version(db, grid_id)
     db.commit()
     db.refresh(grid)
     
@@ -212,8 +306,335 @@ def update_grid(db: Session, grid_id: int, grid_update: schemas.GridUpdate) -> d
 
 # Product CRUD
 def check_product_exists(db: Session, product_code: str) -> bool:
-    """Kiểm tra sản phẩm đã tồn tại chưa"""
-    return db.query(models.Product).filter(models.Product.product_code == product_code).first() is not None
+    """
+    Kiểm tra sản phẩm đã tồn tại chưa
+    Trả lời từ bộ lọc trùng lặp (dedup) khi chắc chắn, chỉ truy vấn DB khi chưa chắc
+    """
+    return bool(_stored_product_codes(db, [product_code]))
+
+def _stored_product_codes(db: Session, codes, use_filter: bool = True) -> set:
+    """
+    Codes among codes that are already stored
+    Known answers come from the duplicate pre-check; the rest take one IN query
+    """
+    stored = set()
+    unknown = set()
+    for code in codes:
+        known = product_codes.check(code) if use_filter else None
+        if known:
+            stored.add(code)
+        elif known is None:
+            unknown.add(code)
+    
+    if unknown:
+        for row in db.query(models.Product.product_code).filter(
+            models.Product.product_code.in_(unknown)
+        ).all():
+            stored.add(row.product_code)
+            product_codes.remember(row.product_code)
+    return stored
+
+def _duplicate_result(product_code: str) -> dict:
+    return {
+        "success": False,
+        "message": f"Sản phẩm {product_code} đã tồn tại trong hệ thống",
+        "duplicate": True
+    }
+
+def _parse_scan(product_input: schemas.ProductInput) -> dict:
+    """
+    Parse everything a scan needs before touching the database
+    Raises ValueError on malformed product code / QR data / numbers
+    """
+    product_info = parse_product_code(product_input.productCode)
+    qr_info = parse_qr_data(product_input.qrData)
+    order_code = extract_order_code(product_input.productCode)
+    order_date = qr_info["order_date"]
+    return {
+        "product_info": product_info,
+        "order_code": order_code,
+        "order_date": order_date,
+        "full_order_key": create_full_order_key(order_code, order_date),
+        "number": int(product_input.number),
+        "total": int(product_input.total)
+    }
+
+def _add_product_to_cell(db: Session, target_cell: models.GridCell, product_input: schemas.ProductInput, scan: dict):
+    """Create the product row, update cell counters/status and log history"""
+    product_info = scan["product_info"]
+    order_code = scan["order_code"]
+    order_date = scan["order_date"]
+    
+    # Tạo sản phẩm mới
+    new_product = models.Product(
+        cell_id=target_cell.id,
+        product_code=product_input.productCode,
+        size=product_input.size,
+        color=product_input.color,
+        qr_data=product_input.qrData,
+        number=scan["number"],
+        total=scan["total"],
+        production_area=product_info["production_area"],
+        size_code=product_info["size_code"],
+        order_number=product_info["order_number"],
+        product_number=product_info["product_number"],
+        order_date=order_date
+    )
+    
+    db.add(new_product)
+    
+    # Lưu status cũ để log
+    old_status = target_cell.status
+    old_count = target_cell.current_product_count or 0
+    
+    # Cập nhật thông tin ô
+    target_cell.current_order_code = order_code
+    target_cell.current_order_date = order_date
+    target_cell.current_full_order_key = scan["full_order_key"]
+    target_cell.current_product_count = (target_cell.current_product_count or 0) + 1
+    target_cell.target_product_count = scan["total"]
+    target_cell.updated_at = datetime.utcnow()
+    
+    # Cập nhật trạng thái ô
+    if target_cell.current_product_count >= target_cell.target_product_count:
+        target_cell.status = "full"
+        target_cell.filled_at = datetime.utcnow()
+    else:
+        target_cell.status = "filling"
+    
+    stats.bump(db, {"products.total": 1})
+    stats.bump_transition(db, "cells", old_status, target_cell.status)
+    
+    # Log: Thêm sản phẩm
+    log_cell_history(
+        db=db,
+        cell_id=target_cell.id,
+        action_type="product_added",
+        description=f"Thêm sản phẩm {product_input.productCode} ({product_input.size}/{product_input.color}) vào ô {target_cell.cell_name}",
+        order_code=order_code,
+        order_date=order_date,
+        new_data={
+            "product_code": product_input.productCode,
+            "size": product_input.size,
+            "color": product_input.color,
+            "current_count": target_cell.current_product_count,
+            "target_count": target_cell.target_product_count
+        }
+    )
+    
+    # Log: Đổi status (nếu thay đổi)
+    if old_status != target_cell.status:
+        log_cell_history(
+            db=db,
+            cell_id=target_cell.id,
+            action_type="status_changed",
+            description=f"Ô {target_cell.cell_name} đổi từ '{old_status}' → '{target_cell.status}' (tự động)",
+            order_code=order_code,
+            order_date=order_date,
+            old_data={"status": old_status, "count": old_count},
+            new_data={"status": target_cell.status, "count": target_cell.current_product_count, "filled_at": target_cell.filled_at.isoformat() if target_cell.filled_at else None}
+        )
+    
+    stage_cell(db, target_cell)
+    stage_code_added(db, product_input.productCode)
+    emit_cell_changed(db, target_cell, "product_added", product_code=product_input.productCode)
+    bump_cell_version(db, target_cell.grid_id, target_cell.id)
+
+# Namespace (first key) of the pg_advisory_xact_lock(int, int) locks taken per order
+ORDER_LOCK_NAMESPACE = 727002
+
+def _lock_order_keys(db: Session, full_order_keys):
+    """
+    Serialize allocation per full_order_key across workers (PostgreSQL only)
+    Transaction-scoped advisory locks, taken in sorted order so batches cannot deadlock;
+    released automatically on commit/rollback
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    lock_ids = sorted({_order_lock_id(key) for key in full_order_keys})
+    for lock_id in lock_ids:
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(:namespace, :lock_id)"),
+            {"namespace": ORDER_LOCK_NAMESPACE, "lock_id": lock_id}
+        )
+
+def _order_lock_id(full_order_key: str) -> int:
+    # Stable across processes (unlike hash()); signed 32-bit for the two-key lock form
+    return int.from_bytes(hashlib.blake2b(full_order_key.encode(), digest_size=4).digest(), "big", signed=True)
+
+def _filling_cells_query(db: Session):
+    """Filling cells in active grids, row-locked so concurrent clears/status changes wait"""
+    return db.query(models.GridCell).join(models.Grid).filter(
+        and_(
+            models.Grid.is_active == True,
+            models.GridCell.status == "filling"
+        )
+    ).with_for_update(of=models.GridCell).populate_existing()
+
+def _find_filling_cell(db: Session, full_order_key: str) -> Optional[models.GridCell]:
+    """
+    Cell in an active grid currently filling this order
+    Call with the order's lock held: a miss in the index (possibly behind other
+    workers) is confirmed against the partial index on current_full_order_key
+    """
+    query = _filling_cells_query(db).filter(models.GridCell.current_full_order_key == full_order_key)
+    if occupancy_index.ready:
+        cell_id = occupancy_index.find_filling(full_order_key)
+        if cell_id is not None:
+            cell = query.filter(models.GridCell.id == cell_id).first()
+            if cell:
+                return cell
+            # Index entry is stale (cell changed by another process) - fall through to the query
+    
+    return query.first()
+
+def _claim_empty_cell(db: Session, scan: dict) -> Optional[models.GridCell]:
+    """
+    Empty cell in an active grid for the scanned order, row-locked (FOR UPDATE SKIP LOCKED)
+    Candidate grids come from the routing table (production_area / size_code),
+    most specific routing first. Within them the allocation strategy picks from
+    the occupancy index free lists when available, otherwise the first cell in
+    grid/row/column order is queried.
+    Cells locked by a concurrent transaction are skipped, never double-booked.
+    """
+    product_info = scan["product_info"]
+    levels = routing_table.candidates(product_info["production_area"], product_info["size_code"])
+    for grid_ids in levels if levels is not None else [None]:
+        cell = _claim_empty_cell_in(db, scan["total"], grid_ids)
+        if cell:
+            return cell
+    return None
+
+def _claim_empty_cell_in(db: Session, total: int, grid_ids: Optional[List[int]]) -> Optional[models.GridCell]:
+    """Empty cell among grid_ids (None = every active grid)"""
+    if occupancy_index.ready:
+        while True:
+            cell_id = claim_empty_cell(db, total, grid_ids)
+            if cell_id is None:
+                return None
+            cell = db.query(models.GridCell).filter(
+                and_(
+                    models.GridCell.id == cell_id,
+                    models.GridCell.status == "empty"
+                )
+            ).with_for_update(skip_locked=True).populate_existing().first()
+            if cell:
+                return cell
+            
+            # Locked by another transaction, or no longer empty: record the real state
+            cell = db.get(models.GridCell, cell_id, populate_existing=True)
+            if cell is None:
+                occupancy_index.remove_cell(cell_id)
+            elif cell.status == "empty":
+                # Being claimed elsewhere; back to the free list once this transaction ends
+                on_commit(db, lambda cell_id=cell_id: occupancy_index.release(cell_id))
+            else:
+                occupancy_index.sync_cell(cell.id, cell.grid_id, cell.position_x, cell.position_y, cell.status, cell.current_full_order_key)
+    
+    query = _empty_cells_query(db)
+    if grid_ids is not None:
+        query = query.filter(models.GridCell.grid_id.in_(grid_ids))
+    return query.first()
+
+def _empty_cells_query(db: Session):
+    """Empty cells of active grids in allocation order, skipping rows locked by other transactions"""
+    return db.query(models.GridCell).join(models.Grid).filter(
+        and_(
+            models.Grid.is_active == True,
+            models.GridCell.status == "empty"
+        )
+    ).order_by(
+        models.GridCell.grid_id,
+        models.GridCell.position_y,
+        models.GridCell.position_x
+    ).with_for_update(of=models.GridCell, skip_locked=True)
+
+def _has_active_grid(db: Session) -> bool:
+    if occupancy_index.ready:
+        return occupancy_index.has_grids()
+    return db.query(models.Grid).filter(models.Grid.is_active == True).first() is not None
+
+def _track_order(db: Session, target_cell: models.GridCell, scan: dict):
+    """
+    Create or update order tracking for one received product in ONE statement:
+    INSERT ... ON CONFLICT (full_order_key) DO UPDATE SET received_products = received_products + 1
+    with status/completed_at derived in the same statement, RETURNING the previous status
+    for the counters. The increment is atomic (no lost updates between workers); the
+    previous status is read from the statement snapshot, exact while the order lock is held.
+    """
+    table = models.OrderTracking.__table__
+    now = datetime.utcnow()
+    completed = scan["total"] <= 1
+    on_postgres = db.get_bind().dialect.name == "postgresql"
+    
+    lookup = select(table.c.status).where(table.c.full_order_key == scan["full_order_key"])
+    if not on_postgres:
+        # SQLite evaluates the CTE after the upsert (it would see the new row):
+        # read the previous status first - writers are serialized there anyway
+        prior = db.execute(lookup).first()
+    previous = lookup.cte("previous")
+    
+    insert = insert_for(db)
+    statement = insert(table).values(
+        order_code=scan["order_code"],
+        order_date=scan["order_date"],
+        full_order_key=scan["full_order_key"],
+        total_products=scan["total"],
+        received_products=1,
+        assigned_cell_id=target_cell.id,
+        status="completed" if completed else "filling",
+        completed_at=now if completed else None,
+        created_at=now,
+        updated_at=now
+    )
+    received = table.c.received_products + 1
+    is_complete = received >= table.c.total_products
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.full_order_key],
+        set_={
+            "received_products": received,
+            "status": case((is_complete, "completed"), else_="filling"),
+            "completed_at": case((is_complete, now), else_=table.c.completed_at),
+            "updated_at": now
+        }
+    ).returning(
+        table.c.status,
+        select(previous.c.status).scalar_subquery().label("previous_status"),
+        exists(select(previous.c.status)).label("existed")
+    ).add_cte(previous)
+    row = db.execute(statement).one()
+    
+    if on_postgres:
+        existed, previous_status = row.existed, row.previous_status
+    else:
+        existed, previous_status = prior is not None, prior.status if prior else None
+    if not existed:
+        stats.bump(db, {"orders.total": 1})
+    stats.bump_transition(db, "orders", previous_status, row.status)
+
+def _assignment_result(target_grid: models.Grid, target_cell: models.GridCell, scan: dict) -> dict:
+    """Build the success payload returned for an assigned product"""
+    product_info = scan["product_info"]
+    return {
+        "success": True,
+        "message": f"Đã phân bổ sản phẩm vào ô {target_cell.cell_name} trong lưới {target_grid.name}",
+        "grid_id": target_grid.id,
+        "grid_name": target_grid.name,
+        "cell_id": target_cell.id,
+        "cell_name": target_cell.cell_name,
+        "cell_position": f"({target_cell.position_x}, {target_cell.position_y})",
+        "order_code": scan["order_code"],
+        "current_count": target_cell.current_product_count,
+        "target_count": target_cell.target_product_count,
+        "cell_status": target_cell.status,
+        "product_info": {
+            "production_area": product_info["production_area"],
+            "size_code": product_info["size_code"],
+            "order_number": product_info["order_number"],
+            "product_number": product_info["product_number"],
+            "order_date": scan["order_date"]
+        }
+    }
 
 def assign_product_to_cell(db: Session, product_input: schemas.ProductInput) -> dict:
     """
@@ -223,47 +644,31 @@ def assign_product_to_cell(db: Session, product_input: schemas.ProductInput) ->
     try:
         # Kiểm tra trùng lặp
         if check_product_exists(db, product_input.productCode):
-            return {
-                "success": False,
-                "message": f"Sản phẩm {product_input.productCode} đã tồn tại trong hệ thống",
-                "duplicate": True
-            }
+            return _duplicate_result(product_input.productCode)
         
         # Phân tích dữ liệu
-        product_info = parse_product_code(product_input.productCode)
-        qr_info = parse_qr_data(product_input.qrData)
-        order_code = extract_order_code(product_input.productCode)
-        order_date = qr_info["order_date"]
-        full_order_key = create_full_order_key(order_code, order_date)
+        scan = _parse_scan(product_input)
+        full_order_key = scan["full_order_key"]
         
-        # Tìm grid active đầu tiên (hoặc có thể có logic chọn grid khác)
-        active_grid = db.query(models.Grid).filter(models.Grid.is_active == True).first()
-        if not active_grid:
+        # Kiểm tra có grid active (hoặc có thể có logic chọn grid khác)
+        if not _has_active_grid(db):
             return {
                 "success": False,
                 "message": "Không có lưới nào đang hoạt động trong hệ thống"
             }
         
+        # Khóa theo đơn hàng: các lượt quét song song cùng đơn xử lý lần lượt
+        _lock_order_keys(db, [full_order_key])
+        
         # Tìm ô đang filling cùng full_order_key (order_code + order_date) trong tất cả grid active
-        existing_cell = db.query(models.GridCell).join(models.Grid).filter(
-            and_(
-                models.Grid.is_active == True,
-                models.GridCell.current_full_order_key == full_order_key,
-                models.GridCell.status == "filling"
-            )
-        ).first()
+        existing_cell = _find_filling_cell(db, full_order_key)
         
         if existing_cell:
             target_cell = existing_cell
             target_grid = existing_cell.grid
         else:
-            # Tìm ô trống đầu tiên trong grid active
-            target_cell = db.query(models.GridCell).join(models.Grid).filter(
-                and_(
-                    models.Grid.is_active == True,
-                    models.GridCell.status == "empty"
-                )
-            ).first()
+            # Chọn ô trống trong grid active theo chiến lược phân bổ (ALLOCATION_STRATEGY)
+            target_cell = _claim_empty_cell(db, scan)
             
             if not target_cell:
                 return {
@@ -273,126 +678,177 @@ def assign_product_to_cell(db: Session, product_input: schemas.ProductInput) ->
             
             target_grid = target_cell.grid
         
-        # Tạo sản phẩm mới
-        new_product = models.Product(
-            cell_id=target_cell.id,
-            product_code=product_input.productCode,
-            size=product_input.size,
-            color=product_input.color,
-            qr_data=product_input.qrData,
-            number=int(product_input.number),
-            total=int(product_input.total),
-            production_area=product_info["production_area"],
-            size_code=product_info["size_code"],
-            order_number=product_info["order_number"],
-            product_number=product_info["product_number"],
-            order_date=qr_info["order_date"]
-        )
-        
-        db.add(new_product)
+        _add_product_to_cell(db, target_cell, product_input, scan)
         
-        # Lưu status cũ để log
-        old_status = target_cell.status
-        old_count = target_cell.current_product_count or 0
+        # Cập nhật/tạo order tracking (một câu lệnh upsert)
+        _track_order(db, target_cell, scan)
         
-        # Cập nhật thông tin ô
-        target_cell.current_order_code = order_code
-        target_cell.current_order_date = order_date
-        target_cell.current_full_order_key = full_order_key
-        target_cell.current_product_count = (target_cell.current_product_count or 0) + 1
-        target_cell.target_product_count = int(product_input.total)
-        target_cell.updated_at = datetime.utcnow()
+        db.commit()
         
-        # Cập nhật trạng thái ô
-        if target_cell.current_product_count >= target_cell.target_product_count:
-            target_cell.status = "full"
-            target_cell.filled_at = datetime.utcnow()
-        else:
-            target_cell.status = "filling"
+        return _assignment_result(target_grid, target_cell, scan)
         
-        # Log: Thêm sản phẩm
-        log_cell_history(
-            db=db,
-            cell_id=target_cell.id,
-            action_type="product_added",
-            description=f"Thêm sản phẩm {product_input.productCode} ({product_input.size}/{product_input.color}) vào ô {target_cell.cell_name}",
-            order_code=order_code,
-            order_date=order_date,
-            new_data={
-                "product_code": product_input.productCode,
-                "size": product_input.size,
-                "color": product_input.color,
-                "current_count": target_cell.current_product_count,
-                "target_count": target_cell.target_product_count
+    except IntegrityError as e:
+        db.rollback()
+        # Cùng mã vừa được lưu bởi worker khác (ràng buộc unique product_code)
+        if _stored_product_codes(db, [product_input.productCode], use_filter=False):
+            return _duplicate_result(product_input.productCode)
+        return {
+            "success": False,
+            "message": f"Lỗi khi phân bổ sản phẩm: {str(e)}"
+        }
+    except Exception as e:
+        db.rollback()
+        return {
+            "success": False,
+            "message": f"Lỗi khi phân bổ sản phẩm: {str(e)}"
+        }
+
+def assign_products_bulk(db: Session, product_inputs: List[schemas.ProductInput]) -> List[dict]:
+    """
+    Assign a batch of scanned products in ONE transaction
+    - Duplicates (already stored or repeated inside the batch) resolved by the duplicate
+      pre-check plus a single IN query for the codes it is unsure about
+    - Items grouped by full_order_key: filling cells and empty cells
+      are looked up once per batch instead of once per scan
+    - Order tracking is one atomic upsert per scan (no read beforehand)
+    - Returns one result dict per input item, in input order
+    """
+    use_filter = True
+    for _ in range(len(product_inputs)):
+        try:
+            return _assign_products_bulk(db, product_inputs, use_filter, retry_conflicts=True)
+        except IntegrityError:
+            # A code was stored concurrently by another worker: redo the batch
+            # with every code checked against the database. The violation is only
+            # raised once that worker has committed, so each retry sees at least
+            # one more stored code (at most one retry per code of the batch).
+            use_filter = False
+    return _assign_products_bulk(db, product_inputs, use_filter, retry_conflicts=False)
+
+def _assign_products_bulk(
+    db: Session,
+    product_inputs: List[schemas.ProductInput],
+    use_filter: bool,
+    retry_conflicts: bool
+) -> List[dict]:
+    """assign_products_bulk; raises IntegrityError (rolled back) instead of failing the batch if retry_conflicts"""
+    results: List[Optional[dict]] = [None] * len(product_inputs)
+    
+    # Kiểm tra trùng lặp cho cả lô (bộ lọc dedup + một truy vấn IN)
+    codes = {product_input.productCode for product_input in product_inputs}
+    existing_codes = _stored_product_codes(db, codes, use_filter=use_filter)
+    
+    # Gom nhóm theo full_order_key, giữ nguyên thứ tự quét trong mỗi nhóm
+    groups = {}
+    seen_codes = set()
+    for index, product_input in enumerate(product_inputs):
+        code = product_input.productCode
+        if code in existing_codes:
+            results[index] = _duplicate_result(code)
+            continue
+        if code in seen_codes:
+            results[index] = {
+                "success": False,
+                "message": f"Sản phẩm {code} bị quét lặp lại trong cùng một lô",
+                "duplicate": True
             }
-        )
+            continue
+        try:
+            scan = _parse_scan(product_input)
+        except ValueError as e:
+            results[index] = {
+                "success": False,
+                "message": f"Lỗi khi phân bổ sản phẩm: {str(e)}"
+            }
+            continue
+        seen_codes.add(code)
+        groups.setdefault(scan["full_order_key"], []).append((index, product_input, scan))
+    
+    if not groups:
+        return results
+    
+    try:
+        if not _has_active_grid(db):
+            for items in groups.values():
+                for index, _, _ in items:
+                    results[index] = {
+                        "success": False,
+                        "message": "Không có lưới nào đang hoạt động trong hệ thống"
+                    }
+            return results
         
-        # Log: Đổi status (nếu thay đổi)
-        if old_status != target_cell.status:
-            log_cell_history(
-                db=db,
-                cell_id=target_cell.id,
-                action_type="status_changed",
-                description=f"Ô {target_cell.cell_name} đổi từ '{old_status}' → '{target_cell.status}' (tự động)",
-                order_code=order_code,
-                order_date=order_date,
-                old_data={"status": old_status, "count": old_count},
-                new_data={"status": target_cell.status, "count": target_cell.current_product_count, "filled_at": target_cell.filled_at.isoformat() if target_cell.filled_at else None}
-            )
+        order_keys = list(groups.keys())
+        _lock_order_keys(db, order_keys)
         
-        # Cập nhật/tạo order tracking
-        order_tracking = db.query(models.OrderTracking).filter(
-            models.OrderTracking.full_order_key == full_order_key
-        ).first()
+        filling_cells = {}
+        for cell in _filling_cells_query(db).filter(
+            models.GridCell.current_full_order_key.in_(order_keys)
+        ).all():
+            filling_cells.setdefault(cell.current_full_order_key, cell)
         
-        if not order_tracking:
-            order_tracking = models.OrderTracking(
-                order_code=order_code,
-                order_date=order_date,
-                full_order_key=full_order_key,
-                total_products=int(product_input.total),
-                received_products=0,
-                assigned_cell_id=target_cell.id,
-                status="pending"
-            )
-            db.add(order_tracking)
+        # Ô trống lấy từ occupancy index; nếu index chưa sẵn sàng thì truy vấn theo lô
+        empty_cells = []
+        claimed_cell_ids = set()
         
-        order_tracking.received_products = (order_tracking.received_products or 0) + 1
-        if order_tracking.received_products >= order_tracking.total_products:
-            order_tracking.status = "completed"
-            order_tracking.completed_at = datetime.utcnow()
-        else:
-            order_tracking.status = "filling"
+        def next_empty_cell(scan: dict) -> Optional[models.GridCell]:
+            if occupancy_index.ready:
+                return _claim_empty_cell(db, scan)
+            product_info = scan["product_info"]
+            levels = routing_table.candidates(product_info["production_area"], product_info["size_code"])
+            if levels is not None:
+                # Routed grids: query level by level
+                for grid_ids in levels:
+                    query = _empty_cells_query(db).filter(models.GridCell.grid_id.in_(grid_ids))
+                    if claimed_cell_ids:
+                        query = query.filter(~models.GridCell.id.in_(claimed_cell_ids))
+                    cell = query.first()
+                    if cell:
+                        claimed_cell_ids.add(cell.id)
+                        return cell
+                return None
+            if not empty_cells:
+                query = _empty_cells_query(db)
+                if claimed_cell_ids:
+                    query = query.filter(~models.GridCell.id.in_(claimed_cell_ids))
+                empty_cells.extend(reversed(query.limit(len(groups)).all()))
+            if not empty_cells:
+                return None
+            cell = empty_cells.pop()
+            claimed_cell_ids.add(cell.id)
+            return cell
         
-        db.commit()
+        for full_order_key, items in groups.items():
+            for index, product_input, scan in items:
+                target_cell = filling_cells.get(full_order_key)
+                if target_cell is None or target_cell.status != "filling":
+                    target_cell = next_empty_cell(scan)
+                    if target_cell is None:
+                        results[index] = {
+                            "success": False,
+                            "message": "Không có ô trống trong tất cả lưới để phân bổ sản phẩm"
+                        }
+                        continue
+                    filling_cells[full_order_key] = target_cell
+                
+                _add_product_to_cell(db, target_cell, product_input, scan)
+                _track_order(db, target_cell, scan)
+                results[index] = _assignment_result(target_cell.grid, target_cell, scan)
         
-        return {
-            "success": True,
-            "message": f"Đã phân bổ sản phẩm vào ô {target_cell.cell_name} trong lưới {target_grid.name}",
-            "grid_id": target_grid.id,
-            "grid_name": target_grid.name,
-            "cell_id": target_cell.id,
-            "cell_name": target_cell.cell_name,
-            "cell_position": f"({target_cell.position_x}, {target_cell.position_y})",
-            "order_code": order_code,
-            "current_count": target_cell.current_product_count,
-            "target_count": target_cell.target_product_count,
-            "cell_status": target_cell.status,
-            "product_info": {
-                "production_area": product_info["production_area"],
-                "size_code": product_info["size_code"],
-                "order_number": product_info["order_number"],
-                "product_number": product_info["product_number"],
-                "order_date": qr_info["order_date"]
-            }
-        }
+        db.commit()
+        return results
         
     except Exception as e:
         db.rollback()
-        return {
+        if isinstance(e, IntegrityError) and retry_conflicts:
+            raise
+        failure = {
             "success": False,
             "message": f"Lỗi khi phân bổ sản phẩm: {str(e)}"
         }
+        for items in groups.values():
+            for index, _, _ in items:
+                results[index] = dict(failure)
+        return results
 
 # Cell CRUD
 def update_cell_note(db: Session, cell_id: int, note: Optional[str]) -> bool:
@@ -416,90 +872,229 @@ def update_cell_note(db: Session, cell_id: int, note: Optional[str]) -> bool:
         old_data={"note": old_note},
         new_data={"note": note}
     )
+    emit_cell_changed(db, cell, "note_updated")
+    bump_cell_version(db, cell.grid_id, cell.id)
     
     db.commit()
     return True
 
 def clear_cell(db: Session, cell_id: int) -> bool:
     """
-    Giải phóng ô - chuyển sản phẩm vào lịch sử và reset ô
+    Giải phóng ô - chuyển sản phẩm vào kho lưu trữ shipped_products và reset ô
     """
     try:
-        cell = db.query(models.GridCell).filter(models.GridCell.id == cell_id).first()
-        if not cell or cell.status == "empty":
-            return False
+        results = clear_cells(db, cell_ids=[cell_id])
+    except Exception as e:
+        return False
+    return results[0]["success"]
+
+def clear_cells(
+    db: Session,
+    cell_ids: Optional[List[int]] = None,
+    grid_id: Optional[int] = None,
+    filled_before: Optional[datetime] = None
+) -> Optional[List[dict]]:
+    """
+    Giải phóng nhiều ô (giao hàng theo đợt) trong MỘT transaction, bằng SQL theo tập hợp:
+    chuyển sản phẩm sang shipped_products, ghi lịch sử, order tracking -> shipped, reset ô
+    - cell_ids: các ô cần giải phóng (ô trống/không tồn tại chỉ bị báo lỗi riêng)
+    - hoặc grid_id: mọi ô "full" của lưới, filled_before: chỉ các ô đầy trước thời điểm này
+    Trả về kết quả từng ô (None nếu không tìm thấy lưới)
+    """
+    cells = models.GridCell
+    query = select(
+        cells.id,
+        cells.grid_id,
+        cells.cell_name,
+        cells.position_x,
+        cells.position_y,
+        cells.status,
+        cells.current_order_code,
+        cells.current_order_date,
+        cells.current_full_order_key,
+        cells.current_product_count,
+        cells.note
+    )
+    if cell_ids is not None:
+        cell_ids = list(dict.fromkeys(cell_ids))
+        query = query.where(cells.id.in_(cell_ids))
+    else:
+        if db.get(models.Grid, grid_id) is None:
+            return None
+        query = query.where(cells.grid_id == grid_id, cells.status == "full")
+        if filled_before is not None:
+            query = query.where(cells.filled_at < filled_before)
+    
+    try:
+        # Khóa theo thứ tự id để các đợt giao song song không deadlock
+        rows = db.execute(query.order_by(cells.id).with_for_update()).all()
+        found = {row.id: row for row in rows}
+        cleared = [row for row in rows if row.status != "empty"]
         
-        # Lấy tất cả sản phẩm trong ô
-        products = db.query(models.Product).filter(models.Product.cell_id == cell_id).all()
+        results = {}
+        if cell_ids is not None:
+            for cell_id in cell_ids:
+                row = found.get(cell_id)
+                if row is None:
+                    results[cell_id] = {"cell_id": cell_id, "success": False, "message": "Không tìm thấy ô"}
+                elif row.status == "empty":
+                    results[cell_id] = {
+                        "cell_id": cell_id,
+                        "cell_name": row.cell_name,
+                        "success": False,
+                        "message": f"Ô {row.cell_name} đang trống"
+                    }
         
-        if products:
-            # Tạo lịch sử
-            products_data = []
-            for product in products:
-                products_data.append({
-                    "product_code": product.product_code,
-                    "size": product.size,
-                    "color": product.color,
-                    "qr_data": product.qr_data,
-                    "number": product.number,
-                    "total": product.total,
-                    "created_at": product.created_at.isoformat()
-                })
+        if cleared:
+            shipped_at = datetime.utcnow()
+            cleared_ids = [row.id for row in cleared]
             
-            # Log: Clear cell (giao hàng)
-            log_cell_history(
-                db=db,
-                cell_id=cell_id,
-                action_type="cell_cleared",
-                description=f"Giải phóng ô {cell.cell_name} - Giao đơn hàng {cell.current_order_code}",
-                order_code=cell.current_order_code,
-                order_date=cell.current_order_date,
-                old_data={
-                    "status": cell.status,
-                    "order_code": cell.current_order_code,
-                    "product_count": cell.current_product_count,
-                    "note": cell.note
-                },
-                new_data={
-                    "status": "empty",
-                    "order_code": None,
-                    "product_count": 0
-                },
-                products_data=json.dumps(products_data, ensure_ascii=False),
-                product_count=cell.current_product_count or len(products)
+            # 1. Sản phẩm -> shipped_products (một câu lệnh cho cả đợt)
+            shipped_codes = archive.move_cell_products(db, cleared_ids, shipped_at)
+            
+            # 2. Lịch sử cell_cleared (một lệnh INSERT nhiều dòng, hoặc write-behind)
+            write_histories(db, [
+                history_row(
+                    cell_id=row.id,
+                    action_type="cell_cleared",
+                    description=f"Giải phóng ô {row.cell_name} - Giao đơn hàng {row.current_order_code}",
+                    order_code=row.current_order_code,
+                    order_date=row.current_order_date,
+                    old_data={
+                        "status": row.status,
+                        "order_code": row.current_order_code,
+                        "product_count": row.current_product_count,
+                        "note": row.note
+                    },
+                    new_data={"status": "empty", "order_code": None, "product_count": 0},
+                    product_count=row.current_product_count or len(shipped_codes[row.id]),
+                    created_at=shipped_at
+                )
+                for row in cleared if shipped_codes[row.id]
+            ])
+            
+            # 3. Order tracking -> shipped
+            order_keys = sorted({row.current_full_order_key for row in cleared if row.current_full_order_key})
+            if order_keys:
+                orders = models.OrderTracking
+                previous = db.execute(
+                    select(orders.status).where(orders.full_order_key.in_(order_keys))
+                    .order_by(orders.full_order_key).with_for_update()
+                ).scalars().all()
+                db.execute(
+                    update(orders).where(orders.full_order_key.in_(order_keys))
+                    .values(status="shipped", shipped_at=shipped_at)
+                    .execution_options(synchronize_session=False)
+                )
+                for old_status in previous:
+                    stats.bump_transition(db, "orders", old_status, "shipped")
+            
+            # 4. Reset ô
+            db.execute(
+                update(cells).where(cells.id.in_(cleared_ids))
+                .values(
+                    current_order_code=None,
+                    current_order_date=None,
+                    current_full_order_key=None,
+                    current_product_count=0,
+                    target_product_count=None,
+                    status="empty",
+                    note=None,
+                    filled_at=None,
+                    cleared_at=shipped_at,
+                    updated_at=shipped_at
+                )
+                .execution_options(synchronize_session=False)
             )
             
-            # Xóa tất cả sản phẩm
-            for product in products:
-                db.delete(product)
-        
-        # Cập nhật order tracking
-        if cell.current_full_order_key:
-            order_tracking = db.query(models.OrderTracking).filter(
-                models.OrderTracking.full_order_key == cell.current_full_order_key
-            ).first()
-            if order_tracking:
-                order_tracking.status = "shipped"
-                order_tracking.shipped_at = datetime.utcnow()
-        
-        # Reset ô
-        cell.current_order_code = None
-        cell.current_order_date = None
-        cell.current_full_order_key = None
-        cell.current_product_count = 0
-        cell.target_product_count = None
-        cell.status = "empty"
-        cell.note = None
-        cell.filled_at = None
-        cell.cleared_at = datetime.utcnow()
-        cell.updated_at = datetime.utcnow()
+            all_codes = [code for codes in shipped_codes.values() for code in codes]
+            stage_codes_removed(db, all_codes)
+            stats.bump(db, {"products.total": -len(all_codes)})
+            for row in cleared:
+                stats.bump_transition(db, "cells", row.status, "empty")
+                cell = _cleared_cell(row, shipped_at)
+                stage_cell(db, cell)
+                emit_cell_changed(db, cell, "cell_cleared", product_codes=shipped_codes[row.id])
+                bump_cell_version(db, row.grid_id, row.id)
+                results[row.id] = {
+                    "cell_id": row.id,
+                    "cell_name": row.cell_name,
+                    "success": True,
+                    "message": f"Đã giải phóng ô {row.cell_name}",
+                    "order_code": row.current_order_code,
+                    "product_count": len(shipped_codes[row.id])
+                }
         
         db.commit()
-        return True
-        
-    except Exception as e:
+    except Exception:
         db.rollback()
-        return False
+        raise
+    
+    if cell_ids is not None:
+        return [results[cell_id] for cell_id in cell_ids]
+    return [results[row.id] for row in cleared]
+
+def _cleared_cell(row, cleared_at: datetime) -> SimpleNamespace:
+    """State of a cell reset by clear_cells (what stage_cell / emit_cell_changed read)"""
+    return SimpleNamespace(
+        id=row.id,
+        grid_id=row.grid_id,
+        cell_name=row.cell_name,
+        position_x=row.position_x,
+        position_y=row.position_y,
+        status="empty",
+        current_order_code=None,
+        current_full_order_key=None,
+        current_product_count=0,
+        target_product_count=None,
+        note=None,
+        updated_at=cleared_at,
+        filled_at=None
+    )
+
+def update_cell_status(db: Session, cell_id: int, new_status: str) -> Optional[dict]:
+    """
+    Đổi trạng thái ô thủ công ("filling" ↔ "full") - GIỮ NGUYÊN dữ liệu
+    Đổi sang "empty" phải dùng clear_cell
+    Trả về None nếu không tìm thấy ô
+    """
+    cell = db.query(models.GridCell).filter(models.GridCell.id == cell_id).with_for_update().populate_existing().first()
+    if not cell:
+        return None
+    
+    old_status = cell.status
+    cell.status = new_status
+    cell.updated_at = datetime.utcnow()
+    stats.bump_transition(db, "cells", old_status, cell.status)
+    
+    # Cập nhật filled_at nếu chuyển sang full
+    if new_status == "full" and old_status != "full":
+        cell.filled_at = datetime.utcnow()
+    
+    # Log: Đổi status thủ công
+    log_cell_history(
+        db=db,
+        cell_id=cell_id,
+        action_type="status_changed",
+        description=f"Ô {cell.cell_name} đổi từ '{old_status}' → '{new_status}' (thủ công)",
+        order_code=cell.current_order_code,
+        order_date=cell.current_order_date,
+        old_data={"status": old_status},
+        new_data={"status": new_status, "filled_at": cell.filled_at.isoformat() if cell.filled_at else None}
+    )
+    stage_cell(db, cell)
+    emit_cell_changed(db, cell, "status_changed")
+    bump_cell_version(db, cell.grid_id, cell.id)
+    
+    db.commit()
+    db.refresh(cell)
+    
+    return {
+        "cell_id": cell.id,
+        "cell_name": cell.cell_name,
+        "old_status": old_status,
+        "new_status": cell.status
+    }
 
 def get_grid_status(db: Session, grid_id: int) -> Optional[dict]:
     """Lấy trạng thái tổng quan của lưới"""
@@ -521,8 +1116,82 @@ def get_grid_status(db: Session, grid_id: int) -> Optional[dict]:
         "cells": grid.cells
     }
 
-def get_cell_histories(db: Session, cell_id: int) -> List[models.CellHistory]:
-    """Lấy lịch sử của ô"""
-    return db.query(models.CellHistory).filter(
-        models.CellHistory.cell_id == cell_id
-    ).order_by(models.CellHistory.cleared_at.desc()).all()
+def get_grid_snapshot(db: Session, grid_id: int, columns: bool = False) -> Optional[dict]:
+    """
+    Compact state of every cell in a grid: status, counts, order key - no products
+    - One row query over grid_cells; size and time scale with cells, not products
+    - columns=True: one array per field instead of one object per cell
+    Also the initial frame of the live grid stream
+    """
+    grid = get_grid(db, grid_id)
+    if not grid:
+        return None
+    
+    rows = db.execute(
+        select(*CELL_STATE_COLUMNS).where(
+            models.GridCell.grid_id == grid_id
+        ).order_by(models.GridCell.position_y, models.GridCell.position_x)
+    ).all()
+    cells = [cell_state(row) for row in rows]
+    
+    snapshot = {
+        "grid_id": grid.id,
+        "grid_name": grid.name,
+        "width": grid.width,
+        "height": grid.height,
+        "total_cells": len(cells),
+        "empty_cells": sum(1 for cell in cells if cell["status"] == "empty"),
+        "filling_cells": sum(1 for cell in cells if cell["status"] == "filling"),
+        "full_cells": sum(1 for cell in cells if cell["status"] == "full"),
+    }
+    if columns:
+        fields = [column.key for column in CELL_STATE_COLUMNS]
+        snapshot["columns"] = {field: [cell[field] for cell in cells] for field in fields}
+    else:
+        snapshot["cells"] = cells
+    return snapshot
+
+def get_cell_products(db: Session, cell_id: int) -> Optional[List[models.Product]]:
+    """Sản phẩm hiện có trong ô (None nếu không tìm thấy ô)"""
+    products = db.query(models.Product).filter(
+        models.Product.cell_id == cell_id
+    ).order_by(models.Product.created_at, models.Product.id).all()
+    if not products and db.get(models.GridCell, cell_id) is None:
+        return None
+    return products
+
+def get_shipped_products(db: Session, product_code: str) -> List[models.ShippedProduct]:
+    """Các lần giao của một mã sản phẩm (shipped_products, mới nhất trước)"""
+    return db.query(models.ShippedProduct).filter(
+        models.ShippedProduct.product_code == product_code
+    ).order_by(models.ShippedProduct.shipped_at.desc()).all()
+
+def cell_histories_query(
+    cell_id: int,
+    action_types: Optional[List[str]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+):
+    """
+    select() lịch sử của ô, lọc theo loại hành động và khoảng thời gian [since, until)
+    Sắp xếp/phân trang bằng keyset_page(..., HISTORY_KEYS, descending=True)
+    """
+    history = models.CellHistory
+    query = select(history).where(history.cell_id == cell_id)
+    if action_types:
+        query = query.where(history.action_type.in_(action_types))
+    if since is not None:
+        query = query.where(history.created_at >= since)
+    if until is not None:
+        query = query.where(history.created_at < until)
+    return query
+
+# Keyset of the cell history (newest first), served by ix_cell_histories_cell_id_created_at
+HISTORY_KEYS = (models.CellHistory.created_at, models.CellHistory.id)
+
+def get_cell_histories(db: Session, cell_id: int, limit: Optional[int] = None) -> List[models.CellHistory]:
+    """Lấy lịch sử của ô (mới nhất trước), tối đa limit dòng"""
+    query = keyset_page(cell_histories_query(cell_id), HISTORY_KEYS, descending=True)
+    if limit:
+        query = query.limit(limit)
+    return db.execute(query).scalars().all()
@@ -0,0 +1,251 @@
+"""
+Duplicate scan pre-check in front of the products.product_code unique constraint
+
+Per worker process:
+- recent codes (LRU with TTL): codes known to be stored, seen within the last
+  DEDUP_RECENT_TTL_SECONDS -> "duplicate" without a database read
+  (rescans of the same label come in bursts)
+- Bloom filter of every stored code -> "not a duplicate" without a database
+  read for codes that were never stored (most scans)
+Anything else (Bloom "maybe") is answered by the database.
+
+Deletes: clear_cell removes products; their codes leave the recent LRU on commit.
+A Bloom filter cannot forget, so deleted codes stay "maybe" (the database decides)
+until the filter is rebuilt - done in the background once deletions make up half
+of it, or when it outgrows its capacity.
+Codes stored or cleared by other workers arrive through grid events; the unique
+constraint stays the final authority (a violation is reported as a duplicate).
+
+Other workers' codes are only as current as their events, so a "never stored"
+answer can be wrong for a code another worker committed a moment ago, until
+its notification arrives: normally milliseconds, at most the listener's
+keep-alive interval when its connection dies silently. While the listener is
+disconnected nothing is answered from memory; when it listens again the
+filter is rebuilt before its answers are trusted again. Assignment is not
+affected (the insert hits the unique constraint); check_product_exists /
+GET /product/{code}/check may say "not stored" within that window.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from core.core.config import settings
+from core.core.database import SessionLocal, on_commit, session_factory_for, transaction_info
+from . import models
+
+logger = logging.getLogger(__name__)
+
+class BloomFilter:
+    def __init__(self, capacity: int, fp_rate: float):
+        self.capacity = max(capacity, 1000)
+        self.size = int(-self.capacity * math.log(fp_rate) / (math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def _positions(self, key: str):
+        # Double hashing over one 128-bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+class ProductCodeFilter:
+    def __init__(self, capacity: int, fp_rate: float, recent_size: int, recent_ttl: float, enabled: bool = True):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.recent_size = recent_size
+        self.recent_ttl = recent_ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._bloom: Optional[BloomFilter] = None
+        self._recent: "OrderedDict[str, float]" = OrderedDict()
+        self._deleted = 0
+        # Codes stored while a rebuild reads the table; replayed into the new filter
+        self._rebuilding: Optional[List[str]] = None
+        # False while other workers' events may be missing (listener disconnected)
+        self.synced = True
+        self._outages = 0
+        # Database of the last rebuild, used again by background rebuilds
+        self.session_factory = SessionLocal
+
+    @property
+    def ready(self) -> bool:
+        return self._bloom is not None
+
+    def rebuild(self, db: Session) -> bool:
+        """Load every stored product code into a fresh Bloom filter (False: a rebuild is already running)"""
+        if not self.enabled:
+            return True
+        self.session_factory = session_factory_for(db)
+        with self._lock:
+            if self._rebuilding is not None:
+                return False
+            self._rebuilding = []
+        try:
+            stored = db.query(models.Product).count()
+            bloom = BloomFilter(max(self.capacity, stored * 2), self.fp_rate)
+            for code in db.execute(
+                select(models.Product.product_code).execution_options(yield_per=10000)
+            ).scalars():
+                bloom.add(code)
+        except Exception:
+            with self._lock:
+                self._rebuilding = None
+            raise
+        with self._lock:
+            for code in self._rebuilding:
+                bloom.add(code)
+            self._rebuilding = None
+            self._bloom = bloom
+            self._deleted = 0
+        return True
+
+    def check(self, code: str) -> Optional[bool]:
+        """True: stored (recently seen), False: never stored, None: ask the database"""
+        if not self.enabled or not self.synced:
+            return None
+        with self._lock:
+            expires = self._recent.get(code)
+            if expires is not None:
+                if expires > time.monotonic():
+                    self._recent.move_to_end(code)
+                    return True
+                del self._recent[code]
+            if self._bloom is not None and code not in self._bloom:
+                return False
+        return None
+
+    def remember(self, code: str):
+        """The database confirmed code is stored"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._remember(code)
+
+    def added(self, codes: Iterable[str]):
+        """Codes committed to products"""
+        if not self.enabled:
+            return
+        with self._lock:
+            for code in codes:
+                self._remember(code)
+                if self._bloom is not None:
+                    self._bloom.add(code)
+                if self._rebuilding is not None:
+                    self._rebuilding.append(code)
+            stale = self._bloom is not None and self._bloom.count > self._bloom.capacity
+        if stale:
+            self._rebuild_in_background()
+
+    def removed(self, codes: Iterable[str]):
+        """Codes deleted from products (cell cleared)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            for code in codes:
+                self._recent.pop(code, None)
+                self._deleted += 1
+            stale = self._bloom is not None and self._deleted * 2 > self._bloom.count
+        if stale:
+            self._rebuild_in_background()
+
+    def unsynced(self):
+        """Other workers' events may be missed from now on: answer nothing until resync()"""
+        with self._lock:
+            self.synced = False
+            self._outages += 1
+
+    def resync(self):
+        """Events may have been missed: rebuild from the database (background), then answer again"""
+        if not self.enabled:
+            return
+        with self._lock:
+            outage = self._outages
+            self._recent.clear()
+
+        def run():
+            try:
+                with self.session_factory() as db:
+                    # A rebuild already running may have read the table before the missed codes
+                    while not self.rebuild(db):
+                        time.sleep(0.1)
+            except Exception:
+                logger.exception("Product code filter resync failed")
+                return
+            with self._lock:
+                if self._outages == outage:
+                    self.synced = True
+        threading.Thread(target=run, name="product-code-filter-resync", daemon=True).start()
+
+    def _remember(self, code: str):
+        # Caller holds the lock
+        self._recent[code] = time.monotonic() + self.recent_ttl
+        self._recent.move_to_end(code)
+        while len(self._recent) > self.recent_size:
+            self._recent.popitem(last=False)
+
+    def _rebuild_in_background(self):
+        def run():
+            try:
+                with self.session_factory() as db:
+                    self.rebuild(db)
+            except Exception:
+                logger.exception("Product code filter rebuild failed")
+        threading.Thread(target=run, name="product-code-filter-rebuild", daemon=True).start()
+
+product_codes = ProductCodeFilter(
+    capacity=settings.DEDUP_BLOOM_CAPACITY,
+    fp_rate=settings.DEDUP_BLOOM_FP_RATE,
+    recent_size=settings.DEDUP_RECENT_SIZE,
+    recent_ttl=settings.DEDUP_RECENT_TTL_SECONDS,
+    enabled=settings.DEDUP_ENABLED
+)
+
+def stage_code_added(db: Session, code: str):
+    """Record a stored product code; applied to the filter when db commits"""
+    _staged(db)["added"].append(code)
+
+def stage_codes_removed(db: Session, codes: Iterable[str]):
+    _staged(db)["removed"].extend(codes)
+
+def apply_remote_events(events: List[dict]):
+    """Codes stored/cleared by other workers (grid events listener)"""
+    for event in events:
+        if event.get("type") == "disconnected":
+            product_codes.unsynced()
+        elif event.get("type") == "resync":
+            product_codes.resync()
+        elif event.get("reason") == "product_added" and event.get("product_code"):
+            product_codes.added([event["product_code"]])
+        elif event.get("reason") == "cell_cleared" and event.get("product_codes"):
+            product_codes.removed(event["product_codes"])
+
+def _staged(db: Session) -> dict:
+    info = transaction_info(db)
+    staged = info.get("product_codes")
+    if staged is None:
+        staged = info["product_codes"] = {"added": [], "removed": []}
+        on_commit(db, lambda: _apply_staged(staged))
+    return staged
+
+def _apply_staged(staged: dict):
+    if staged["removed"]:
+        product_codes.removed(staged["removed"])
+    if staged["added"]:
+        product_codes.added(staged["added"])
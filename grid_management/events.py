@@ -0,0 +1,317 @@
+"""
+Grid change events for the live grid stream (GET /{grid_id}/events)
+
+Crud mutations stage cell-level deltas on the session. When the transaction
+commits they are:
+- delivered to subscribers of this process immediately (on_commit), and
+- sent to the other worker processes with pg_notify inside the same
+  transaction, so they are only visible if the change is committed.
+A listener connection per process (started in the app lifespan) receives the
+other workers' notifications and fans them out to local subscribers.
+
+Notifications sent while the listener is not connected are lost. Its handlers
+get [DISCONNECTED] when the connection drops (in-memory state may fall behind
+from then on) and [RESYNC] once it listens again (reload from the database);
+stream subscribers get RESYNC too. A connection that dies silently is noticed
+by the next keep-alive query (LISTENER_KEEPALIVE_SECONDS).
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Callable, Dict, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from core.core.config import settings
+from core.core.database import before_commit, on_commit, transaction_info
+from . import models
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "grid_events"
+# pg_notify payloads must stay under 8000 bytes
+MAX_NOTIFY_PAYLOAD = 7500
+SUBSCRIBER_QUEUE_SIZE = 1000
+LISTENER_KEEPALIVE_SECONDS = 10
+LISTENER_CONNECT_TIMEOUT_SECONDS = 10
+LISTENER_APPLICATION_NAME = "grid_events_listener"     # pg_stat_activity.application_name
+
+# Marker telling a subscriber it missed events and must reload the snapshot
+RESYNC = {"type": "resync"}
+# Marker telling listener handlers that other workers' events may be missed until the next RESYNC
+DISCONNECTED = {"type": "disconnected"}
+
+PROCESS_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+# Columns read by cell_state (lets snapshots select rows instead of loading entities)
+CELL_STATE_COLUMNS = (
+    models.GridCell.id,
+    models.GridCell.grid_id,
+    models.GridCell.cell_name,
+    models.GridCell.position_x,
+    models.GridCell.position_y,
+    models.GridCell.status,
+    models.GridCell.current_order_code,
+    models.GridCell.current_full_order_key,
+    models.GridCell.current_product_count,
+    models.GridCell.target_product_count,
+    models.GridCell.note,
+    models.GridCell.updated_at,
+    models.GridCell.filled_at,
+)
+
+def cell_state(cell) -> dict:
+    """Compact, JSON-ready state of one cell (no products); cell may be a GridCell or a CELL_STATE_COLUMNS row"""
+    return {
+        "id": cell.id,
+        "grid_id": cell.grid_id,
+        "cell_name": cell.cell_name,
+        "position_x": cell.position_x,
+        "position_y": cell.position_y,
+        "status": cell.status,
+        "current_order_code": cell.current_order_code,
+        "current_full_order_key": cell.current_full_order_key,
+        "current_product_count": cell.current_product_count or 0,
+        "target_product_count": cell.target_product_count,
+        "note": cell.note,
+        "updated_at": cell.updated_at.isoformat() if cell.updated_at else None,
+        "filled_at": cell.filled_at.isoformat() if cell.filled_at else None,
+    }
+
+def emit_cell_changed(db: Session, cell: models.GridCell, reason: str, **extra):
+    """Stage a cell delta; published only if the transaction commits"""
+    _pending(db).append({
+        "type": "cell",
+        "reason": reason,
+        "grid_id": cell.grid_id,
+        "cell": cell_state(cell),
+        **extra
+    })
+
+def emit_grid_changed(db: Session, grid_id: int, reason: str):
+    """Stage a grid-level change (subscribers reload the snapshot)"""
+    _pending(db).append({"type": "grid", "reason": reason, "grid_id": grid_id})
+
+class _Subscriber:
+    def __init__(self, grid_id: int):
+        self.grid_id = grid_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, event: dict):
+        # Runs on the subscriber's event loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too slow to keep up: drop the backlog and ask for a fresh snapshot
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+class GridEventBus:
+    """In-process fan-out of grid events to stream subscribers"""
+
+    def __init__(self):
+        self._subscribers: Dict[int, Set[_Subscriber]] = {}
+
+    def subscribe(self, grid_id: int) -> _Subscriber:
+        subscriber = _Subscriber(grid_id)
+        self._subscribers.setdefault(grid_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber):
+        subscribers = self._subscribers.get(subscriber.grid_id)
+        if subscribers:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.grid_id]
+
+    def publish(self, events: List[dict]):
+        """Thread-safe: may be called from any thread"""
+        for event in events:
+            for subscriber in list(self._subscribers.get(event.get("grid_id"), ())):
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, event)
+
+    def resync(self):
+        """Send RESYNC to every subscriber (events may have been missed)"""
+        for subscribers in list(self._subscribers.values()):
+            for subscriber in list(subscribers):
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, RESYNC)
+
+event_bus = GridEventBus()
+
+class PostgresEventListener:
+    """LISTENs on the events channel and republishes other workers' events locally"""
+
+    def __init__(self, bus: GridEventBus):
+        self.bus = bus
+        self._handlers: List[Callable[[List[dict]], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._listening: Optional[asyncio.Event] = None
+        # Notifications may have been missed since the last (re)connect
+        self._missed = False
+
+    def add_handler(self, handler: Callable[[List[dict]], None]):
+        """Also call handler(events) for every batch committed by another worker"""
+        if handler not in self._handlers:
+            self._handlers.append(handler)
+
+    async def start(self, timeout: float = LISTENER_CONNECT_TIMEOUT_SECONDS):
+        """
+        Start listening. Waits (up to timeout) for the connection, so in-memory
+        state built afterwards misses no event; if it is not up by then, the
+        handlers get DISCONNECTED now and RESYNC once it is.
+        """
+        if self._task is not None:
+            return
+        self._listening = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._listening.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Grid event listener not connected after %ss, continuing without it", timeout)
+            self._lost()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        import asyncpg
+
+        delay = 1
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(
+                    host=settings.DB_HOST,
+                    port=settings.DB_PORT,
+                    user=settings.DB_USER,
+                    password=settings.DB_PASSWORD,
+                    database=settings.DB_NAME,
+                    server_settings={"application_name": LISTENER_APPLICATION_NAME}
+                )
+                closed = asyncio.get_running_loop().create_future()
+                connection.add_termination_listener(lambda _: closed.done() or closed.set_result(None))
+                await connection.add_listener(CHANNEL, self._on_notify)
+                delay = 1
+                if self._missed:
+                    # Events committed while not listening are lost: reload from the database
+                    self._missed = False
+                    self._dispatch([RESYNC])
+                    self.bus.resync()
+                self._listening.set()
+                # Keep the connection alive; a broken connection raises here
+                while True:
+                    try:
+                        await asyncio.wait_for(asyncio.shield(closed), LISTENER_KEEPALIVE_SECONDS)
+                        raise ConnectionError("listener connection closed")
+                    except asyncio.TimeoutError:
+                        await connection.execute("SELECT 1", timeout=LISTENER_KEEPALIVE_SECONDS)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Grid event listener failed, reconnecting in %ss", delay)
+                self._lost()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+            finally:
+                if connection is not None and not connection.is_closed():
+                    connection.terminate()
+
+    def _lost(self):
+        self._listening.clear()
+        if not self._missed:
+            self._missed = True
+            self._dispatch([DISCONNECTED])
+
+    def _on_notify(self, connection, pid, channel, payload):
+        message = json.loads(payload)
+        if message.get("origin") == PROCESS_ID:
+            return
+        events = message.get("events", [])
+        self._dispatch(events)
+        self.bus.publish(events)
+
+    def _dispatch(self, events: List[dict]):
+        for handler in self._handlers:
+            try:
+                handler(events)
+            except Exception:
+                logger.exception("Grid event handler failed")
+
+event_listener = PostgresEventListener(event_bus)
+
+def _pending(db: Session) -> List[dict]:
+    info = transaction_info(db)
+    pending = info.get("grid_events")
+    if pending is None:
+        pending = info["grid_events"] = []
+        before_commit(db, lambda session: _notify(session, pending))
+        on_commit(db, lambda: event_bus.publish(pending))
+    return pending
+
+def _notify(db: Session, events: List[dict]):
+    if not events or db.get_bind().dialect.name != "postgresql":
+        return
+    for payload in _payloads(events):
+        db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": payload})
+
+def _payloads(events: List[dict]):
+    """Split events into NOTIFY-sized JSON messages"""
+    batch: List[str] = []
+    size = 0
+    for event in events:
+        for encoded in _encode(event):
+            if batch and size + len(encoded.encode()) > MAX_NOTIFY_PAYLOAD - 100:
+                yield _message(batch)
+                batch, size = [], 0
+            batch.append(encoded)
+            size += len(encoded.encode()) + 1
+    if batch:
+        yield _message(batch)
+
+def _encode(event: dict) -> List[str]:
+    """
+    event as JSON, or as several events when it does not fit one message:
+    copies carrying a share of its product_codes each (all of them must reach
+    the other workers' duplicate pre-check), of a grid-level change if even
+    the event without its codes is too large
+    """
+    limit = MAX_NOTIFY_PAYLOAD - 100
+    encoded = json.dumps(event, ensure_ascii=False)
+    if len(encoded.encode()) <= limit:
+        return [encoded]
+    
+    codes = event.get("product_codes") or []
+    base = {key: value for key, value in event.items() if key != "product_codes"}
+    if len(json.dumps(base, ensure_ascii=False).encode()) > limit // 2:
+        base = {"type": "grid", "reason": event.get("reason"), "grid_id": event.get("grid_id")}
+    if not codes:
+        return [json.dumps(base, ensure_ascii=False)]
+    
+    room = limit - len(json.dumps({**base, "product_codes": []}, ensure_ascii=False).encode())
+    chunks: List[List[str]] = [[]]
+    size = 0
+    for code in codes:
+        code_size = len(json.dumps(code, ensure_ascii=False).encode()) + 2   # ", " separator
+        if chunks[-1] and size + code_size > room:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(code)
+        size += code_size
+    return [json.dumps({**base, "product_codes": chunk}, ensure_ascii=False) for chunk in chunks]
+
+def _message(encoded_events: List[str]) -> str:
+    return '{"origin": %s, "events": [%s]}' % (json.dumps(PROCESS_ID), ",".join(encoded_events))
@@ -0,0 +1,419 @@
+"""
+Cell history writes, optionally write-behind (HISTORY_WRITE_BEHIND)
+
+By default history rows are inserted inside the transaction that changes the
+cell, as before. In write-behind mode the transaction only carries the state
+change and its history rows are appended to a local spool file right before
+its COMMIT (with the transaction's id, txid_current()). They are queued for
+the process's HistoryWriter when it commits (never for a rollback), and a
+background thread inserts them in batches (one multi-row INSERT per
+HISTORY_FLUSH_BATCH rows) every HISTORY_FLUSH_INTERVAL_SECONDS, or sooner once
+a batch is full.
+
+Durability: spool segments
+(HISTORY_SPOOL_DIR/cell_history-<pid>-<started>-<n>.ndjson) are deleted once
+each of their transactions is either in the database or rolled back. A worker
+that starts up replays segments left behind by a process that died (each live
+process holds an exclusive lock on its own segments), keeping only the
+transactions that committed (txid_status), so history survives a crash at any
+point of the commit. Delivery is at-least-once: a crash between the batch
+COMMIT and the segment delete replays that batch. The commit path only writes
+to the OS: with HISTORY_SPOOL_FSYNC the flusher thread fsyncs the spool every
+interval, so a host crash loses at most the last interval; without it the
+spool survives a process crash but not a host crash.
+
+History reads (GET /cells/{cell_id}/history) lag by up to one flush interval.
+Processes that never start the writer (scripts, maintenance jobs) keep writing
+history synchronously.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import IO, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import insert, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from core.core.config import settings
+from core.core.database import SessionLocal, before_commit, on_commit, on_rollback, transaction_info
+from . import models
+from .cache import cell_version, response_cache
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no spool locking (single worker) on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SPOOL_PATTERN = "cell_history-*.ndjson"
+
+def history_row(
+    cell_id: int,
+    action_type: str,
+    description: str,
+    order_code: str = None,
+    order_date: str = None,
+    old_data: dict = None,
+    new_data: dict = None,
+    products_data: str = None,
+    product_count: int = None,
+    performed_by: str = "system",
+    created_at: datetime = None
+) -> dict:
+    """One cell_histories row; old_data/new_data stay dicts until written"""
+    return {
+        "cell_id": cell_id,
+        "action_type": action_type,
+        "description": description,
+        "order_code": order_code,
+        "order_date": order_date,
+        "old_data": old_data,
+        "new_data": new_data,
+        "products_data": products_data,
+        "product_count": product_count,
+        "performed_by": performed_by,
+        "created_at": created_at or datetime.utcnow(),
+    }
+
+def db_row(row: dict) -> dict:
+    """history_row() (or a spooled copy of it) -> cell_histories column values"""
+    values = dict(row)
+    for column in ("old_data", "new_data"):
+        if values[column] and not isinstance(values[column], str):
+            values[column] = json.dumps(values[column], ensure_ascii=False)
+        values[column] = values[column] or None
+    if isinstance(values["created_at"], str):
+        values["created_at"] = datetime.fromisoformat(values["created_at"])
+    return values
+
+def write_histories(db: Session, rows: List[dict]):
+    """
+    Record history rows of db's current transaction: spooled before its COMMIT
+    and queued for the write-behind writer when it runs, otherwise inserted in
+    the transaction
+    """
+    if not rows:
+        return
+    if history_writer.running:
+        info = transaction_info(db)
+        staged = info.get("histories")
+        if staged is None:
+            staged = info["histories"] = []
+            before_commit(db, lambda session: history_writer.spool(session, staged))
+        staged.extend(rows)
+    elif len(rows) == 1:
+        db.add(models.CellHistory(**db_row(rows[0])))
+    else:
+        db.execute(insert(models.CellHistory), [db_row(row) for row in rows])
+
+class _Segment:
+    """A spool file, locked by this process while it holds rows that are not in the database"""
+
+    def __init__(self, path: str, file: IO[str]):
+        self.path = path
+        self.file = file
+        self.lines = 0      # transactions appended
+        self.open = 0       # of which neither rolled back nor written to the database
+
+    def discard(self):
+        os.unlink(self.path)
+        self.file.close()
+
+class HistoryWriter:
+    def __init__(self):
+        self._lock = threading.Lock()           # pending rows, spool segments
+        self._flush_lock = threading.Lock()     # one flush at a time
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pending: List[Tuple[_Segment, List[dict]]] = []   # committed, per transaction
+        self._pending_rows = 0
+        self._segments: List[_Segment] = []     # rotated out, still holding open transactions
+        self._spool: Optional[_Segment] = None  # segment being appended to
+        self._unsynced: Set[_Segment] = set()
+        self._prefix = ""
+        self._sequence = 0
+        self.running = False
+        self.flushed = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.failures = 0
+
+    def start(self):
+        """Recover orphaned spool segments and start the background flusher (if enabled)"""
+        if self.running or not settings.HISTORY_WRITE_BEHIND:
+            return
+        os.makedirs(settings.HISTORY_SPOOL_DIR, exist_ok=True)
+        self._prefix = f"cell_history-{os.getpid()}-{int(time.time() * 1000)}"
+        self._recover()
+        self._spool = self._open_segment()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        self.running = True
+        if self._pending:
+            self._wake.set()
+
+    def stop(self, timeout: float = 30):
+        """Stop accepting rows, flush what is queued; unflushed segments stay for the next start"""
+        if not self.running:
+            return
+        self.running = False
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("History writer: final flush failed, rows stay spooled")
+        self._sync()
+        with self._lock:
+            for segment in self._segments:
+                segment.file.close()
+            if self._spool is not None:
+                if self._spool.open:
+                    self._spool.file.close()
+                else:
+                    self._spool.discard()
+            self._segments, self._spool, self._pending, self._pending_rows = [], None, [], 0
+
+    def spool(self, db: Session, rows: List[dict]):
+        """
+        before_commit: append the transaction's rows, tagged with its id, to the
+        spool; they are queued for the next flush once it commits and the line
+        is dropped (on recovery too) if it does not
+        """
+        line = json.dumps(
+            {"txid": _transaction_id(db), "rows": rows}, ensure_ascii=False, default=_json_default
+        ) + "\n"
+        with self._lock:
+            segment = self._spool
+            if segment is not None:
+                segment.file.write(line)
+                segment.file.flush()
+                segment.lines += 1
+                segment.open += 1
+                self._unsynced.add(segment)
+        if segment is None:
+            # Stopped meanwhile: nothing will flush them, keep them in the transaction
+            db.execute(insert(models.CellHistory), [db_row(row) for row in rows])
+            return
+        on_commit(db, lambda: self._queue(segment, rows))
+        on_rollback(db, lambda: self._release([segment]))
+
+    def flush(self) -> int:
+        """Insert every queued row (one transaction); returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                pending, self._pending, self._pending_rows = self._pending, [], 0
+                # Later transactions go to a new segment, the old one is deleted once
+                # none of its transactions is open
+                spool, finished = self._spool, None
+                if spool is not None and spool.lines:
+                    self._spool = self._open_segment() if self.running else None
+                    if spool.open:
+                        self._segments.append(spool)
+                    else:
+                        finished = spool    # every transaction rolled back
+            if finished is not None:
+                finished.discard()
+            rows = [row for _, transaction_rows in pending for row in transaction_rows]
+            try:
+                written = self._insert(rows)
+            except Exception:
+                with self._lock:
+                    self._pending[:0] = pending
+                    self._pending_rows += len(rows)
+                self.failures += 1
+                raise
+            self._release([segment for segment, _ in pending])
+            # Cell detail embeds recent history: views cached before the flush are stale
+            response_cache.bump({cell_version(row["cell_id"]) for row in rows})
+            self.flushed += written
+            return written
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "running": self.running,
+                "pending": self._pending_rows,
+                "spool_segments": len(self._segments) + (1 if self._spool is not None and self._spool.open else 0),
+                "flushed": self.flushed,
+                "replayed": self.replayed,
+                "dropped": self.dropped,
+                "failures": self.failures,
+            }
+
+    def _queue(self, segment: _Segment, rows: List[dict]):
+        """on_commit: queue the spooled rows for the next flush"""
+        with self._lock:
+            if self.running:
+                self._pending.append((segment, rows))
+                self._pending_rows += len(rows)
+                if self._pending_rows >= settings.HISTORY_FLUSH_BATCH:
+                    self._wake.set()
+                return
+        # Committed after stop(): nothing will flush it, write it now (the
+        # spooled line is replayed again by the next start: at-least-once)
+        with SessionLocal() as db:
+            self._insert_batches(db, [db_row(row) for row in rows])
+            db.commit()
+
+    def _release(self, segments: List[_Segment]):
+        """One open transaction of each segment is written or rolled back; delete the finished rotated ones"""
+        finished = []
+        with self._lock:
+            for segment in segments:
+                segment.open -= 1
+                if not segment.open and segment is not self._spool and segment in self._segments:
+                    self._segments.remove(segment)
+                    self._unsynced.discard(segment)
+                    finished.append(segment)
+        for segment in finished:
+            segment.discard()
+
+    def _sync(self):
+        """fsync the segments appended to since the last call (HISTORY_SPOOL_FSYNC), off the commit path"""
+        with self._lock:
+            segments, self._unsynced = self._unsynced, set()
+        if not settings.HISTORY_SPOOL_FSYNC:
+            return
+        for segment in segments:
+            try:
+                os.fsync(segment.file.fileno())
+            except (ValueError, OSError):
+                pass    # deleted meanwhile: its rows are in the database
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(settings.HISTORY_FLUSH_INTERVAL_SECONDS)
+            self._wake.clear()
+            try:
+                self._sync()
+                self.flush()
+            except Exception:
+                # Rows stay queued and spooled; retried next interval
+                logger.exception("History writer: flush failed")
+
+    def _insert(self, rows: List[dict]) -> int:
+        values = [db_row(row) for row in rows]
+        with SessionLocal() as db:
+            try:
+                self._insert_batches(db, values)
+                db.commit()
+                return len(values)
+            except IntegrityError:
+                db.rollback()
+            # A cell was deleted (grid shrunk) before its history was flushed
+            cell_ids = {row["cell_id"] for row in values}
+            existing = set(db.execute(
+                select(models.GridCell.id).where(models.GridCell.id.in_(cell_ids))
+            ).scalars())
+            kept = [row for row in values if row["cell_id"] in existing]
+            if len(kept) < len(values):
+                self.dropped += len(values) - len(kept)
+                logger.warning("History writer: dropped %d rows of deleted cells", len(values) - len(kept))
+            self._insert_batches(db, kept)
+            db.commit()
+            return len(kept)
+
+    def _insert_batches(self, db: Session, values: List[dict]):
+        batch = max(settings.HISTORY_FLUSH_BATCH, 1)
+        for start in range(0, len(values), batch):
+            db.execute(insert(models.CellHistory), values[start:start + batch])
+
+    def _open_segment(self) -> _Segment:
+        self._sequence += 1
+        path = os.path.join(settings.HISTORY_SPOOL_DIR, f"{self._prefix}-{self._sequence}.ndjson")
+        file = open(path, "a", encoding="utf-8")
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return _Segment(path, file)
+
+    def _recover(self):
+        """
+        Queue the rows of segments no live process holds (a previous run crashed
+        or failed to flush), skipping transactions that never committed
+        """
+        segments = []
+        for path in sorted(glob.glob(os.path.join(settings.HISTORY_SPOOL_DIR, SPOOL_PATTERN))):
+            try:
+                file = open(path, "r+", encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            if fcntl is not None:
+                try:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    file.close()    # another worker's live segment
+                    continue
+            if not os.path.exists(path):
+                file.close()        # replayed and removed by another worker meanwhile
+                continue
+            transactions = []
+            for line in file:
+                try:
+                    transactions.append(json.loads(line))
+                except ValueError:
+                    # Torn last line of a crash in the middle of an append
+                    logger.warning("History spool %s: skipped an unreadable line", path)
+            segment = _Segment(path, file)
+            segments.append((segment, transactions))
+        if not segments:
+            return
+        committed = _committed_transactions({
+            transaction["txid"] for _, transactions in segments for transaction in transactions
+            if "rows" in transaction and transaction["txid"] is not None
+        })
+        skipped = 0
+        for segment, transactions in segments:
+            rows = []
+            for transaction in transactions:
+                if "rows" not in transaction:
+                    rows.append(transaction)    # a row spooled after COMMIT (older format)
+                elif transaction["txid"] is None or transaction["txid"] in committed:
+                    rows.extend(transaction["rows"])
+                else:
+                    skipped += len(transaction["rows"])
+            segment.lines = segment.open = 1
+            self._segments.append(segment)
+            self._pending.append((segment, rows))
+            self._pending_rows += len(rows)
+            self.replayed += len(rows)
+        if skipped:
+            logger.info("History writer: skipped %d spooled rows of transactions that did not commit", skipped)
+        if self.replayed:
+            logger.info("History writer: replaying %d spooled rows", self.replayed)
+
+def _transaction_id(db: Session) -> Optional[int]:
+    """Id of db's current transaction, to tell on recovery whether it committed (PostgreSQL only)"""
+    if db.get_bind().dialect.name != "postgresql":
+        return None
+    return db.execute(text("SELECT txid_current()")).scalar()
+
+def _committed_transactions(txids: Set[int]) -> Set[int]:
+    """The txids that committed; status unknown (too old to tell) counts as committed"""
+    if not txids:
+        return set()
+    with SessionLocal() as db:
+        statuses: Dict[int, Optional[str]] = dict(db.execute(
+            text("SELECT txid, txid_status(txid) FROM unnest(CAST(:txids AS bigint[])) AS txid"),
+            {"txids": sorted(txids)}
+        ).all())
+    return {txid for txid, status in statuses.items() if status in ("committed", None)}
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+history_writer = HistoryWriter()
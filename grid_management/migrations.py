@@ -0,0 +1,170 @@
+"""
+Schema migrations for the grid management tables (applied in order by core.core.migrations)
+
+Add new migrations at the end of MIGRATIONS with the next version number;
+never edit one that has already shipped. A migration creates what it declares
+itself (_baseline_tables, explicit Index objects), not what the models declare
+today, so the schema it builds stays the same when the models move on.
+"""
+from datetime import datetime
+from typing import Dict
+
+from sqlalchemy import (
+    Boolean, Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, Text, UniqueConstraint, inspect
+)
+from sqlalchemy.engine import Connection
+
+from core.core.migrations import Migration, create_index_online, drop_index_online
+from . import archive, models, stats
+
+def _baseline_tables(metadata: MetaData) -> Dict[str, Table]:
+    """The tables as they were before versioned migrations (frozen, do not follow models.py)"""
+    tables = [
+        Table(
+            "grids", metadata,
+            Column("id", Integer, primary_key=True, index=True),
+            Column("name", String(100), nullable=False, comment="Grid name"),
+            Column("width", Integer, nullable=False, comment="Grid width"),
+            Column("height", Integer, nullable=False, comment="Grid height"),
+            Column("total_cells", Integer, nullable=False, comment="Total cells (width * height)"),
+            Column("created_at", DateTime),
+            Column("updated_at", DateTime),
+            Column("is_active", Boolean, comment="Active status"),
+        ),
+        Table(
+            "grid_cells", metadata,
+            Column("id", Integer, primary_key=True, index=True),
+            Column("grid_id", Integer, ForeignKey("grids.id"), nullable=False),
+            Column("position_x", Integer, nullable=False, comment="X position in grid (0-based)"),
+            Column("position_y", Integer, nullable=False, comment="Y position in grid (0-based)"),
+            Column("cell_name", String(50), nullable=False, comment="Cell name (e.g: A1, B2)"),
+            Column("current_order_code", String(100), nullable=True, comment="Current order code (VA-M-000126)"),
+            Column("current_order_date", String(10), nullable=True, comment="Current order date (101725)"),
+            Column("current_full_order_key", String(120), nullable=True, comment="Full key: order_code-order_date"),
+            Column("current_product_count", Integer, comment="Current product count in cell"),
+            Column("target_product_count", Integer, nullable=True, comment="Total products needed for order"),
+            Column("status", String(20), comment="Status: empty, filling, full"),
+            Column("note", Text, nullable=True, comment="Cell note"),
+            Column("created_at", DateTime),
+            Column("updated_at", DateTime),
+            Column("filled_at", DateTime, nullable=True, comment="Time when cell was filled"),
+            Column("cleared_at", DateTime, nullable=True, comment="Time when cell was cleared"),
+            UniqueConstraint("grid_id", "position_x", "position_y", name="unique_cell_position"),
+        ),
+        Table(
+            "products", metadata,
+            Column("id", Integer, primary_key=True, index=True),
+            Column("cell_id", Integer, ForeignKey("grid_cells.id"), nullable=False),
+            Column("product_code", String(100), nullable=False, unique=True, comment="Product code: VA-M-000126-2 (UNIQUE)"),
+            Column("size", String(10), nullable=False, comment="Size: S, M, L, XL"),
+            Column("color", String(50), nullable=False, comment="Color"),
+            Column("qr_data", String(200), nullable=False, comment="QR data: 101725-VA-M-000126-2"),
+            Column("number", Integer, nullable=False, comment="Product sequence number in order"),
+            Column("total", Integer, nullable=False, comment="Total products in order"),
+            Column("production_area", String(10), nullable=False, comment="Production area: VA"),
+            Column("size_code", String(5), nullable=False, comment="Size code: M"),
+            Column("order_number", String(20), nullable=False, comment="Order number: 000126"),
+            Column("product_number", Integer, nullable=False, comment="Product number: 2"),
+            Column("order_date", String(10), nullable=False, comment="Order date: 101725"),
+            Column("created_at", DateTime),
+        ),
+        Table(
+            "cell_histories", metadata,
+            Column("id", Integer, primary_key=True, index=True),
+            Column("cell_id", Integer, ForeignKey("grid_cells.id"), nullable=False),
+            Column("action_type", String(50), nullable=False, comment="Type: product_added, status_changed, note_updated, cell_cleared"),
+            Column("description", Text, nullable=False, comment="Detailed description"),
+            Column("order_code", String(100), nullable=True, comment="Related order code"),
+            Column("order_date", String(10), nullable=True, comment="Order date"),
+            Column("old_data", Text, nullable=True, comment="Data before change (JSON)"),
+            Column("new_data", Text, nullable=True, comment="Data after change (JSON)"),
+            Column("products_data", Text, nullable=True, comment="Product JSON data when cleared"),
+            Column("product_count", Integer, nullable=True, comment="Product count when cleared"),
+            Column("performed_by", String(100), comment="Performed by"),
+            Column("created_at", DateTime, comment="Action timestamp"),
+        ),
+        Table(
+            "order_tracking", metadata,
+            Column("id", Integer, primary_key=True, index=True),
+            Column("order_code", String(100), nullable=False, comment="Order code: VA-M-000126"),
+            Column("order_date", String(10), nullable=False, comment="Order date: 101725"),
+            Column("full_order_key", String(120), nullable=False, unique=True, comment="Full key: order_code-order_date"),
+            Column("total_products", Integer, nullable=False, comment="Total products in order"),
+            Column("received_products", Integer, comment="Received products count"),
+            Column("assigned_cell_id", Integer, ForeignKey("grid_cells.id"), nullable=True, comment="Assigned cell"),
+            Column("status", String(20), comment="Status: pending, filling, completed, shipped"),
+            Column("created_at", DateTime),
+            Column("updated_at", DateTime),
+            Column("completed_at", DateTime, nullable=True, comment="Order completion time"),
+            Column("shipped_at", DateTime, nullable=True, comment="Shipping time"),
+        ),
+    ]
+    return {table.name: table for table in tables}
+
+def _initial_schema(conn: Connection):
+    # Tables as they existed before versioned migrations (previously created by
+    # Base.metadata.create_all at startup). checkfirst keeps existing databases intact.
+    metadata = MetaData()
+    _baseline_tables(metadata)
+    metadata.create_all(conn, checkfirst=True)
+
+def _hot_path_indexes(conn: Connection):
+    tables = _baseline_tables(MetaData())
+    cells, products, histories, orders = (
+        tables[name].c for name in ("grid_cells", "products", "cell_histories", "order_tracking")
+    )
+    for index in (
+        Index("ix_grid_cells_status_filled_at", cells.status, cells.filled_at),
+        Index("ix_grid_cells_status_updated_at", cells.status, cells.updated_at),
+        Index(
+            "ix_grid_cells_filling_order_key", cells.current_full_order_key,
+            postgresql_where=(cells.status == "filling"),
+            sqlite_where=(cells.status == "filling")
+        ),
+        Index(
+            "ix_grid_cells_empty_slot", cells.grid_id, cells.position_y, cells.position_x,
+            postgresql_where=(cells.status == "empty"),
+            sqlite_where=(cells.status == "empty")
+        ),
+        Index("ix_products_cell_id", products.cell_id),
+        Index("ix_cell_histories_cell_id", histories.cell_id),
+        Index("ix_order_tracking_status_created_at", orders.status, orders.created_at),
+        Index("ix_order_tracking_created_at", orders.created_at),
+    ):
+        create_index_online(conn, index)
+
+def _stat_counters(conn: Connection):
+    models.StatCounter.__table__.create(conn, checkfirst=True)
+    stats.reset_counters(conn, stats.compute_counters(conn))
+
+def _shipped_products(conn: Connection):
+    # Partitioned by month on PostgreSQL (postgresql_partition_by); legacy
+    # cell_histories.products_data is compacted later by archive.run_maintenance
+    models.ShippedProduct.__table__.create(conn, checkfirst=True)
+    archive.create_upcoming_partitions(conn, datetime.utcnow())
+
+def _grid_routing_keys(conn: Connection):
+    # Present already on databases whose initial_schema ran before it was frozen
+    # (it used to create the tables of the current models)
+    if "routing_keys" not in {column["name"] for column in inspect(conn).get_columns("grids")}:
+        conn.exec_driver_sql("ALTER TABLE grids ADD COLUMN routing_keys VARCHAR(500)")
+
+def _cell_history_timeline_index(conn: Connection):
+    histories = _baseline_tables(MetaData())["cell_histories"].c
+    create_index_online(conn, Index(
+        "ix_cell_histories_cell_id_created_at", histories.cell_id, histories.created_at, histories.id
+    ))
+
+def _drop_cell_history_cell_id_index(conn: Connection):
+    # Covered by ix_cell_histories_cell_id_created_at (cell_id is its leading column)
+    drop_index_online(conn, "ix_cell_histories_cell_id")
+
+MIGRATIONS = [
+    Migration(1, "initial_schema", _initial_schema),
+    Migration(2, "hot_path_indexes", _hot_path_indexes, transactional=False),
+    Migration(3, "stat_counters", _stat_counters),
+    Migration(4, "shipped_products", _shipped_products),
+    Migration(5, "grid_routing_keys", _grid_routing_keys),
+    Migration(6, "cell_history_timeline_index", _cell_history_timeline_index, transactional=False),
+    Migration(7, "drop_cell_history_cell_id_index", _drop_cell_history_cell_id_index, transactional=False),
+]
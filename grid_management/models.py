@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from core.core.database import Base
@@ -17,6 +17,7 @@ class Grid(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = Column(Boolean, default=True, comment="Active status")
+    routing_keys = Column(String(500), nullable=True, comment="Comma-separated routing keys: VA-M, VA-*, *-L (NULL = any product)")
     
     # Relationship
     cells = relationship("GridCell", back_populates="grid", cascade="all, delete-orphan")
@@ -50,8 +51,26 @@ class GridCell(Base):
     filled_at = Column(DateTime, nullable=True, comment="Time when cell was filled")
     cleared_at = Column(DateTime, nullable=True, comment="Time when cell was cleared")
     
-    # Unique constraint cho vị trí trong grid
-    __table_args__ = (UniqueConstraint('grid_id', 'position_x', 'position_y', name='unique_cell_position'),)
+    # Unique constraint cho vị trí trong grid + indexes for the hot lookups
+    __table_args__ = (
+        UniqueConstraint('grid_id', 'position_x', 'position_y', name='unique_cell_position'),
+        # /cells/ready-to-ship (status='full' ORDER BY filled_at), stats
+        Index('ix_grid_cells_status_filled_at', 'status', 'filled_at'),
+        # /cells/by-status/{status} (ORDER BY updated_at DESC)
+        Index('ix_grid_cells_status_updated_at', 'status', 'updated_at'),
+        # Assignment: filling cell of an order
+        Index(
+            'ix_grid_cells_filling_order_key', 'current_full_order_key',
+            postgresql_where=(status == 'filling'),
+            sqlite_where=(status == 'filling')
+        ),
+        # Assignment: first empty cell per grid
+        Index(
+            'ix_grid_cells_empty_slot', 'grid_id', 'position_y', 'position_x',
+            postgresql_where=(status == 'empty'),
+            sqlite_where=(status == 'empty')
+        ),
+    )
     
     # Relationships
     grid = relationship("Grid", back_populates="cells")
@@ -66,7 +85,7 @@ class Product(Base):
     __tablename__ = "products"
     
     id = Column(Integer, primary_key=True, index=True)
-    cell_id = Column(Integer, ForeignKey("grid_cells.id"), nullable=False)
+    cell_id = Column(Integer, ForeignKey("grid_cells.id"), nullable=False, index=True)
     
     # Product information from FE
     product_code = Column(String(100), nullable=False, unique=True, comment="Product code: VA-M-000126-2 (UNIQUE)")
@@ -101,6 +120,7 @@ class CellHistory(Base):
     __tablename__ = "cell_histories"
     
     id = Column(Integer, primary_key=True, index=True)
+    # Indexed by ix_cell_histories_cell_id_created_at (leading column)
     cell_id = Column(Integer, ForeignKey("grid_cells.id"), nullable=False)
     
     # Action type
@@ -127,6 +147,11 @@ class CellHistory(Base):
     
     # Relationships
     cell = relationship("GridCell", back_populates="histories")
+    
+    __table_args__ = (
+        # /cell/{cell_id}/history: newest first, keyset on (created_at, id); scanned backward
+        Index('ix_cell_histories_cell_id_created_at', 'cell_id', 'created_at', 'id'),
+    )
 
 class OrderTracking(Base):
     """
@@ -149,5 +174,64 @@ class OrderTracking(Base):
     completed_at = Column(DateTime, nullable=True, comment="Order completion time")
     shipped_at = Column(DateTime, nullable=True, comment="Shipping time")
     
+    # /orders/list (optional status filter, ORDER BY created_at DESC) and stats
+    __table_args__ = (
+        Index('ix_order_tracking_status_created_at', 'status', 'created_at'),
+        Index('ix_order_tracking_created_at', 'created_at'),
+    )
+    
     # Relationships
     assigned_cell = relationship("GridCell", back_populates="order_tracking")
+
+class StatCounter(Base):
+    """
+    Materialized system counters for /stats/summary
+    Kept up to date in the same transaction as the change they count.
+    Each counter is split over a few shard rows so concurrent scans do not
+    queue on a single row lock; the value is SUM(value) per name.
+    """
+    __tablename__ = "stat_counters"
+    
+    name = Column(String(50), primary_key=True, comment="Counter name: cells.empty, orders.shipped...")
+    shard = Column(Integer, primary_key=True, default=0, comment="Shard number")
+    value = Column(BigInteger, nullable=False, default=0, comment="Partial count held by this shard")
+
+class ShippedProduct(Base):
+    """
+    Shipped products archive - one row per product of a cleared cell
+    Filled by clear_cell (products are moved here, not copied into cell_histories).
+    On PostgreSQL the table is range-partitioned by shipped_at, one partition per month.
+    """
+    __tablename__ = "shipped_products"
+    
+    # products.id of the shipped product; negative for rows compacted from legacy
+    # cell_histories.products_data JSON. shipped_at is part of the key because a
+    # partitioned table's primary key must include the partition column.
+    product_id = Column(BigInteger, primary_key=True, autoincrement=False, comment="Original products.id")
+    shipped_at = Column(DateTime, primary_key=True, comment="Time the cell was cleared")
+    
+    # Where it was stored (no foreign keys: the archive outlives cells and grids)
+    cell_id = Column(Integer, nullable=False, comment="Cell the product was shipped from")
+    grid_id = Column(Integer, nullable=True, comment="Grid of that cell")
+    full_order_key = Column(String(120), nullable=True, comment="Full key: order_code-order_date")
+    
+    # Product information (same as products)
+    product_code = Column(String(100), nullable=False, comment="Product code: VA-M-000126-2")
+    size = Column(String(10), nullable=True, comment="Size: S, M, L, XL")
+    color = Column(String(50), nullable=True, comment="Color")
+    qr_data = Column(String(200), nullable=True, comment="QR data: 101725-VA-M-000126-2")
+    number = Column(Integer, nullable=True, comment="Product sequence number in order")
+    total = Column(Integer, nullable=True, comment="Total products in order")
+    production_area = Column(String(10), nullable=True, comment="Production area: VA")
+    size_code = Column(String(5), nullable=True, comment="Size code: M")
+    order_number = Column(String(20), nullable=True, comment="Order number: 000126")
+    product_number = Column(Integer, nullable=True, comment="Product number: 2")
+    order_date = Column(String(10), nullable=True, comment="Order date: 101725")
+    scanned_at = Column(DateTime, nullable=True, comment="Time the product was scanned into the cell")
+    
+    # Product code / order lookups across past shipments
+    __table_args__ = (
+        Index('ix_shipped_products_product_code', 'product_code'),
+        Index('ix_shipped_products_full_order_key', 'full_order_key'),
+        {"postgresql_partition_by": "RANGE (shipped_at)"},
+    )
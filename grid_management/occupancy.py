@@ -0,0 +1,305 @@
+"""
+In-memory cell occupancy index
+
+Keeps, per process:
+- full_order_key -> id of the cell currently "filling" that order
+- per active grid and cell kind, a free list (heap) of empty cells, ordered and
+  chosen by the allocation strategy (allocation.py; default row by row: A1, A2, ..., B1...)
+
+assign_product_to_cell uses it to pick a slot without searching grid_cells.
+The database stays the source of truth: the picked row is loaded by primary key
+and re-checked, and a mismatch just re-syncs that cell and tries the next one.
+Changes are staged on the session and applied only after commit.
+"""
+import asyncio
+import heapq
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from core.core.database import SessionLocal, on_commit, on_rollback, session_factory_for, transaction_info
+from . import models
+from .allocation import AllocationStrategy, FreePool, create_strategy
+
+# cell_id -> (grid_id, position_x, position_y, status, full_order_key)
+CellState = Tuple[int, int, int, str, Optional[str]]
+
+# (grid_id, cell kind) -> free list
+PoolKey = Tuple[int, str]
+
+class CellOccupancyIndex:
+    def __init__(self, strategy: Optional[AllocationStrategy] = None):
+        self._lock = threading.Lock()
+        self.strategy = strategy or create_strategy()
+        self._cells: Dict[int, CellState] = {}
+        self._by_order: Dict[str, int] = {}
+        self._free: Dict[PoolKey, List[tuple]] = {}
+        self._free_ids: Dict[PoolKey, set] = {}
+        self._pools: Dict[int, List[PoolKey]] = {}
+        self._grid_cells: Dict[int, set] = {}
+        self._grid_ids: List[int] = []
+        self._grid_ranks: Dict[int, int] = {}
+        self.ready = False
+        # Database of the last rebuild, used again by reloads
+        self.session_factory = SessionLocal
+
+    def rebuild(self, db: Session):
+        """Reload the whole index from the database (startup)"""
+        self.session_factory = session_factory_for(db)
+        self.load(_active_cells_query(db).all())
+
+    def reload_grid(self, db: Session, grid_id: int):
+        """Reload the cells of one grid (created, resized or deactivated elsewhere)"""
+        rows = _active_cells_query(db).filter(models.GridCell.grid_id == grid_id).all()
+        with self._lock:
+            gone = set(self._grid_cells.get(grid_id, ()))
+            for cell_id, _, x, y, status, full_order_key in rows:
+                gone.discard(cell_id)
+                self._apply(cell_id, (grid_id, x, y, status, full_order_key))
+            for cell_id in gone:
+                self._forget(cell_id)
+                self._cells.pop(cell_id, None)
+            self._prune(grid_id)
+
+    def load(self, rows):
+        """Replace the index content with (id, grid_id, x, y, status, full_order_key) rows"""
+        with self._lock:
+            self._cells.clear()
+            self._by_order.clear()
+            self._free.clear()
+            self._free_ids.clear()
+            self._pools.clear()
+            self._grid_cells.clear()
+            self._grid_ids = []
+            self._grid_ranks = {}
+            for cell_id, grid_id, x, y, status, full_order_key in rows:
+                self._apply(cell_id, (grid_id, x, y, status, full_order_key))
+            self.ready = True
+
+    def has_grids(self) -> bool:
+        return bool(self._grid_ids)
+
+    def find_filling(self, full_order_key: str) -> Optional[int]:
+        """Cell id currently filling this order, if known"""
+        return self._by_order.get(full_order_key)
+
+    def claim_empty(self, total: Optional[int] = None, grid_ids: Optional[List[int]] = None) -> Optional[int]:
+        """
+        Take the free cell the allocation strategy picks for an order of total
+        products off the free lists of grid_ids (None = every grid).
+        The caller owns the cell until it commits a new state for it
+        (applied via stage_cell) or gives it back with release().
+        Use claim_empty_cell() from a session so the release is automatic.
+        """
+        with self._lock:
+            best = None
+            for grid_id in self._grid_ids if grid_ids is None else grid_ids:
+                grid_rank = self._grid_ranks.get(grid_id)
+                if grid_rank is None:
+                    continue
+                for pool_key in self._pools[grid_id]:
+                    top = self._peek_free(pool_key)
+                    if top is None:
+                        continue
+                    rank = self.strategy.rank(FreePool(
+                        grid_id,
+                        grid_rank,
+                        pool_key[1],
+                        top,
+                        len(self._free_ids[pool_key]),
+                        len(self._grid_cells[grid_id])
+                    ), total)
+                    if rank is not None and (best is None or rank < best[0]):
+                        best = (rank, pool_key)
+            if best is None:
+                return None
+            return self._pop_free(best[1])
+
+    def release(self, cell_id: int):
+        """Return a claimed cell to its free list (transaction rolled back)"""
+        with self._lock:
+            state = self._cells.get(cell_id)
+            if state and state[3] == "empty":
+                self._push_free(cell_id, state)
+
+    def sync_cell(self, cell_id: int, grid_id: int, position_x: int, position_y: int, status: str, full_order_key: Optional[str]):
+        """Apply the committed state of one cell"""
+        with self._lock:
+            self._apply(cell_id, (grid_id, position_x, position_y, status, full_order_key))
+
+    def remove_cell(self, cell_id: int):
+        with self._lock:
+            state = self._cells.get(cell_id)
+            if state:
+                self._forget(cell_id)
+                del self._cells[cell_id]
+                self._prune(state[0])
+
+    def free_count(self, grid_id: int) -> int:
+        return sum(len(self._free_ids[pool_key]) for pool_key in self._pools.get(grid_id, ()))
+
+    # Internal helpers - caller holds the lock
+
+    def _apply(self, cell_id: int, state: CellState):
+        self._forget(cell_id)
+        self._cells[cell_id] = state
+        grid_id, _, _, status, full_order_key = state
+        if grid_id not in self._grid_cells:
+            self._grid_cells[grid_id] = set()
+            self._pools[grid_id] = []
+            self._rank_grids()
+        self._grid_cells[grid_id].add(cell_id)
+        if status == "empty":
+            self._push_free(cell_id, state)
+        elif status == "filling" and full_order_key:
+            self._by_order[full_order_key] = cell_id
+
+    def _forget(self, cell_id: int):
+        state = self._cells.get(cell_id)
+        if not state:
+            return
+        grid_id, x, y, _, full_order_key = state
+        if full_order_key and self._by_order.get(full_order_key) == cell_id:
+            del self._by_order[full_order_key]
+        self._grid_cells[grid_id].discard(cell_id)
+        free_ids = self._free_ids.get((grid_id, self.strategy.cell_kind(x, y)))
+        if free_ids is not None:
+            free_ids.discard(cell_id)
+
+    def _prune(self, grid_id: int):
+        """Drop a grid whose last cell is gone (has_grids, claim_empty stop seeing it)"""
+        if grid_id not in self._grid_cells or self._grid_cells[grid_id]:
+            return
+        del self._grid_cells[grid_id]
+        for pool_key in self._pools.pop(grid_id):
+            del self._free[pool_key]
+            del self._free_ids[pool_key]
+        self._rank_grids()
+
+    def _rank_grids(self):
+        self._grid_ids = sorted(self._grid_cells)
+        self._grid_ranks = {grid_id: rank for rank, grid_id in enumerate(self._grid_ids)}
+
+    def _push_free(self, cell_id: int, state: CellState):
+        grid_id, x, y, _, _ = state
+        pool_key = (grid_id, self.strategy.cell_kind(x, y))
+        if pool_key not in self._free:
+            self._free[pool_key] = []
+            self._free_ids[pool_key] = set()
+            self._pools[grid_id].append(pool_key)
+        free_ids = self._free_ids[pool_key]
+        if cell_id in free_ids:
+            return
+        free_ids.add(cell_id)
+        heap = self._free[pool_key]
+        heapq.heappush(heap, (self.strategy.cell_key(x, y), cell_id))
+        # Cells that left the free list through sync stay in the heap until popped;
+        # compact once stale entries dominate
+        if len(heap) > 2 * len(free_ids) + 64:
+            heap[:] = [entry for entry in heap if entry[1] in free_ids]
+            heapq.heapify(heap)
+
+    def _peek_free(self, pool_key: PoolKey) -> Optional[tuple]:
+        """cell_key of the pool's best free cell (drops stale entries on top)"""
+        heap = self._free[pool_key]
+        free_ids = self._free_ids[pool_key]
+        while heap:
+            key, cell_id = heap[0]
+            if cell_id in free_ids:
+                return key
+            heapq.heappop(heap)
+        return None
+
+    def _pop_free(self, pool_key: PoolKey) -> Optional[int]:
+        heap = self._free[pool_key]
+        free_ids = self._free_ids[pool_key]
+        while heap:
+            _, cell_id = heapq.heappop(heap)
+            if cell_id in free_ids:
+                free_ids.discard(cell_id)
+                return cell_id
+        return None
+
+occupancy_index = CellOccupancyIndex()
+
+def claim_empty_cell(db: Session, total: Optional[int] = None, grid_ids: Optional[List[int]] = None) -> Optional[int]:
+    """Claim a free cell (of grid_ids) for an order of total products; it goes back to the free list on rollback"""
+    cell_id = occupancy_index.claim_empty(total, grid_ids)
+    if cell_id is not None:
+        on_rollback(db, lambda: occupancy_index.release(cell_id))
+    return cell_id
+
+def stage_cell(db: Session, cell: models.GridCell):
+    """Record the cell's new state; applied to the index when db commits"""
+    _staged(db)[cell.id] = (
+        cell.grid_id,
+        cell.position_x,
+        cell.position_y,
+        cell.status,
+        cell.current_full_order_key
+    )
+
+def stage_cell_removed(db: Session, cell_id: int):
+    _staged(db)[cell_id] = None
+
+def _staged(db: Session) -> dict:
+    info = transaction_info(db)
+    staged = info.get("occupancy")
+    if staged is None:
+        staged = info["occupancy"] = {}
+        on_commit(db, lambda: _apply_staged(staged))
+    return staged
+
+def _apply_staged(staged: dict):
+    for cell_id, state in staged.items():
+        if state is None:
+            occupancy_index.remove_cell(cell_id)
+        else:
+            occupancy_index.sync_cell(cell_id, *state)
+
+def apply_remote_events(events: List[dict]):
+    """
+    Keep this worker's index in step with cells changed by other workers
+    (grid events listener). Grid-level changes add/remove cells: reload that grid;
+    after a listener reconnect (resync) reload the whole index.
+    """
+    grid_ids = set()
+    for event in events:
+        if event.get("type") == "resync":
+            asyncio.get_running_loop().run_in_executor(None, _reload)
+            return
+        if event.get("type") == "cell":
+            cell = event["cell"]
+            occupancy_index.sync_cell(
+                cell["id"],
+                cell["grid_id"],
+                cell["position_x"],
+                cell["position_y"],
+                cell["status"],
+                cell["current_full_order_key"]
+            )
+        elif event.get("type") == "grid":
+            grid_ids.add(event["grid_id"])
+    if grid_ids:
+        asyncio.get_running_loop().run_in_executor(None, _reload_grids, sorted(grid_ids))
+
+def _reload():
+    with occupancy_index.session_factory() as db:
+        occupancy_index.rebuild(db)
+
+def _reload_grids(grid_ids: List[int]):
+    with occupancy_index.session_factory() as db:
+        for grid_id in grid_ids:
+            occupancy_index.reload_grid(db, grid_id)
+
+def _active_cells_query(db: Session):
+    """(id, grid_id, x, y, status, full_order_key) of the cells of active grids"""
+    return db.query(
+        models.GridCell.id,
+        models.GridCell.grid_id,
+        models.GridCell.position_x,
+        models.GridCell.position_y,
+        models.GridCell.status,
+        models.GridCell.current_full_order_key
+    ).join(models.Grid).filter(models.Grid.is_active == True)
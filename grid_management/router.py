@@ -1,9 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session, selectinload
-from typing import List
-from core.core.database import get_db
+import asyncio
+import json
+from datetime import datetime, timezone
 
-from . import crud, schemas, models
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import noload, selectinload
+from typing import List, Optional
+from core.core.database import AsyncSessionLocal, get_async_db
+from core.core.pagination import NEXT_CURSOR_HEADER, InvalidCursor, keyset_page, next_cursor, stream_ndjson
+
+from . import async_crud, crud, schemas, models, stats
+from .cache import LAYOUT, cell_version, grid_version, response_cache
+from .events import RESYNC, event_bus
+
+# Comment line sent on idle event streams so proxies keep the connection open
+STREAM_KEEPALIVE_SECONDS = 15
+
+# Rows per page of list endpoints without an explicit limit (stream=true for everything)
+LIST_PAGE_SIZE = 100
 
 router = APIRouter(
     prefix="/api/grid",
@@ -13,16 +29,17 @@ router = APIRouter(
 # Grid Management Endpoints
 
 @router.post("/create", response_model=schemas.GridResponse)
-def create_grid(
+async def create_grid(
     grid: schemas.GridCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Tạo lưới mới với kích thước width x height
     Tự động tạo tất cả các ô trong lưới
+    routing_keys (tùy chọn): chỉ nhận sản phẩm của khu vực/size này, VD ["VA-M", "VA-*"]
     """
     try:
-        db_grid = crud.create_grid(db=db, grid=grid)
+        db_grid = await async_crud.create_grid(db=db, grid=grid)
         return db_grid
     except Exception as e:
         raise HTTPException(
@@ -30,41 +47,95 @@ def create_grid(
             detail=f"Không thể tạo lưới: {str(e)}"
         )
 
+@router.post("/create/bulk", response_model=List[schemas.GridResponse])
+async def create_grids(
+    payload: schemas.BulkGridCreate,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Tạo nhiều lưới trong một transaction (khai báo khu kho mới)
+    - Tất cả ô của mọi lưới được ghi bằng lệnh INSERT nhiều dòng
+    - Trả về các lưới theo đúng thứ tự gửi lên
+    """
+    try:
+        return await async_crud.create_grids(db=db, grids=payload.grids)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Không thể tạo lưới: {str(e)}"
+        )
+
 @router.get("/list", response_model=List[schemas.GridResponse])
-def get_grids(
+async def get_grids(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Lấy danh sách tất cả lưới"""
-    grids = crud.get_grids(db=db, skip=skip, limit=limit)
+    grids = await async_crud.get_grids(db=db, skip=skip, limit=limit)
     return grids
 
 @router.get("/{grid_id}", response_model=schemas.GridWithCellsResponse)
-def get_grid_detail(
+async def get_grid_detail(
     grid_id: int,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Lấy chi tiết lưới kèm tất cả ô và sản phẩm"""
-    grid = db.query(models.Grid).options(
-        selectinload(models.Grid.cells).selectinload(models.GridCell.products)
-    ).filter(models.Grid.id == grid_id).first()
+    """
+    Lấy chi tiết lưới kèm tất cả ô và sản phẩm
+    Có cache + ETag: gửi If-None-Match để nhận 304 khi lưới chưa thay đổi
+    """
+    async def build():
+        grid = await async_crud.get_grid_with_cells(db=db, grid_id=grid_id)
+        if not grid:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Không tìm thấy lưới"
+            )
+        return schemas.GridWithCellsResponse.model_validate(grid).model_dump_json().encode()
     
-    if not grid:
+    return await _cached_view(request, "grid", (grid_id,), (grid_version(grid_id),), build)
+
+@router.get("/{grid_id}/snapshot")
+async def get_grid_snapshot(
+    grid_id: int,
+    request: Request,
+    layout: str = "rows",
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Trạng thái gọn của lưới - KHÔNG kèm sản phẩm (dùng cho màn hình hiển thị lưới)
+    - Mỗi ô: trạng thái, số lượng, mã đơn hàng, ghi chú
+    - layout=rows: danh sách "cells", mỗi ô một object
+    - layout=columns: "columns", mỗi trường một mảng (payload nhỏ hơn với lưới lớn)
+    - Sản phẩm của từng ô lấy riêng qua /cell/{cell_id}/products khi cần
+    - Có cache + ETag: màn hình polling gửi If-None-Match để nhận 304 khi lưới chưa thay đổi
+    """
+    if layout not in ("rows", "columns"):
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Không tìm thấy lưới"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="layout không hợp lệ. Chỉ chấp nhận: rows, columns"
         )
-    return grid
+    
+    async def build():
+        snapshot = await async_crud.get_grid_snapshot(db=db, grid_id=grid_id, columns=layout == "columns")
+        if not snapshot:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Không tìm thấy lưới"
+            )
+        return json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode()
+    
+    return await _cached_view(request, "snapshot", (grid_id, layout), (grid_version(grid_id),), build)
 
 @router.put("/{grid_id}", response_model=schemas.GridResponse)
-def update_grid(
+async def update_grid(
     grid_id: int,
     grid_update: schemas.GridUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Cập nhật lưới (tên hoặc kích thước)
+    Cập nhật lưới (tên, kích thước hoặc routing_keys)
     
     **Tăng kích thước:**
     - Tự động tạo thêm các ô mới
@@ -76,8 +147,12 @@ def update_grid(
     
     **Chỉ đổi tên:**
     - Không ảnh hưởng đến cells
+    
+    **routing_keys:**
+    - Khu vực sản xuất / size mà lưới nhận: VA-M, VA-*, *-L ([] = nhận mọi sản phẩm)
+    - Sản phẩm đang nằm trong lưới không bị ảnh hưởng
     """
-    result = crud.update_grid(db=db, grid_id=grid_id, grid_update=grid_update)
+    result = await async_crud.update_grid(db=db, grid_id=grid_id, grid_update=grid_update)
     
     if not result["success"]:
         raise HTTPException(
@@ -87,12 +162,67 @@ def update_grid(
     
     return result["grid"]
 
+@router.get("/{grid_id}/events")
+async def stream_grid_events(
+    grid_id: int,
+    request: Request
+):
+    """
+    Luồng cập nhật trạng thái lưới theo thời gian thực (Server-Sent Events)
+    - Sự kiện đầu tiên "snapshot": trạng thái tất cả ô (không kèm sản phẩm)
+    - Sau đó là các sự kiện "cell" khi ô thay đổi (thêm sản phẩm, giải phóng, ghi chú, đổi trạng thái)
+    - Sự kiện "grid" (đổi kích thước) hoặc khi client bị chậm: gửi lại "snapshot" mới
+    """
+    async def load_snapshot():
+        # Own short-lived session: the stream must not hold a pooled connection
+        async with AsyncSessionLocal() as db:
+            return await async_crud.get_grid_snapshot(db=db, grid_id=grid_id)
+    
+    # Subscribe before reading the snapshot so no change can fall in between
+    subscriber = event_bus.subscribe(grid_id)
+    snapshot = await load_snapshot()
+    if not snapshot:
+        event_bus.unsubscribe(subscriber)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Không tìm thấy lưới"
+        )
+    
+    async def event_stream():
+        try:
+            yield _sse("snapshot", snapshot)
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), timeout=STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                
+                if event is RESYNC or event["type"] == "grid":
+                    current = await load_snapshot()
+                    if not current:
+                        break
+                    yield _sse("snapshot", current)
+                else:
+                    yield _sse(event["type"], event)
+        finally:
+            event_bus.unsubscribe(subscriber)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _sse(event_type: str, data: dict) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 # Product Assignment Endpoints
 
 @router.post("/assign-product", response_model=schemas.ProductAssignmentResponse)
-def assign_product(
+async def assign_product(
     product: schemas.ProductInput,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Quét và phân bổ sản phẩm tự động
@@ -102,7 +232,7 @@ def assign_product(
     - Tự động phân bổ vào ô cùng order hoặc ô trống
     - Trả về thông tin chi tiết về vị trí đã phân bổ
     """
-    result = crud.assign_product_to_cell(db=db, product_input=product)
+    result = await async_crud.assign_product_to_cell(db=db, product_input=product)
     
     if not result["success"]:
         if result.get("duplicate"):
@@ -118,24 +248,61 @@ def assign_product(
     
     return result
 
+@router.post("/assign-product/bulk", response_model=schemas.BulkAssignmentResponse)
+async def assign_products_bulk(
+    payload: schemas.BulkProductInput,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Quét và phân bổ nhiều sản phẩm trong một transaction
+    - Dùng cho trạm phân loại quét liên tục (mỗi lô tối đa 1000 sản phẩm)
+    - Kiểm tra trùng lặp cả lô bằng một truy vấn
+    - Trả về kết quả cho từng sản phẩm theo đúng thứ tự gửi lên
+    - Sản phẩm trùng lặp/sai định dạng chỉ bị từ chối riêng, không ảnh hưởng các sản phẩm khác
+    """
+    results = await async_crud.assign_products_bulk(db=db, product_inputs=payload.products)
+    assigned = sum(1 for result in results if result["success"])
+    
+    return {
+        "total": len(results),
+        "assigned": assigned,
+        "failed": len(results) - assigned,
+        "results": results
+    }
+
 @router.get("/product/{product_code}/check")
-def check_product_duplicate(
+async def check_product_duplicate(
     product_code: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Kiểm tra sản phẩm đã tồn tại chưa"""
-    exists = crud.check_product_exists(db=db, product_code=product_code)
+    exists = await async_crud.check_product_exists(db=db, product_code=product_code)
     return {
         "product_code": product_code,
         "exists": exists,
         "message": "Sản phẩm đã tồn tại" if exists else "Sản phẩm chưa tồn tại"
     }
 
+@router.get("/product/{product_code}/shipments", response_model=List[schemas.ShippedProductResponse])
+async def get_product_shipments(
+    product_code: str,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Tra cứu mã sản phẩm trong các lần giao hàng trước (kho lưu trữ shipped_products)
+    - Mới nhất trước; danh sách rỗng nếu chưa từng giao
+    """
+    return await async_crud.get_shipped_products(db=db, product_code=product_code)
+
 # Cell Management Endpoints
 
 @router.get("/cells/ready-to-ship", response_model=List[schemas.GridCellResponse])
-def get_cells_ready_to_ship(
-    db: Session = Depends(get_db)
+async def get_cells_ready_to_ship(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, le=1000),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Lấy danh sách các ô sẵn sàng giao hàng (status = "full")
@@ -143,75 +310,153 @@ def get_cells_ready_to_ship(
     **Dùng cho:**
     - Admin xem các ô đã đầy, cần lấy hàng đi giao
     - Sắp xếp theo thời gian đầy (filled_at) - ô nào đầy trước sẽ hiện trước
+    
+    **Phân trang:**
+    - limit: số ô mỗi trang (mặc định 100, tối đa 1000); header X-Next-Cursor chứa cursor của trang kế tiếp
+    - cursor: lấy tiếp sau trang trước
+    - stream=true: trả về NDJSON (mỗi dòng một ô) cho tất cả ô còn lại - cách duy nhất để lấy hết trong một lần
     """
-    cells = db.query(models.GridCell).options(
+    keys = (models.GridCell.filled_at, models.GridCell.id)
+    query = select(models.GridCell).options(
         selectinload(models.GridCell.products)
-    ).filter(
+    ).where(
         models.GridCell.status == "full"
-    ).order_by(
-        models.GridCell.filled_at.asc()
-    ).all()
-    
-    return cells
+    )
+    return await _list_page(db, response, query, keys, cursor, limit, stream, schemas.GridCellResponse)
 
-@router.get("/cells/by-status/{status}", response_model=List[schemas.GridCellResponse])
-def get_cells_by_status(
-    status: str,
-    db: Session = Depends(get_db)
+@router.get("/cells/by-status/{cell_status}", response_model=List[schemas.GridCellResponse])
+async def get_cells_by_status(
+    cell_status: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, le=1000),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Lấy danh sách ô theo trạng thái
+    Lấy danh sách ô theo trạng thái (mới cập nhật trước)
     
     **Trạng thái:**
     - empty: Ô trống
     - filling: Đang nhận hàng
     - full: Đã đầy (sẵn sàng giao)
+    
+    **Phân trang:** limit (mặc định 100) / cursor (header X-Next-Cursor), stream=true trả về NDJSON
     """
     valid_statuses = ["empty", "filling", "full"]
-    if status not in valid_statuses:
+    if cell_status not in valid_statuses:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Trạng thái không hợp lệ. Chỉ chấp nhận: {', '.join(valid_statuses)}"
         )
     
-    cells = db.query(models.GridCell).options(
+    keys = (models.GridCell.updated_at, models.GridCell.id)
+    query = select(models.GridCell).options(
         selectinload(models.GridCell.products)
-    ).filter(
-        models.GridCell.status == status
-    ).order_by(
-        models.GridCell.updated_at.desc()
-    ).all()
+    ).where(
+        models.GridCell.status == cell_status
+    )
+    return await _list_page(db, response, query, keys, cursor, limit, stream, schemas.GridCellResponse, descending=True)
+
+@router.post("/cells/clear", response_model=schemas.BulkClearResponse)
+async def clear_cells(
+    payload: schemas.BulkClearInput,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Giải phóng nhiều ô một lần (giao hàng theo đợt) trong một transaction
+    - cell_ids: danh sách ô cần giải phóng
+    - hoặc grid_id (+ filled_before): mọi ô "full" của lưới, đầy trước thời điểm filled_before
+    - Trả về kết quả từng ô; ô trống/không tồn tại chỉ bị báo lỗi riêng
+    """
+    if (payload.cell_ids is None) == (payload.grid_id is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cần truyền cell_ids hoặc grid_id (chỉ một trong hai)"
+        )
+    if payload.filled_before is not None and payload.grid_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="filled_before chỉ dùng cùng grid_id"
+        )
     
-    return cells
+    results = await async_crud.clear_cells(
+        db=db,
+        cell_ids=payload.cell_ids,
+        grid_id=payload.grid_id,
+        filled_before=payload.filled_before
+    )
+    if results is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Không tìm thấy lưới"
+        )
+    cleared = sum(1 for result in results if result["success"])
+    
+    return {
+        "total": len(results),
+        "cleared": cleared,
+        "failed": len(results) - cleared,
+        "results": results
+    }
 
 @router.get("/cell/{cell_id}/detail", response_model=schemas.CellDetailResponse)
-def get_cell_detail(
+async def get_cell_detail(
     cell_id: int,
-    db: Session = Depends(get_db)
+    request: Request,
+    history_limit: int = Query(20, ge=0, le=200),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Lấy chi tiết ô bao gồm:
     - Thông tin ô
     - Danh sách sản phẩm hiện tại (với timestamp created_at)
-    - Lịch sử giao hàng của ô
+    - history_limit dòng lịch sử gần nhất của ô (mới nhất trước)
+    - history_next_cursor: đọc tiếp lịch sử qua /cell/{cell_id}/history?cursor=...
+    Có cache + ETag: gửi If-None-Match để nhận 304 khi ô chưa thay đổi
     """
-    cell = db.query(models.GridCell).options(
-        selectinload(models.GridCell.products),
-        selectinload(models.GridCell.histories)
-    ).filter(models.GridCell.id == cell_id).first()
-    
-    if not cell:
+    async def build():
+        cell = (await db.execute(
+            select(models.GridCell).options(
+                selectinload(models.GridCell.products),
+                noload(models.GridCell.histories)
+            ).where(models.GridCell.id == cell_id)
+        )).scalars().first()
+        
+        if not cell:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Không tìm thấy ô"
+            )
+        
+        detail = schemas.CellDetailResponse.model_validate(cell)
+        if history_limit:
+            histories = await async_crud.get_cell_histories(db=db, cell_id=cell_id, limit=history_limit)
+            detail.histories = [schemas.CellHistoryResponse.model_validate(history) for history in histories]
+            detail.history_next_cursor = next_cursor(histories, crud.HISTORY_KEYS, history_limit)
+        return detail.model_dump_json().encode()
+    
+    return await _cached_view(request, "cell", (cell_id, history_limit), (cell_version(cell_id), LAYOUT), build)
+
+@router.get("/cell/{cell_id}/products", response_model=List[schemas.ProductResponse])
+async def get_cell_products(
+    cell_id: int,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Lấy danh sách sản phẩm hiện có trong ô (theo thứ tự quét)"""
+    products = await async_crud.get_cell_products(db=db, cell_id=cell_id)
+    if products is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Không tìm thấy ô"
         )
-    return cell
+    return products
 
 @router.put("/cell/{cell_id}/status")
-def update_cell_status(
+async def update_cell_status(
     cell_id: int,
     status_update: schemas.CellStatusUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Cập nhật trạng thái của ô
@@ -224,7 +469,7 @@ def update_cell_status(
     - Dùng API này để đổi "filling" ↔ "full" (thủ công)
     - Dùng `/cell/{id}/clear` để giải phóng ô (tương đương đổi về "empty")
     """
-    cell = db.query(models.GridCell).filter(models.GridCell.id == cell_id).first()
+    cell = await db.get(models.GridCell, cell_id)
     if not cell:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -241,7 +486,7 @@ def update_cell_status(
     
     # Nếu đổi sang "empty" → Phải clear hết data (giống clear_cell)
     if status_update.status == "empty":
-        success = crud.clear_cell(db=db, cell_id=cell_id)
+        success = await async_crud.clear_cell(db=db, cell_id=cell_id)
         if not success:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -259,48 +504,27 @@ def update_cell_status(
         }
     
     # Nếu đổi filling/full → Chỉ update status
-    old_status = cell.status
-    cell.status = status_update.status
-    
-    # Cập nhật filled_at nếu chuyển sang full
-    if status_update.status == "full" and old_status != "full":
-        from datetime import datetime
-        cell.filled_at = datetime.utcnow()
-    
-    # Log: Đổi status thủ công
-    crud.log_cell_history(
-        db=db,
-        cell_id=cell_id,
-        action_type="status_changed",
-        description=f"Ô {cell.cell_name} đổi từ '{old_status}' → '{status_update.status}' (thủ công)",
-        order_code=cell.current_order_code,
-        order_date=cell.current_order_date,
-        old_data={"status": old_status},
-        new_data={"status": status_update.status, "filled_at": cell.filled_at.isoformat() if cell.filled_at else None}
-    )
-    
-    db.commit()
-    db.refresh(cell)
+    result = await async_crud.update_cell_status(db=db, cell_id=cell_id, new_status=status_update.status)
     
     return {
         "success": True,
-        "message": f"Đã cập nhật trạng thái ô {cell.cell_name} từ '{old_status}' thành '{status_update.status}'",
+        "message": f"Đã cập nhật trạng thái ô {result['cell_name']} từ '{result['old_status']}' thành '{result['new_status']}'",
         "cell_id": cell_id,
-        "cell_name": cell.cell_name,
-        "old_status": old_status,
-        "new_status": status_update.status,
+        "cell_name": result["cell_name"],
+        "old_status": result["old_status"],
+        "new_status": result["new_status"],
         "history_created": False,
         "data_cleared": False
     }
 
 @router.put("/cell/{cell_id}/note")
-def update_cell_note(
+async def update_cell_note(
     cell_id: int,
     note_update: schemas.CellNoteUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Cập nhật ghi chú cho ô"""
-    success = crud.update_cell_note(db=db, cell_id=cell_id, note=note_update.note)
+    success = await async_crud.update_cell_note(db=db, cell_id=cell_id, note=note_update.note)
     if not success:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -315,18 +539,18 @@ def update_cell_note(
     }
 
 @router.post("/cell/{cell_id}/clear")
-def clear_cell(
+async def clear_cell(
     cell_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Giải phóng ô - giao hàng
-    - Chuyển tất cả sản phẩm vào lịch sử
+    - Chuyển tất cả sản phẩm vào kho lưu trữ shipped_products
     - Reset ô về trạng thái empty
     - Xóa ghi chú
     - Cập nhật order tracking thành shipped
     """
-    success = crud.clear_cell(db=db, cell_id=cell_id)
+    success = await async_crud.clear_cell(db=db, cell_id=cell_id)
     if not success:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -340,28 +564,51 @@ def clear_cell(
     }
 
 @router.get("/cell/{cell_id}/history", response_model=List[schemas.CellHistoryResponse])
-def get_cell_history(
+async def get_cell_history(
     cell_id: int,
-    db: Session = Depends(get_db)
+    response: Response,
+    action_type: Optional[List[str]] = Query(None),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Lấy lịch sử của ô"""
-    histories = crud.get_cell_histories(db=db, cell_id=cell_id)
-    return histories
+    """
+    Lấy lịch sử của ô (mới nhất trước)
+    
+    **Bộ lọc:**
+    - action_type (lặp lại được): product_added, status_changed, note_updated, cell_cleared
+    - since / until: khoảng thời gian [since, until) theo created_at (UTC)
+    
+    **Phân trang:** limit / cursor (header X-Next-Cursor), stream=true trả về NDJSON
+    """
+    query = crud.cell_histories_query(cell_id, action_type, _naive_utc(since), _naive_utc(until))
+    return await _list_page(db, response, query, crud.HISTORY_KEYS, cursor, limit, stream, schemas.CellHistoryResponse, descending=True)
+
+def _naive_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    """Timestamps are stored as naive UTC"""
+    if moment is not None and moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
 
 # Order Tracking Endpoints
 
 @router.get("/order/{full_order_key}", response_model=schemas.OrderTrackingResponse)
-def get_order_status(
+async def get_order_status(
     full_order_key: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Lấy trạng thái đơn hàng theo full_order_key
     VD: VA-M-000126-101725 (order_code-order_date)
     """
-    order = db.query(models.OrderTracking).filter(
-        models.OrderTracking.full_order_key == full_order_key
-    ).first()
+    order = (await db.execute(
+        select(models.OrderTracking).where(
+            models.OrderTracking.full_order_key == full_order_key
+        )
+    )).scalars().first()
     
     if not order:
         raise HTTPException(
@@ -372,68 +619,139 @@ def get_order_status(
     return order
 
 @router.get("/orders/list", response_model=List[schemas.OrderTrackingResponse])
-def get_all_orders(
+async def get_all_orders(
+    response: Response,
     status_filter: str = None,
     skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db)
+    limit: int = LIST_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Lấy danh sách đơn hàng
+    Lấy danh sách đơn hàng (mới tạo trước)
     status_filter: pending, filling, completed, shipped
+    
+    **Phân trang:**
+    - Nên dùng cursor thay cho skip: header X-Next-Cursor chứa cursor của trang kế tiếp
+      (trang sâu vẫn nhanh như trang đầu)
+    - skip chỉ áp dụng khi không có cursor
+    - stream=true: trả về NDJSON (mỗi dòng một đơn hàng) cho tất cả đơn còn lại
     """
-    query = db.query(models.OrderTracking)
+    query = select(models.OrderTracking)
     
     if status_filter:
-        query = query.filter(models.OrderTracking.status == status_filter)
+        query = query.where(models.OrderTracking.status == status_filter)
+    if skip and not cursor and not stream:
+        query = query.offset(skip)
     
-    orders = query.order_by(models.OrderTracking.created_at.desc()).offset(skip).limit(limit).all()
-    return orders
+    keys = (models.OrderTracking.created_at, models.OrderTracking.id)
+    return await _list_page(db, response, query, keys, cursor, limit, stream, schemas.OrderTrackingResponse, descending=True)
 
-# Statistics Endpoints
-
-@router.get("/stats/summary")
-def get_system_summary(db: Session = Depends(get_db)):
-    """Lấy thống kê tổng quan hệ thống"""
+async def _list_page(
+    db: AsyncSession,
+    response: Response,
+    query,
+    keys,
+    cursor: Optional[str],
+    limit: int,
+    stream: bool,
+    schema,
+    descending: bool = False
+):
+    """
+    One keyset page of query (X-Next-Cursor header when more rows may follow),
+    or with stream=true every remaining row as NDJSON
+    """
+    try:
+        page = keyset_page(query, keys, cursor, descending=descending)
+    except InvalidCursor:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor không hợp lệ"
+        )
     
-    # Thống kê lưới
-    total_grids = db.query(models.Grid).filter(models.Grid.is_active == True).count()
-    total_cells = db.query(models.GridCell).count()
+    if stream:
+        return stream_ndjson(query, keys, schema, cursor, descending=descending)
     
-    # Thống kê ô
-    empty_cells = db.query(models.GridCell).filter(models.GridCell.status == "empty").count()
-    filling_cells = db.query(models.GridCell).filter(models.GridCell.status == "filling").count()
-    full_cells = db.query(models.GridCell).filter(models.GridCell.status == "full").count()
+    items = (await db.execute(page.limit(limit))).scalars().all()
     
-    # Thống kê sản phẩm
-    total_products = db.query(models.Product).count()
+    following = next_cursor(items, keys, limit)
+    if following:
+        response.headers[NEXT_CURSOR_HEADER] = following
+    return items
+
+async def _cached_view(request: Request, name: str, params: tuple, version_keys: tuple, build) -> Response:
+    """
+    JSON view served from the response cache: 304 if If-None-Match still matches
+    the view's current versions, cached body if present, else build() (bytes) and cache it
+    """
+    etag = response_cache.etag(name, params, version_keys)
+    if etag is None:
+        return Response(await build(), media_type="application/json")
+    
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))):
+        response_cache.not_modified += 1
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    body = response_cache.get(etag)
+    if body is None:
+        body = await build()
+        response_cache.set(etag, body)
+    return Response(body, media_type="application/json", headers=headers)
+
+# Statistics Endpoints
+
+@router.get("/stats/summary")
+async def get_system_summary(
+    fresh: bool = False,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Lấy thống kê tổng quan hệ thống
+    - Mặc định đọc từ bảng bộ đếm (stat_counters), cập nhật cùng transaction với mỗi thay đổi
+    - fresh=true: tính lại từ các bảng gốc và trả thêm "drift" (chênh lệch bộ đếm so với thực tế)
+    """
+    counters = await db.run_sync(stats.read_counters)
+    summary_counters = counters
+    drift = None
+    
+    if fresh:
+        summary_counters = await db.run_sync(stats.compute_counters)
+        drift = {
+            name: counters[name] - value
+            for name, value in summary_counters.items()
+            if counters[name] != value
+        }
     
-    # Thống kê đơn hàng
-    total_orders = db.query(models.OrderTracking).count()
-    pending_orders = db.query(models.OrderTracking).filter(models.OrderTracking.status == "pending").count()
-    filling_orders = db.query(models.OrderTracking).filter(models.OrderTracking.status == "filling").count()
-    completed_orders = db.query(models.OrderTracking).filter(models.OrderTracking.status == "completed").count()
-    shipped_orders = db.query(models.OrderTracking).filter(models.OrderTracking.status == "shipped").count()
+    total_cells = summary_counters["cells.total"]
+    filling_cells = summary_counters["cells.filling"]
+    full_cells = summary_counters["cells.full"]
     
-    return {
+    summary = {
         "grids": {
-            "total": total_grids,
+            "total": summary_counters["grids.total"],
             "total_cells": total_cells
         },
         "cells": {
-            "empty": empty_cells,
+            "empty": summary_counters["cells.empty"],
             "filling": filling_cells,
             "full": full_cells,
             "utilization_rate": round((filling_cells + full_cells) / total_cells * 100, 2) if total_cells > 0 else 0
         },
         "products": {
-            "total": total_products
+            "total": summary_counters["products.total"]
         },
         "orders": {
-            "total": total_orders,
-            "pending": pending_orders,
-            "filling": filling_orders,
-            "completed": completed_orders,
-            "shipped": shipped_orders
+            "total": summary_counters["orders.total"],
+            "pending": summary_counters["orders.pending"],
+            "filling": summary_counters["orders.filling"],
+            "completed": summary_counters["orders.completed"],
+            "shipped": summary_counters["orders.shipped"]
         }
     }
+    if drift is not None:
+        summary["drift"] = drift
+    return summary
@@ -0,0 +1,135 @@
+"""
+Product routing: which grids may receive a product
+
+Grids are tagged with routing keys "<production_area>-<size_code>", where either
+part may be "*" (VA-M, VA-*, *-L). A scan's candidate grids come from an
+in-memory table keyed on the fields parse_product_code extracts, tried from
+the most specific match to the least:
+    VA-M grids -> VA-* grids -> *-M grids -> untagged grids
+so allocation only scans the free lists of the product's own zone (falling back
+to wildcard and untagged grids, never to grids of another zone). Without any
+tagged grid every active grid is a candidate, as before.
+
+The table is rebuilt at startup and on grid changes from other workers (grid
+events); local grid writes stage their routing and apply it on commit.
+"""
+import asyncio
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from core.core.database import SessionLocal, on_commit, session_factory_for, transaction_info
+from . import models
+
+ANY = "*"
+
+def normalize_key(key: str) -> str:
+    """'va' -> 'VA-*', ' va-m ' -> 'VA-M'; raises ValueError for anything else"""
+    parts = key.strip().upper().split("-")
+    if len(parts) == 1:
+        parts.append(ANY)
+    if len(parts) != 2 or not all(part == ANY or part.isalnum() for part in parts):
+        raise ValueError(f"Invalid routing key '{key}', expected <production_area>-<size_code> (* = any)")
+    return "-".join(parts)
+
+def split_keys(value: Optional[str]) -> List[str]:
+    """Stored form (comma-separated) -> list"""
+    return [key for key in (value or "").split(",") if key]
+
+def join_keys(keys: Optional[Iterable[str]]) -> Optional[str]:
+    """List -> stored form; None/empty -> NULL (untagged grid)"""
+    keys = list(dict.fromkeys(normalize_key(key) for key in keys or ()))
+    return ",".join(keys) or None
+
+class RoutingTable:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._grids: Dict[int, List[str]] = {}
+        self._by_key: Dict[str, List[int]] = {}
+        self._untagged: List[int] = []
+        self._cache: Dict[Tuple[str, str], List[List[int]]] = {}
+        self.ready = False
+        # Database of the last rebuild, used again by reloads
+        self.session_factory = SessionLocal
+
+    def rebuild(self, db: Session):
+        self.session_factory = session_factory_for(db)
+        rows = db.query(models.Grid.id, models.Grid.routing_keys).filter(models.Grid.is_active == True).all()
+        with self._lock:
+            self._grids = {grid_id: split_keys(keys) for grid_id, keys in rows}
+            self._reindex()
+            self.ready = True
+
+    def set_grid(self, grid_id: int, keys: Optional[List[str]]):
+        """Apply a committed grid: keys None = grid removed/inactive, [] = untagged"""
+        with self._lock:
+            if keys is None:
+                self._grids.pop(grid_id, None)
+            else:
+                self._grids[grid_id] = keys
+            self._reindex()
+
+    def candidates(self, production_area: str, size_code: str) -> Optional[List[List[int]]]:
+        """
+        Candidate grid ids per preference level, most specific first.
+        None: no grid is tagged, every active grid is a candidate.
+        """
+        cache_key = (production_area.upper(), size_code.upper())
+        levels = self._cache.get(cache_key)
+        if levels is not None:
+            return levels
+        with self._lock:
+            if len(self._untagged) == len(self._grids):
+                return None
+            area, size = cache_key
+            levels = [
+                grid_ids
+                for grid_ids in (
+                    self._by_key.get(f"{area}-{size}"),
+                    self._by_key.get(f"{area}-{ANY}"),
+                    self._by_key.get(f"{ANY}-{size}"),
+                    self._untagged,
+                )
+                if grid_ids
+            ]
+            self._cache[cache_key] = levels
+        return levels
+
+    def _reindex(self):
+        # Caller holds the lock
+        by_key: Dict[str, List[int]] = {}
+        untagged = []
+        for grid_id in sorted(self._grids):
+            keys = [key for key in self._grids[grid_id] if key != f"{ANY}-{ANY}"]
+            if not keys:
+                untagged.append(grid_id)
+            for key in keys:
+                by_key.setdefault(key, []).append(grid_id)
+        self._by_key = by_key
+        self._untagged = untagged
+        self._cache = {}
+
+routing_table = RoutingTable()
+
+def stage_grid(db: Session, grid_id: int, routing_keys: Optional[str], is_active: bool = True):
+    """Record a grid's routing (stored form); applied to the table when db commits"""
+    info = transaction_info(db)
+    staged = info.get("routing")
+    if staged is None:
+        staged = info["routing"] = {}
+        on_commit(db, lambda: _apply_staged(staged))
+    staged[grid_id] = split_keys(routing_keys) if is_active else None
+
+def _apply_staged(staged: dict):
+    for grid_id, keys in staged.items():
+        routing_table.set_grid(grid_id, keys)
+
+def apply_remote_events(events: List[dict]):
+    """Grids created/changed by other workers, or events missed (listener reconnect): reload the table"""
+    if any(event.get("type") in ("grid", "resync") for event in events):
+        asyncio.get_running_loop().run_in_executor(None, _reload)
+
+def _reload():
+    with routing_table.session_factory() as db:
+        routing_table.rebuild(db)
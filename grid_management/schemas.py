@@ -1,6 +1,14 @@
 from pydantic import BaseModel, Field, validator
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, timezone
+
+from core.core.config import settings
+from .routing import normalize_key, split_keys
+
+def _normalize_routing_keys(keys: Optional[List[str]]) -> Optional[List[str]]:
+    if keys is None:
+        return None
+    return list(dict.fromkeys(normalize_key(key) for key in keys))
 
 # Product Input Schema (from FE)
 class ProductInput(BaseModel):
@@ -11,16 +19,39 @@ class ProductInput(BaseModel):
     number: str = Field(..., description="Product sequence number")
     total: str = Field(..., description="Total products")
 
+class BulkProductInput(BaseModel):
+    products: List[ProductInput] = Field(..., min_length=1, max_length=1000, description="Scanned products (1-1000)")
+
 # Grid Schemas
+ROUTING_KEYS_DESCRIPTION = "Routing keys <production_area>-<size_code>, * = any (VA-M, VA-*, *-L); empty = any product"
+
 class GridCreate(BaseModel):
     name: str = Field(..., description="Grid name")
-    width: int = Field(..., gt=0, le=20, description="Grid width (1-20)")
-    height: int = Field(..., gt=0, le=20, description="Grid height (1-20)")
+    width: int = Field(..., gt=0, le=settings.GRID_MAX_WIDTH, description=f"Grid width (1-{settings.GRID_MAX_WIDTH})")
+    height: int = Field(..., gt=0, le=settings.GRID_MAX_HEIGHT, description=f"Grid height (1-{settings.GRID_MAX_HEIGHT})")
+    routing_keys: Optional[List[str]] = Field(None, description=ROUTING_KEYS_DESCRIPTION)
+    
+    @validator("routing_keys")
+    def valid_routing_keys(cls, value):
+        return _normalize_routing_keys(value)
+
+class BulkGridCreate(BaseModel):
+    grids: List[GridCreate] = Field(
+        ...,
+        min_length=1,
+        max_length=settings.GRID_BULK_MAX_GRIDS,
+        description=f"Grids to create (1-{settings.GRID_BULK_MAX_GRIDS})"
+    )
 
 class GridUpdate(BaseModel):
     name: Optional[str] = Field(None, description="New grid name")
-    width: Optional[int] = Field(None, gt=0, le=20, description="New width (1-20)")
-    height: Optional[int] = Field(None, gt=0, le=20, description="New height (1-20)")
+    width: Optional[int] = Field(None, gt=0, le=settings.GRID_MAX_WIDTH, description=f"New width (1-{settings.GRID_MAX_WIDTH})")
+    height: Optional[int] = Field(None, gt=0, le=settings.GRID_MAX_HEIGHT, description=f"New height (1-{settings.GRID_MAX_HEIGHT})")
+    routing_keys: Optional[List[str]] = Field(None, description=f"New routing keys ([] = any product). {ROUTING_KEYS_DESCRIPTION}")
+    
+    @validator("routing_keys")
+    def valid_routing_keys(cls, value):
+        return _normalize_routing_keys(value)
 
 class GridResponse(BaseModel):
     id: int
@@ -30,6 +61,12 @@ class GridResponse(BaseModel):
     total_cells: int
     created_at: datetime
     is_active: bool
+    routing_keys: List[str] = []
+    
+    @validator("routing_keys", pre=True)
+    def split_routing_keys(cls, value):
+        # Stored as a comma-separated string
+        return split_keys(value) if value is None or isinstance(value, str) else value
     
     class Config:
         from_attributes = True
@@ -53,6 +90,24 @@ class ProductResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ShippedProductResponse(BaseModel):
+    product_id: int
+    product_code: str
+    cell_id: int
+    grid_id: Optional[int]
+    full_order_key: Optional[str]
+    size: Optional[str]
+    color: Optional[str]
+    qr_data: Optional[str]
+    number: Optional[int]
+    total: Optional[int]
+    order_date: Optional[str]
+    scanned_at: Optional[datetime]
+    shipped_at: datetime
+    
+    class Config:
+        from_attributes = True
+
 # Cell Schemas
 class GridCellResponse(BaseModel):
     id: int
@@ -83,8 +138,13 @@ class GridWithCellsResponse(BaseModel):
     total_cells: int
     created_at: datetime
     is_active: bool
+    routing_keys: List[str] = []
     cells: List[GridCellResponse] = []
     
+    @validator("routing_keys", pre=True)
+    def split_routing_keys(cls, value):
+        return split_keys(value) if value is None or isinstance(value, str) else value
+    
     class Config:
         from_attributes = True
 
@@ -92,6 +152,18 @@ class GridWithCellsResponse(BaseModel):
 class CellNoteUpdate(BaseModel):
     note: Optional[str] = Field(None, description="Cell note")
 
+class BulkClearInput(BaseModel):
+    cell_ids: Optional[List[int]] = Field(None, min_length=1, max_length=10000, description="Cells to clear (1-10000)")
+    grid_id: Optional[int] = Field(None, description="Or: every full cell of this grid")
+    filled_before: Optional[datetime] = Field(None, description="With grid_id: only cells filled before this time")
+    
+    @validator("filled_before")
+    def naive_utc(cls, value):
+        # Timestamps are stored as naive UTC
+        if value is not None and value.tzinfo is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
 class CellStatusUpdate(BaseModel):
     status: str = Field(..., description="Status: empty, filling, full")
 
@@ -148,7 +220,8 @@ class CellDetailResponse(BaseModel):
     filled_at: Optional[datetime]
     cleared_at: Optional[datetime]
     products: List[ProductResponse] = []
-    histories: List[CellHistoryResponse] = []
+    histories: List[CellHistoryResponse] = []       # most recent first, bounded by history_limit
+    history_next_cursor: Optional[str] = None       # cursor of /cell/{cell_id}/history for older rows
     
     class Config:
         from_attributes = True
@@ -169,6 +242,26 @@ class ProductAssignmentResponse(BaseModel):
     product_info: Optional[dict] = None
     duplicate: Optional[bool] = False
 
+class BulkAssignmentResponse(BaseModel):
+    total: int
+    assigned: int
+    failed: int
+    results: List[ProductAssignmentResponse]
+
+class CellClearResult(BaseModel):
+    cell_id: int
+    cell_name: Optional[str] = None
+    success: bool
+    message: str
+    order_code: Optional[str] = None
+    product_count: Optional[int] = None
+
+class BulkClearResponse(BaseModel):
+    total: int
+    cleared: int
+    failed: int
+    results: List[CellClearResult]
+
 class GridStatusResponse(BaseModel):
     grid_id: int
     grid_name: str
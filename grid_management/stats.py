@@ -0,0 +1,120 @@
+"""
+System counters behind /stats/summary
+
+Mutations call bump()/bump_transition(); deltas are summed per transaction and
+written as ONE upsert into stat_counters right before commit, so the summary is
+a single small grouped read instead of eleven COUNT(*) scans.
+compute_counters() recomputes the same numbers from the base tables (drift check, backfill).
+"""
+import random
+from typing import Dict, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from core.core.database import before_commit, insert_for, transaction_info
+from . import models
+
+COUNTER_SHARDS = 8
+
+COUNTER_NAMES = (
+    "grids.total",
+    "cells.total",
+    "cells.empty",
+    "cells.filling",
+    "cells.full",
+    "products.total",
+    "orders.total",
+    "orders.pending",
+    "orders.filling",
+    "orders.completed",
+    "orders.shipped",
+)
+
+def bump(db: Session, deltas: Dict[str, int]):
+    """Add deltas to counters as part of the current transaction"""
+    pending = _pending(db)
+    for name, delta in deltas.items():
+        pending[name] = pending.get(name, 0) + delta
+
+def bump_transition(db: Session, prefix: str, old_status: Optional[str], new_status: Optional[str]):
+    """Move one item between status counters (e.g. cells.empty -> cells.filling)"""
+    if old_status == new_status:
+        return
+    deltas = {}
+    if old_status:
+        deltas[f"{prefix}.{old_status}"] = -1
+    if new_status:
+        deltas[f"{prefix}.{new_status}"] = 1
+    bump(db, deltas)
+
+def read_counters(db: Session) -> Dict[str, int]:
+    counters = dict.fromkeys(COUNTER_NAMES, 0)
+    rows = db.query(
+        models.StatCounter.name,
+        func.sum(models.StatCounter.value)
+    ).group_by(models.StatCounter.name).all()
+    for name, value in rows:
+        counters[name] = int(value or 0)
+    return counters
+
+def compute_counters(db) -> Dict[str, int]:
+    """Recompute every counter from the base tables in a single statement"""
+    cells = models.GridCell
+    orders = models.OrderTracking
+
+    def count(model, *conditions):
+        query = select(func.count()).select_from(model)
+        for condition in conditions:
+            query = query.where(condition)
+        return query.scalar_subquery()
+
+    row = db.execute(select(
+        count(models.Grid, models.Grid.is_active == True).label("grids.total"),
+        count(cells).label("cells.total"),
+        count(cells, cells.status == "empty").label("cells.empty"),
+        count(cells, cells.status == "filling").label("cells.filling"),
+        count(cells, cells.status == "full").label("cells.full"),
+        count(models.Product).label("products.total"),
+        count(orders).label("orders.total"),
+        count(orders, orders.status == "pending").label("orders.pending"),
+        count(orders, orders.status == "filling").label("orders.filling"),
+        count(orders, orders.status == "completed").label("orders.completed"),
+        count(orders, orders.status == "shipped").label("orders.shipped"),
+    )).one()
+    return dict(row._mapping)
+
+def reset_counters(db, counters: Dict[str, int]):
+    """Overwrite all counters (shard 0 holds the value, other shards are removed)"""
+    table = models.StatCounter.__table__
+    db.execute(table.delete())
+    db.execute(table.insert(), [
+        {"name": name, "shard": 0, "value": counters.get(name, 0)}
+        for name in COUNTER_NAMES
+    ])
+
+def _pending(db: Session) -> Dict[str, int]:
+    info = transaction_info(db)
+    pending = info.get("stat_deltas")
+    if pending is None:
+        pending = info["stat_deltas"] = {}
+        before_commit(db, lambda session: _flush(session, pending))
+    return pending
+
+def _flush(db: Session, pending: Dict[str, int]):
+    # Sorted rows -> every transaction locks counter rows in the same order (no deadlocks)
+    shard = random.randrange(COUNTER_SHARDS)
+    rows = [
+        {"name": name, "shard": shard, "value": delta}
+        for name, delta in sorted(pending.items())
+        if delta
+    ]
+    if not rows:
+        return
+    insert = insert_for(db)
+    statement = insert(models.StatCounter).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[models.StatCounter.name, models.StatCounter.shard],
+        set_={"value": models.StatCounter.value + statement.excluded.value}
+    )
+    db.execute(statement)
@@ -1,10 +1,13 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.httpsredirect import HTTPSRedirectMiddleware
 from fastapi.exceptions import RequestValidationError
 
 from core.core.config import settings
-from core.core.database import engine, Base
+from core.core.database import engine, SessionLocal
+from core.core.migrations import run_migrations
 from core.core.exceptions import APIError
 from core.core.exception_handlers import (
     api_error_handler,
@@ -17,12 +20,58 @@ from grid_management.models import *
 
 # Import routers
 from grid_management.router import router as grid_router
+from core.core.internal_router import router as internal_router, metrics_router
+from core.core.metrics import MetricsMiddleware
+from core.core import nplusone, slowlog
+from grid_management.occupancy import occupancy_index, apply_remote_events
+from grid_management.events import event_listener
+from grid_management import archive, cache, dedup, routing
+from grid_management.history import history_writer
+from grid_management.migrations import MIGRATIONS
 
-# Create all tables in the database
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create/upgrade tables and indexes (replaces Base.metadata.create_all)
+    run_migrations(engine, MIGRATIONS)
+    
+    # Response cache of grid/cell views (CACHE_BACKEND)
+    cache.response_cache.configure()
+    
+    # Receive grid change events committed by other workers (live grid stream)
+    # and apply their cell changes / stored product codes / cached view versions locally.
+    # Listening before the indexes below are built: no change falls in between
+    event_listener.add_handler(apply_remote_events)
+    event_listener.add_handler(dedup.apply_remote_events)
+    event_listener.add_handler(routing.apply_remote_events)
+    event_listener.add_handler(cache.apply_remote_events)
+    await event_listener.start()
+    
+    # Warm the in-memory cell occupancy index used for slot selection
+    with SessionLocal() as db:
+        occupancy_index.rebuild(db)
+        # Product routing: grids tagged per production area / size
+        routing.routing_table.rebuild(db)
+        # Duplicate scan pre-check: Bloom filter of stored product codes
+        dedup.product_codes.rebuild(db)
+    
+    # Write-behind cell history (HISTORY_WRITE_BEHIND): replay spooled rows of a
+    # crashed worker, then flush history in batches in the background
+    history_writer.start()
+    
+    # Slow request / query log (SLOW_REQUEST_SECONDS), EXPLAIN of sampled slow statements
+    slowlog.slow_log.start(explain_engine=engine)
+    
+    # Shipped products archive: partitions ahead, retention, legacy compaction
+    archive.start_maintenance()
+    yield
+    await archive.stop_maintenance()
+    await asyncio.to_thread(slowlog.slow_log.stop)
+    await asyncio.to_thread(history_writer.stop)
+    await event_listener.stop()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
+    lifespan=lifespan,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     exception_handlers={
         APIError: api_error_handler,
@@ -44,8 +93,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency / SQL metrics (GET /metrics); added after CORS, so the
+# latency includes CORS handling
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+# Log requests repeating an identical statement (N+1 lazy loads); on with DEBUG
+if nplusone.enabled():
+    app.add_middleware(nplusone.NPlusOneMiddleware)
+
+# Log slow requests with their SQL statements (SLOW_REQUEST_SECONDS)
+if slowlog.enabled():
+    app.add_middleware(slowlog.SlowLogMiddleware)
+
 # Include routers
 app.include_router(grid_router, prefix=settings.API_V1_STR)
+app.include_router(internal_router, prefix=settings.API_V1_STR)
+if settings.METRICS_ENABLED:
+    app.include_router(metrics_router)
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,84 @@
+"""
+Tests run the app in-process (TestClient) against PostgreSQL.
+
+The server and credentials come from the environment / .env as for the app,
+but the database is "<DB_NAME>_test" (or TEST_DB_NAME): it is created for the
+run and dropped afterwards, the configured database itself is never touched.
+Every test starts from empty tables.
+
+    pytest                          # DB_HOST, DB_USER, ... from .env
+    TEST_DB_NAME=grid_ci pytest
+"""
+import os
+
+import psycopg2
+import pytest
+from dotenv import dotenv_values
+
+_configured = {**dotenv_values(".env"), **os.environ}
+SERVER = {
+    "host": _configured.get("DB_HOST", "localhost"),
+    "port": int(_configured.get("DB_PORT") or 5432),
+    "user": _configured.get("DB_USER"),
+    "password": _configured.get("DB_PASSWORD"),
+    "dbname": _configured.get("DB_NAME", "postgres"),
+}
+TEST_DB_NAME = _configured.get("TEST_DB_NAME") or f"{SERVER['dbname']}_test"
+
+# Before the app (and its settings / engines) is imported
+os.environ["DB_NAME"] = TEST_DB_NAME
+os.environ.setdefault("CACHE_BACKEND", "off")                        # every call reaches the database
+os.environ.setdefault("HISTORY_WRITE_BEHIND", "false")
+os.environ.setdefault("ARCHIVE_MAINTENANCE_INTERVAL_SECONDS", "0")   # no background statements
+os.environ.setdefault("SLOW_REQUEST_SECONDS", "0")
+
+def _admin(sql: str):
+    connection = psycopg2.connect(**SERVER)
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+    finally:
+        connection.close()
+
+@pytest.fixture(scope="session")
+def client():
+    _admin(f'DROP DATABASE IF EXISTS "{TEST_DB_NAME}"')
+    _admin(f'CREATE DATABASE "{TEST_DB_NAME}"')
+    from fastapi.testclient import TestClient
+    from core.core.database import engine
+    import main
+
+    try:
+        with TestClient(main.app) as test_client:
+            yield test_client
+    finally:
+        engine.dispose()
+        # The async pool's connections can only be closed on their event loop, which is gone
+        _admin(f'DROP DATABASE IF EXISTS "{TEST_DB_NAME}" WITH (FORCE)')
+
+@pytest.fixture(autouse=True)
+def empty_tables(client):
+    """Truncate every table and reset the in-memory indexes built from them"""
+    from sqlalchemy import text
+    from core.core.database import Base, SessionLocal
+    from grid_management import dedup, routing
+    from grid_management.occupancy import occupancy_index
+
+    tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+    with SessionLocal() as db:
+        db.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+        db.commit()
+        occupancy_index.rebuild(db)
+        routing.routing_table.rebuild(db)
+        dedup.product_codes.rebuild(db)
+    # Recently scanned codes are answered as duplicates without a lookup
+    dedup.product_codes._recent.clear()
+
+@pytest.fixture
+def db(client):
+    """Sync session on the test database"""
+    from core.core.database import SessionLocal
+
+    with SessionLocal() as session:
+        yield session
@@ -0,0 +1,68 @@
+"""Response cache ETags: versions, TTL bucket, listener resync, shared store epoch"""
+from grid_management import cache
+from grid_management.cache import LocalBackend, RedisBackend, ResponseCache, cell_version, grid_version
+from grid_management.events import RESYNC
+
+class DictRedis:
+    """The hash commands RedisBackend uses, on a dict (values come back as bytes, as from redis-py)"""
+
+    def __init__(self):
+        self.hashes = {}
+
+    def hmget(self, name, fields):
+        values = self.hashes.get(name, {})
+        return [values.get(field) for field in fields]
+
+    def hget(self, name, field):
+        return self.hashes.get(name, {}).get(field)
+
+    def hsetnx(self, name, field, value):
+        self.hashes.setdefault(name, {}).setdefault(field, str(value).encode())
+
+    def hincrby(self, name, field, amount):
+        values = self.hashes.setdefault(name, {})
+        values[field] = str(int(values.get(field, b"0")) + amount).encode()
+
+    def flushall(self):
+        self.hashes.clear()
+
+def etag(response_cache: ResponseCache) -> str:
+    return response_cache.etag("grid", (1,), (grid_version(1),))
+
+def test_etag_expires_with_the_ttl(monkeypatch):
+    response_cache = ResponseCache()
+    response_cache.configure(LocalBackend(10, 1024, 60))
+    now = 60.0 * 20_000_000   # start of a bucket
+    monkeypatch.setattr(cache.time, "time", lambda: now)
+    first = etag(response_cache)
+    now += 59
+    assert etag(response_cache) == first
+    # No bump arrived, but a 304 is not answered past the TTL
+    now += 60
+    assert etag(response_cache) != first
+
+def test_listener_resync_changes_every_local_version(monkeypatch):
+    backend = LocalBackend(10, 1024, 60)
+    response_cache = ResponseCache()
+    response_cache.configure(backend)
+    monkeypatch.setattr(cache, "response_cache", response_cache)
+    backend.set("body", b"{}")
+    before = etag(response_cache)
+
+    cache.apply_remote_events([RESYNC])
+    assert etag(response_cache) != before
+    assert backend.get("body") is None
+
+def test_redis_versions_do_not_restart_after_a_flush():
+    client = DictRedis()
+    response_cache = ResponseCache()
+    response_cache.configure(RedisBackend(client, 60))
+    before = etag(response_cache)
+    response_cache.bump([grid_version(1), cell_version(5)])
+    bumped = etag(response_cache)
+    assert bumped != before
+
+    # Flushed (or the hash evicted), then bumped back to the same count
+    client.flushall()
+    response_cache.bump([grid_version(1)])
+    assert etag(response_cache) not in (before, bumped)
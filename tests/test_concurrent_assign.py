@@ -0,0 +1,52 @@
+"""
+Concurrent scans against the test database: every thread has its own session
+(connection), so slot allocation races on the database locks as it does
+between workers. Checked with the queries of tools/stress_assign.py.
+"""
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from core.core.database import SessionLocal
+from grid_management import crud, schemas
+from tools.stress_assign import build_scans, check_database
+
+BASE = "/v1/api/grid"
+THREADS = 8
+
+def assign_all(batches, assign) -> int:
+    """Run assign(db, batch) for every batch on THREADS threads; returns the accepted scans"""
+    def run(batch):
+        with SessionLocal() as db:
+            results = assign(db, [schemas.ProductInput(**scan) for scan in batch])
+        return sum(result["success"] for result in results)
+
+    with ThreadPoolExecutor(THREADS) as executor:
+        return sum(executor.map(run, batches))
+
+@pytest.fixture
+def scans(client):
+    random.seed(1017)
+    order_date = f"{random.randint(0, 999999):06d}"
+    scans = build_scans(80, 5, order_date)
+    # Rescans of the same label race with the first scan
+    scans += random.sample(scans, len(scans) // 10)
+    random.shuffle(scans)
+    for index in range(2):
+        response = client.post(f"{BASE}/create", json={"name": f"stress-{index}", "width": 10, "height": 10})
+        assert response.status_code == 200, response.text
+    return order_date, scans
+
+def test_concurrent_single_scans(db, scans):
+    order_date, scans = scans
+    accepted = assign_all([[scan] for scan in scans], lambda db, batch: [crud.assign_product_to_cell(db, batch[0])])
+    assert accepted == len({scan["productCode"] for scan in scans})
+    assert check_database(db, order_date, accepted) == []
+
+def test_concurrent_bulk_scans(db, scans):
+    order_date, scans = scans
+    batches = [scans[start:start + 10] for start in range(0, len(scans), 10)]
+    accepted = assign_all(batches, crud.assign_products_bulk)
+    assert accepted == len({scan["productCode"] for scan in scans})
+    assert check_database(db, order_date, accepted) == []
@@ -0,0 +1,73 @@
+"""Grid events sent to the other workers (pg_notify payloads) and their listener"""
+import json
+import time
+
+from sqlalchemy import text
+
+from grid_management import dedup, events, models
+
+BASE = "/v1/api/grid"
+
+def cleared_event(codes, note=None) -> dict:
+    cell = {"id": 7, "grid_id": 3, "status": "empty", "note": note}
+    return {"type": "cell", "reason": "cell_cleared", "grid_id": 3, "cell": cell, "product_codes": codes}
+
+def delivered(payloads) -> list:
+    messages = [json.loads(payload) for payload in payloads]
+    return [event for message in messages for event in message["events"]]
+
+def test_large_cleared_cell_keeps_every_product_code():
+    codes = [f"VA-XL-{number:06d}-{number % 9 + 1}" for number in range(1000)]
+    payloads = list(events._payloads([cleared_event(codes)]))
+
+    assert len(payloads) > 1
+    assert all(len(payload.encode()) <= events.MAX_NOTIFY_PAYLOAD for payload in payloads)
+    received = delivered(payloads)
+    assert [code for event in received for code in event["product_codes"]] == codes
+    assert all(event["type"] == "cell" and event["cell"]["id"] == 7 for event in received)
+
+    # The other workers' duplicate pre-check forgets all of them
+    dedup.product_codes.remember(codes[0])
+    dedup.product_codes.remember(codes[-1])
+    dedup.apply_remote_events(received)
+    assert dedup.product_codes.check(codes[0]) is not True
+    assert dedup.product_codes.check(codes[-1]) is not True
+
+def test_oversized_cell_state_falls_back_to_a_grid_change():
+    payloads = list(events._payloads([cleared_event(["VA-M-000001-1"], note="x" * 8000)]))
+    assert delivered(payloads) == [
+        {"type": "grid", "reason": "cell_cleared", "grid_id": 3, "product_codes": ["VA-M-000001-1"]}
+    ]
+
+def wait_for(condition, timeout: float = 15) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_listener_reconnect_resyncs_duplicate_check(client, db):
+    grid = client.post(f"{BASE}/create", json={"name": "events", "width": 1, "height": 1}).json()
+    cell_id = db.query(models.GridCell.id).filter(models.GridCell.grid_id == grid["id"]).scalar()
+    # Stored by another worker whose notification never arrived
+    code = "VA-M-000001-1"
+    db.add(models.Product(
+        cell_id=cell_id, product_code=code, size="M", color="Red", qr_data=f"101725-{code}", number=1, total=1,
+        production_area="VA", size_code="M", order_number="000001", product_number=1, order_date="101725"
+    ))
+    db.commit()
+    assert dedup.product_codes.check(code) is False
+
+    db.execute(text(
+        "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+        "WHERE application_name = :name AND datname = current_database()"
+    ), {"name": events.LISTENER_APPLICATION_NAME})
+    # Disconnected: nothing answered from memory
+    assert wait_for(lambda: not dedup.product_codes.synced)
+    assert dedup.product_codes.check(code) is None
+
+    # Listening again: the filter is rebuilt from the database before it answers
+    assert wait_for(lambda: dedup.product_codes.synced)
+    assert dedup.product_codes.check(code) is None
+    assert dedup.product_codes.check("VA-M-000002-1") is False
@@ -0,0 +1,95 @@
+"""Write-behind cell history (HISTORY_WRITE_BEHIND): spool, flush and crash recovery"""
+import glob
+import json
+import os
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from core.core.config import settings
+from core.core.database import SessionLocal, before_commit
+from grid_management import history, models
+
+BASE = "/v1/api/grid"
+
+@pytest.fixture
+def writer(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "HISTORY_WRITE_BEHIND", True)
+    monkeypatch.setattr(settings, "HISTORY_SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "HISTORY_FLUSH_INTERVAL_SECONDS", 3600)   # flushed by the test
+    writer = history.HistoryWriter()
+    monkeypatch.setattr(history, "history_writer", writer)
+    yield writer
+    writer.stop()
+
+@pytest.fixture
+def cell_id(client, db) -> int:
+    grid = client.post(f"{BASE}/create", json={"name": "history", "width": 1, "height": 1}).json()
+    return db.query(models.GridCell.id).filter(models.GridCell.grid_id == grid["id"]).scalar()
+
+def note_row(cell_id: int, description: str) -> dict:
+    return history.history_row(cell_id, "note_updated", description)
+
+def descriptions(db) -> list:
+    return sorted(description for description, in db.query(models.CellHistory.description))
+
+def spooled(directory) -> list:
+    return [
+        json.loads(line)
+        for path in sorted(glob.glob(os.path.join(directory, history.SPOOL_PATTERN)))
+        for line in open(path, encoding="utf-8")
+    ]
+
+def test_rows_are_spooled_before_commit_and_dropped_on_rollback(writer, cell_id, db, tmp_path):
+    writer.start()
+    with SessionLocal() as session:
+        history.write_histories(session, [note_row(cell_id, "committed")])
+        session.commit()
+    with SessionLocal() as session:
+        history.write_histories(session, [note_row(cell_id, "rolled back")])
+        session.rollback()
+    # The rolled back transaction never spooled (its before_commit did not run)
+    assert [line["rows"][0]["description"] for line in spooled(tmp_path)] == ["committed"]
+    assert descriptions(db) == []
+
+    assert writer.flush() == 1
+    assert descriptions(db) == ["committed"]
+    # Every transaction of the rotated segment is written: it is deleted
+    assert spooled(tmp_path) == []
+
+def test_failed_commit_releases_its_spool_line(writer, cell_id, db, tmp_path):
+    writer.start()
+    with SessionLocal() as session:
+        history.write_histories(session, [note_row(cell_id, "failed")])
+        # Fails after the rows were spooled
+        before_commit(session, lambda session: session.execute(text("SELECT 1 / 0")))
+        with pytest.raises(DBAPIError):
+            session.commit()
+    assert writer.report()["pending"] == 0
+    assert writer.flush() == 0
+    writer.stop()
+    # Nothing committed: the segment is not left behind for a replay
+    assert spooled(tmp_path) == []
+
+def test_recovery_replays_only_committed_transactions(writer, cell_id, db, tmp_path):
+    txids = {}
+    for outcome in ("committed", "rolled back"):
+        with SessionLocal() as session:
+            txids[outcome] = session.execute(text("SELECT txid_current()")).scalar()
+            session.commit() if outcome == "committed" else session.rollback()
+    # Left behind by a worker that crashed around its commits
+    lines = [
+        {"txid": txids["committed"], "rows": [note_row(cell_id, "committed")]},
+        {"txid": txids["rolled back"], "rows": [note_row(cell_id, "rolled back")]},
+        note_row(cell_id, "older format"),
+    ]
+    with open(tmp_path / "cell_history-1-1-1.ndjson", "w", encoding="utf-8") as file:
+        for line in lines:
+            file.write(json.dumps(line, default=history._json_default) + "\n")
+
+    writer.start()
+    assert writer.replayed == 2
+    assert writer.flush() == 2
+    assert descriptions(db) == ["committed", "older format"]
+    assert spooled(tmp_path) == []
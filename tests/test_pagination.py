@@ -0,0 +1,142 @@
+"""Keyset pages and NDJSON streams of the list endpoints"""
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, update
+
+from core.core.pagination import NEXT_CURSOR_HEADER, STREAM_BATCH_SIZE, encode_cursor
+from grid_management import models
+
+BASE = "/v1/api/grid"
+MOMENT = datetime(2025, 10, 17, 8, 30)
+
+LIST_URLS = (
+    f"{BASE}/orders/list",
+    f"{BASE}/cells/ready-to-ship",
+    f"{BASE}/cells/by-status/empty",
+    f"{BASE}/cell/1/history",
+)
+
+def add_orders(db, count: int, created_at=lambda number: MOMENT):
+    db.execute(insert(models.OrderTracking), [
+        {
+            "order_code": f"VA-M-{number:06d}",
+            "order_date": "101725",
+            "full_order_key": f"VA-M-{number:06d}-101725",
+            "total_products": 1,
+            "status": "pending",
+            "created_at": created_at(number),
+        }
+        for number in range(count)
+    ])
+    db.commit()
+    return db.query(models.OrderTracking.id).count()
+
+def add_cells(client, db, grids: int, width: int, height: int, **values) -> int:
+    """Create grids (width x height cells each), then set values on every cell"""
+    response = client.post(f"{BASE}/create/bulk", json={
+        "grids": [{"name": f"page-{number}", "width": width, "height": height} for number in range(grids)]
+    })
+    assert response.status_code == 200, response.text
+    if values:
+        db.execute(update(models.GridCell).values(**values))
+        db.commit()
+    return grids * width * height
+
+def walk(client, url: str, limit: int):
+    """Every page of url (ids per page) and whether each page sent X-Next-Cursor"""
+    pages, cursors = [], []
+    params = {"limit": limit}
+    while True:
+        response = client.get(url, params=params)
+        assert response.status_code == 200, response.text
+        pages.append([item["id"] for item in response.json()])
+        following = response.headers.get(NEXT_CURSOR_HEADER)
+        cursors.append(following is not None)
+        if following is None:
+            return pages, cursors
+        params = {"limit": limit, "cursor": following}
+
+def stream_ids(client, url: str, **params):
+    response = client.get(url, params={"stream": "true", **params})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line)["id"] for line in response.text.splitlines()]
+
+def test_orders_pages_with_tied_created_at(client, db):
+    total = add_orders(db, 7)
+    pages, cursors = walk(client, f"{BASE}/orders/list", limit=3)
+    ids = [order_id for page in pages for order_id in page]
+    # Same created_at everywhere: id DESC breaks the tie, no row lost or repeated
+    assert ids == list(range(total, 0, -1))
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert cursors == [True, True, False]
+
+def test_ready_to_ship_pages_with_tied_filled_at(client, db):
+    total = add_cells(client, db, 1, 5, 2, status="full", filled_at=MOMENT)
+    pages, cursors = walk(client, f"{BASE}/cells/ready-to-ship", limit=4)
+    ids = [cell_id for page in pages for cell_id in page]
+    assert ids == list(range(1, total + 1))
+    assert cursors == [True, True, False]
+
+def test_by_status_pages_with_tied_updated_at(client, db):
+    total = add_cells(client, db, 1, 5, 2, updated_at=MOMENT)
+    pages, cursors = walk(client, f"{BASE}/cells/by-status/empty", limit=4)
+    ids = [cell_id for page in pages for cell_id in page]
+    assert ids == list(range(total, 0, -1))
+    assert cursors == [True, True, False]
+
+@pytest.mark.parametrize("url", [f"{BASE}/cells/ready-to-ship", f"{BASE}/cells/by-status/full"])
+def test_cell_lists_default_to_one_page(client, db, url):
+    total = add_cells(client, db, 1, 15, 10, status="full", filled_at=MOMENT)
+    response = client.get(url)
+    assert len(response.json()) == 100
+    assert NEXT_CURSOR_HEADER in response.headers
+    # Everything at once only as a stream
+    assert len(stream_ids(client, url)) == total
+
+def test_no_cursor_after_last_page(client, db):
+    add_orders(db, 6)
+    # A full last page may still send a cursor; the page after it is empty and ends the walk
+    pages, cursors = walk(client, f"{BASE}/orders/list", limit=3)
+    assert [len(page) for page in pages] == [3, 3, 0]
+    assert cursors == [True, True, False]
+
+    response = client.get(f"{BASE}/orders/list", params={"limit": 10})
+    assert len(response.json()) == 6
+    assert NEXT_CURSOR_HEADER not in response.headers
+
+@pytest.mark.parametrize("url", LIST_URLS)
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",
+    encode_cursor([1]),                         # wrong number of key values
+    encode_cursor(["not-a-date", 1]),
+    encode_cursor(["2024-01-01T00:00:00", "x"]),  # id of the wrong type
+    encode_cursor(["2024-01-01T00:00:00", 2 ** 40]),  # id out of the column's range
+    encode_cursor(["2024-01-01T00:00:00", None]),
+])
+@pytest.mark.parametrize("stream", [False, True])
+def test_invalid_cursor_is_rejected(client, url, cursor, stream):
+    response = client.get(url, params={"cursor": cursor, "stream": str(stream).lower()})
+    assert response.status_code == 400
+
+def test_orders_stream_beyond_one_batch(client, db):
+    total = add_orders(db, STREAM_BATCH_SIZE * 2 + 200, created_at=lambda number: MOMENT.replace(minute=number % 7))
+    assert total > STREAM_BATCH_SIZE
+
+    ids = stream_ids(client, f"{BASE}/orders/list")
+    assert len(ids) == total
+    assert set(ids) == set(range(1, total + 1))
+
+    # The stream continues after a page's cursor
+    first = client.get(f"{BASE}/orders/list", params={"limit": 100})
+    rest = stream_ids(client, f"{BASE}/orders/list", cursor=first.headers[NEXT_CURSOR_HEADER])
+    assert [item["id"] for item in first.json()] + rest == ids
+
+def test_ready_to_ship_stream_beyond_one_batch(client, db):
+    total = add_cells(client, db, 4, 20, 15, status="full", filled_at=MOMENT)
+    assert total > STREAM_BATCH_SIZE
+
+    ids = stream_ids(client, f"{BASE}/cells/ready-to-ship")
+    assert ids == list(range(1, total + 1))
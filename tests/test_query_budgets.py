@@ -0,0 +1,48 @@
+"""
+SQL statement budgets of the grid views: a lost selectinload turns into one
+lazy load per cell, which repeats a statement and fails these tests
+"""
+import pytest
+
+from core.core.testing import assert_max_queries, query_budget
+from grid_management import crud, schemas
+
+BASE = "/v1/api/grid"
+
+def scan(code: str, number: int, total: int) -> dict:
+    return {
+        "productCode": code,
+        "qrData": f"101725-{code}",
+        "size": code.split("-")[1],
+        "color": "Red",
+        "number": str(number),
+        "total": str(total),
+    }
+
+@pytest.fixture
+def grid_id(client) -> int:
+    """3x3 grid with products in four cells (three full orders, one filling)"""
+    grid = client.post(f"{BASE}/create", json={"name": "budget", "width": 3, "height": 3}).json()
+    for order, total, scanned in ((1, 2, 2), (2, 2, 2), (3, 3, 3), (4, 3, 1)):
+        for number in range(1, scanned + 1):
+            response = client.post(f"{BASE}/assign-product", json=scan(f"VA-M-{order:06d}-{number}", number, total))
+            assert response.status_code == 200, response.text
+    return grid["id"]
+
+def test_grid_detail_endpoint(client, grid_id):
+    # grid, its cells, their products (selectinload)
+    response = assert_max_queries(client, "GET", f"{BASE}/{grid_id}", 3, max_repeats=1)
+    assert response.status_code == 200
+    assert sum(len(cell["products"]) for cell in response.json()["cells"]) == 8
+
+def test_get_grid_with_cells(db, grid_id):
+    with query_budget(max_queries=3, max_repeats=1):
+        grid = crud.get_grid_with_cells(db, grid_id)
+        # Serializing walks every relationship the response model reads
+        schemas.GridWithCellsResponse.model_validate(grid).model_dump_json()
+
+def test_get_grid_status(db, grid_id):
+    with query_budget(max_queries=3, max_repeats=1):
+        grid_status = crud.get_grid_status(db, grid_id)
+        [schemas.GridCellResponse.model_validate(cell).model_dump_json() for cell in grid_status["cells"]]
+    assert (grid_status["full_cells"], grid_status["filling_cells"], grid_status["empty_cells"]) == (3, 1, 5)
@@ -0,0 +1,285 @@
+"""
+Microbenchmarks for the crud hot paths
+
+Times the crud functions behind the busiest endpoints on a seeded database and
+reports per benchmark: latency percentiles (ms) and SQL statements per call.
+- assign_product: crud.assign_product_to_cell (new and continuing orders)
+- clear_cell: crud.clear_cell of a full cell
+- create_grid: crud.create_grid of a --width x --height grid
+- update_grid: crud.update_grid growing / shrinking a grid by one column
+- stats_summary: the counters behind GET /stats/summary (stats.read_counters)
+- stats_summary_fresh: the same with fresh=true (stats.compute_counters)
+
+Database (never the one of .env unless --url says so):
+- --db pgserver: a throwaway local PostgreSQL (pip install pgserver), default when installed
+- --db sqlite: a temporary SQLite file (fallback; no advisory locks, different plans)
+- --url postgresql+psycopg2://...: an existing scratch database
+The database is seeded with --grids grids of --width x --height cells holding
+about --products stored products before anything is timed.
+
+Baselines: --save-baseline FILE stores the results; --baseline FILE compares
+against them and exits with code 1 when a benchmark's p50 or p95 grew by more
+than --threshold (default 0.2 = 20%) or it runs more statements per call.
+
+Usage (from the repository root):
+    python tools/bench_crud.py
+    python tools/bench_crud.py --db sqlite --iterations 200
+    python tools/bench_crud.py --grids 20 --width 20 --height 20 --products 20000
+    python tools/bench_crud.py --save-baseline bench_baseline.json
+    python tools/bench_crud.py --baseline bench_baseline.json --threshold 0.25
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session, sessionmaker
+
+from core.core.migrations import run_migrations
+from grid_management import crud, dedup, models, schemas, stats
+from grid_management.migrations import MIGRATIONS
+from grid_management.occupancy import occupancy_index
+from grid_management.routing import routing_table
+
+PERCENTILES = (50, 95, 99)
+
+class QueryCounter:
+    """Counts SQL statements sent through an engine"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+class Bench:
+    def __init__(self, session_factory: Callable[[], Session], counter: QueryCounter, order_date: str):
+        self.session_factory = session_factory
+        self.counter = counter
+        self.order_date = order_date
+        self._orders = itertools.count()
+
+    def scans(self, orders: int, max_total: int) -> List[schemas.ProductInput]:
+        """Every scan of orders new orders (1..max_total products), shuffled"""
+        scans = []
+        for _ in range(orders):
+            order = next(self._orders)
+            size = random.choice("SML")
+            total = random.randint(1, max_total)
+            for number in range(1, total + 1):
+                code = f"BN-{size}-{order:06d}-{number}"
+                scans.append(schemas.ProductInput(
+                    productCode=code,
+                    qrData=f"{self.order_date}-{code}",
+                    size=size,
+                    color="bench",
+                    number=str(number),
+                    total=str(total)
+                ))
+        random.shuffle(scans)
+        return scans
+
+    def measure(self, name: str, calls, run: Callable[[Session, object], None]) -> dict:
+        """Time run(db, argument) once per argument, each in a fresh session"""
+        timings, queries = [], []
+        for argument in calls:
+            with self.session_factory() as db:
+                before = self.counter.count
+                started = time.perf_counter()
+                run(db, argument)
+                timings.append((time.perf_counter() - started) * 1000)
+                queries.append(self.counter.count - before)
+        return summarize(name, timings, queries)
+
+def summarize(name: str, timings: List[float], queries: List[int]) -> dict:
+    ordered = sorted(timings)
+    result = {"name": name, "calls": len(ordered)}
+    if not ordered:
+        return result
+    for percentile in PERCENTILES:
+        result[f"p{percentile}"] = ordered[min(len(ordered) - 1, round(percentile / 100 * (len(ordered) - 1)))]
+    result["mean"] = statistics.fmean(ordered)
+    result["queries"] = statistics.fmean(queries)
+    return result
+
+def seed(bench: Bench, grids: int, width: int, height: int, products: int, max_total: int) -> int:
+    """Create the grids and store about products products; returns the stored count"""
+    with bench.session_factory() as db:
+        crud.create_grids(db, [
+            schemas.GridCreate(name=f"bench-{number}", width=width, height=height)
+            for number in range(grids)
+        ])
+        rebuild_indexes(db)
+    # Whole orders (full cells); at most half the cells in use, the rest stay free to claim
+    orders = min(max(products // max(1, (max_total + 1) // 2), 0), grids * width * height // 2)
+    scans = bench.scans(orders, max_total)
+    for start in range(0, len(scans), 500):
+        with bench.session_factory() as db:
+            crud.assign_products_bulk(db, scans[start:start + 500])
+    with bench.session_factory() as db:
+        return stats.read_counters(db)["products.total"]
+
+def rebuild_indexes(db: Session):
+    """Process-local structures the app builds at startup"""
+    occupancy_index.rebuild(db)
+    routing_table.rebuild(db)
+    dedup.product_codes.rebuild(db)
+
+def run_benchmarks(bench: Bench, args) -> List[dict]:
+    results = []
+
+    # Scans: new orders and the following products of orders already in a cell
+    scans = bench.scans(args.iterations, args.max_total)[:args.iterations]
+    results.append(bench.measure("assign_product", scans, lambda db, scan: crud.assign_product_to_cell(db, scan)))
+
+    # Clear: full cells prepared (untimed) by scanning whole orders
+    with bench.session_factory() as db:
+        crud.assign_products_bulk(db, bench.scans(args.iterations, 1))
+        full_cells = db.execute(
+            select(models.GridCell.id).where(models.GridCell.status == "full").limit(args.iterations)
+        ).scalars().all()
+    results.append(bench.measure("clear_cell", full_cells, lambda db, cell_id: crud.clear_cell(db, cell_id)))
+
+    grid_input = schemas.GridCreate(name="bench-created", width=args.width, height=args.height)
+    results.append(bench.measure(
+        "create_grid",
+        range(max(args.iterations // 10, 1)),
+        lambda db, _: crud.create_grid(db, grid_input)
+    ))
+
+    # Resize one empty grid: +1 column, -1 column, ...
+    with bench.session_factory() as db:
+        grid_id = crud.create_grid(db, schemas.GridCreate(name="bench-resized", width=args.width - 1, height=args.height)).id
+    widths = [args.width if step % 2 == 0 else args.width - 1 for step in range(max(args.iterations // 10, 2))]
+    results.append(bench.measure(
+        "update_grid",
+        widths,
+        lambda db, width: crud.update_grid(db, grid_id, schemas.GridUpdate(width=width))
+    ))
+
+    results.append(bench.measure("stats_summary", range(args.iterations), lambda db, _: stats.read_counters(db)))
+    results.append(bench.measure(
+        "stats_summary_fresh",
+        range(max(args.iterations // 10, 1)),
+        lambda db, _: stats.compute_counters(db)
+    ))
+    return results
+
+def compare(results: List[dict], baseline: List[dict], threshold: float) -> List[str]:
+    """Regressions of results against baseline (empty list = none)"""
+    previous = {entry["name"]: entry for entry in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result["name"])
+        if not before or "p50" not in result or "p50" not in before:
+            continue
+        for metric in ("p50", "p95"):
+            if result[metric] > before[metric] * (1 + threshold):
+                regressions.append(
+                    f"{result['name']}: {metric} {before[metric]:.2f} -> {result[metric]:.2f} ms "
+                    f"(+{result[metric] / before[metric] - 1:.0%})"
+                )
+        if result["queries"] > before["queries"] + 0.01:
+            regressions.append(f"{result['name']}: queries/call {before['queries']:.1f} -> {result['queries']:.1f}")
+    return regressions
+
+def print_table(results: List[dict], baseline: Optional[List[dict]] = None):
+    previous = {entry["name"]: entry for entry in baseline or []}
+    header = f"{'benchmark':<22}{'calls':>7}" + "".join(f"{f'p{p} ms':>10}" for p in PERCENTILES) + f"{'mean ms':>10}{'queries':>9}"
+    print(header + (f"{'p50 vs base':>13}" if baseline else ""))
+    for result in results:
+        if "p50" not in result:
+            print(f"{result['name']:<22}{0:>7}")
+            continue
+        line = f"{result['name']:<22}{result['calls']:>7}" + "".join(f"{result[f'p{p}']:>10.2f}" for p in PERCENTILES)
+        line += f"{result['mean']:>10.2f}{result['queries']:>9.1f}"
+        before = previous.get(result["name"])
+        if before and before.get("p50"):
+            line += f"{result['p50'] / before['p50'] - 1:>+13.0%}"
+        print(line)
+
+@contextlib.contextmanager
+def database(args):
+    """SQLAlchemy URL of the database to benchmark (created for the run unless --url)"""
+    if args.url:
+        yield args.url
+        return
+    kind = args.db
+    if kind == "pgserver":
+        try:
+            import pgserver
+        except ImportError:
+            print("pgserver is not installed (pip install pgserver), using SQLite", file=sys.stderr)
+            kind = "sqlite"
+    with tempfile.TemporaryDirectory(prefix="bench_crud_") as directory:
+        if kind == "sqlite":
+            yield f"sqlite:///{os.path.join(directory, 'bench.db')}"
+            return
+        server = pgserver.get_server(directory, cleanup_mode="stop")
+        try:
+            yield server.get_uri().replace("postgresql://", "postgresql+psycopg2://", 1)
+        finally:
+            server.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", choices=("pgserver", "sqlite"), default="pgserver", help="throwaway database to create")
+    parser.add_argument("--url", help="benchmark an existing (scratch!) database instead")
+    parser.add_argument("--grids", type=int, default=10)
+    parser.add_argument("--width", type=int, default=10)
+    parser.add_argument("--height", type=int, default=10)
+    parser.add_argument("--products", type=int, default=2000, help="stored products seeded before timing (at most half the cells get an order)")
+    parser.add_argument("--max-total", type=int, default=4, help="largest order (products per order)")
+    parser.add_argument("--iterations", type=int, default=300, help="calls per benchmark (fewer for the slow ones)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", help="compare with this baseline file")
+    parser.add_argument("--save-baseline", metavar="FILE", help="store the results as a baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p50/p95 growth against the baseline")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with database(args) as url:
+        engine = create_engine(url)
+        try:
+            run_migrations(engine, MIGRATIONS)
+            counter = QueryCounter(engine)
+            bench = Bench(sessionmaker(autocommit=False, autoflush=False, bind=engine), counter, order_date=f"{random.randint(1, 999999):06d}")
+            seeded = seed(bench, args.grids, args.width, args.height, args.products, args.max_total)
+            results = run_benchmarks(bench, args)
+            info = {"database": engine.dialect.name, "grids": args.grids, "cells": args.width * args.height, "products": seeded}
+        finally:
+            engine.dispose()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+    if args.json:
+        print(json.dumps({"info": info, "results": results}, indent=2))
+    else:
+        print(f"{info['database']}: {args.grids} grids x {info['cells']} cells, {info['products']} products seeded")
+        print_table(results, baseline)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as file:
+            json.dump({"info": info, "results": results}, file, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+Scan-stream load generator: replay or synthesize a scanning wave against the API
+
+N stations scan products (POST /assign-product) while shipping clears the cells
+of completed orders (POST /cell/{cell_id}/clear), paced to a target scan rate.
+Each station sends its scans one after the other, like a person with a scanner;
+latency is measured from the time a request was due, so a backed-up server
+shows up in the tail instead of silently lowering the offered load.
+
+Reports per endpoint: throughput, latency p50/p95/p99/max, HTTP status codes,
+allocation failures (no free cell / no grid) and duplicate scans (409).
+
+Target:
+- in-process (default): the FastAPI app of main.py over ASGI, lifespan included,
+  using the database of .env
+- --url http://host:8000: a running server (start it with the production worker count)
+
+Scan source:
+- --synthetic ORDERS: orders of realistic sizes (mostly 1-3 products, a tail up
+  to --max-total), --rescan share of products scanned twice, each order shipped
+  --ship-after seconds after its last scan
+- --log FILE: NDJSON scan log, one event per line in time order
+    {"t": 0.42, "station": 3, "productCode": "VA-M-000126-1", "qrData": "101725-VA-M-000126-1", "total": "3"}
+    {"t": 95.0, "ship": "VA-M-000126-101725"}
+  "t" (seconds from the start) and "station" are optional: without "t" events are
+  paced at --rate; size/color/number default from the product code. The scan
+  lines are the format of tools/simulate_allocation.py. --record FILE writes
+  the synthesized wave in this format for later replays.
+
+Usage (from the repository root):
+    python tools/loadgen.py --synthetic 2000 --stations 12 --rate 40 --create-grids 6
+    python tools/loadgen.py --synthetic 2000 --record monday.ndjson --dry-run
+    python tools/loadgen.py --log monday.ndjson --speed 2 --url http://127.0.0.1:8000
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+API = "/v1/api/grid"
+SHIPPING = "shipping"
+
+class Event(NamedTuple):
+    at: float                     # seconds from the start of the wave
+    station: object               # station id, SHIPPING for clears
+    scan: Optional[dict] = None   # ProductInput payload
+    ship: Optional[str] = None    # full_order_key of the order to ship
+
+def order_key(product_code: str, qr_data: str) -> str:
+    return f"{product_code.rsplit('-', 1)[0]}-{qr_data.split('-', 1)[0]}"
+
+def scan_payload(product_code: str, qr_data: str, total, size: str = None, color: str = None, number=None) -> dict:
+    parts = product_code.split("-")
+    return {
+        "productCode": product_code,
+        "qrData": qr_data,
+        "size": size or (parts[1] if len(parts) == 4 else "M"),
+        "color": color or "loadgen",
+        "number": str(number or parts[-1]),
+        "total": str(total),
+    }
+
+def synthetic_wave(
+    orders: int,
+    stations: int,
+    rate: float,
+    max_total: int,
+    rescan: float,
+    ship_after: float,
+    areas: List[str],
+    seed: Optional[int]
+) -> List[Event]:
+    """Orders spread over stations; each station works through a few orders at once"""
+    rng = random.Random(seed)
+    order_date = f"{rng.randint(0, 999999):06d}"
+    per_station: Dict[int, List[List[dict]]] = collections.defaultdict(list)
+    for number in range(orders):
+        total = min(max_total, max(1, int(rng.expovariate(1 / 1.5)) + 1))
+        code = f"{rng.choice(areas)}-{rng.choice('SML')}-{number:06d}"
+        products = [scan_payload(f"{code}-{n}", f"{order_date}-{code}-{n}", total) for n in range(1, total + 1)]
+        per_station[number % stations].append(products)
+
+    scans: List[tuple] = []
+    for station, station_orders in per_station.items():
+        active: List[List[dict]] = []
+        pending = list(reversed(station_orders))
+        while pending or active:
+            while pending and len(active) < 3:
+                active.append(pending.pop())
+            products = rng.choice(active)
+            payload = products.pop(0)
+            scans.append((station, payload))
+            if rng.random() < rescan:
+                scans.append((station, payload))
+            if not products:
+                active.remove(products)
+
+    # Stations run in parallel: interleave their scan sequences, then pace the whole stream at rate
+    queues: Dict[int, collections.deque] = collections.defaultdict(collections.deque)
+    for station, payload in scans:
+        queues[station].append(payload)
+    turns = [station for station, _ in scans]
+    rng.shuffle(turns)
+    events: List[Event] = []
+    remaining: Dict[str, int] = {}
+    scanned = set()
+    for index, station in enumerate(turns):
+        payload = queues[station].popleft()
+        events.append(Event(index / rate, station, scan=payload))
+        if payload["productCode"] in scanned:
+            continue
+        scanned.add(payload["productCode"])
+        key = order_key(payload["productCode"], payload["qrData"])
+        remaining[key] = remaining.get(key, int(payload["total"])) - 1
+        if remaining[key] == 0:
+            events.append(Event(index / rate + ship_after, SHIPPING, ship=key))
+    events.sort(key=lambda event: event.at)
+    return events
+
+def read_log(path: str, rate: float) -> List[Event]:
+    events = []
+    with open(path, encoding="utf-8") as log:
+        for index, line in enumerate(line for line in log if line.strip()):
+            entry = json.loads(line)
+            at = float(entry["t"]) if "t" in entry else index / rate
+            if "ship" in entry:
+                events.append(Event(at, SHIPPING, ship=entry["ship"]))
+            else:
+                events.append(Event(at, entry.get("station", 0), scan=scan_payload(
+                    entry["productCode"],
+                    entry["qrData"],
+                    entry["total"],
+                    entry.get("size"),
+                    entry.get("color"),
+                    entry.get("number")
+                )))
+    events.sort(key=lambda event: event.at)
+    return events
+
+def write_log(path: str, events: List[Event]):
+    with open(path, "w", encoding="utf-8") as log:
+        for event in events:
+            entry = {"t": round(event.at, 4)}
+            if event.ship:
+                entry["ship"] = event.ship
+            else:
+                entry["station"] = event.station
+                entry.update(event.scan)
+            log.write(json.dumps(entry) + "\n")
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = collections.defaultdict(list)
+        self.statuses: Dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+        self.outcomes: Dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+        self.messages = collections.Counter()
+
+    def record(self, endpoint: str, latency: float, status, outcome: Optional[str] = None, message: str = None):
+        self.latencies[endpoint].append(latency)
+        self.statuses[endpoint][status] += 1
+        if outcome:
+            self.outcomes[endpoint][outcome] += 1
+        if message:
+            self.messages[f"{endpoint} {status}: {message[:100]}"] += 1
+
+    def report(self, elapsed: float) -> dict:
+        report = {"elapsed_s": round(elapsed, 2), "endpoints": {}}
+        for endpoint, latencies in self.latencies.items():
+            ordered = sorted(latencies)
+            pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+            report["endpoints"][endpoint] = {
+                "requests": len(ordered),
+                "per_second": round(len(ordered) / elapsed, 1) if elapsed else None,
+                "p50_ms": pick(0.50),
+                "p95_ms": pick(0.95),
+                "p99_ms": pick(0.99),
+                "max_ms": round(ordered[-1] * 1000, 1),
+                "status": {str(code): count for code, count in self.statuses[endpoint].most_common()},
+                **dict(self.outcomes[endpoint]),
+            }
+        report["top_errors"] = dict(self.messages.most_common(10))
+        return report
+
+class Runner:
+    def __init__(self, client: httpx.AsyncClient, speed: float, max_in_flight: int):
+        self.client = client
+        self.speed = speed
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.stats = Stats()
+        self.order_cells: Dict[str, int] = {}
+        self.started = 0.0
+
+    async def run(self, events: List[Event]) -> float:
+        by_station: Dict[object, List[Event]] = collections.defaultdict(list)
+        for event in events:
+            by_station[event.station].append(event)
+        shipping = by_station.pop(SHIPPING, [])
+        self.started = time.perf_counter()
+        await asyncio.gather(self._shipping(shipping), *(self._station(station_events) for station_events in by_station.values()))
+        return time.perf_counter() - self.started
+
+    async def _station(self, events: List[Event]):
+        """One scanner: each scan waits for the previous one"""
+        for event in events:
+            due = await self._wait(event)
+            await self._scan(event.scan, due)
+
+    async def _shipping(self, events: List[Event]):
+        """Clears go out when due, independent of each other (several shipping staff)"""
+        clears = []
+        for event in events:
+            due = await self._wait(event)
+            clears.append(asyncio.create_task(self._ship(event.ship, due)))
+        await asyncio.gather(*clears)
+
+    async def _wait(self, event: Event) -> float:
+        due = self.started + event.at / self.speed
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return due
+
+    async def _scan(self, payload: dict, due: float):
+        async with self.semaphore:
+            try:
+                response = await self.client.post(f"{API}/assign-product", json=payload)
+            except httpx.HTTPError as e:
+                self.stats.record("assign-product", time.perf_counter() - due, type(e).__name__, "errors")
+                return
+        latency = time.perf_counter() - due
+        if response.status_code == 200:
+            self.order_cells[order_key(payload["productCode"], payload["qrData"])] = response.json()["cell_id"]
+            self.stats.record("assign-product", latency, 200, "assigned")
+        elif response.status_code == 409:
+            self.stats.record("assign-product", latency, 409, "duplicates")
+        elif response.status_code == 400:
+            self.stats.record("assign-product", latency, 400, "allocation_failures", _detail(response))
+        else:
+            self.stats.record("assign-product", latency, response.status_code, "errors", _detail(response))
+
+    async def _ship(self, key: str, due: float):
+        cell_id = self.order_cells.pop(key, None)
+        if cell_id is None:
+            # The order never got a cell (allocation failed): nothing to clear
+            self.stats.outcomes["cell-clear"]["skipped"] += 1
+            return
+        async with self.semaphore:
+            try:
+                response = await self.client.post(f"{API}/cell/{cell_id}/clear")
+            except httpx.HTTPError as e:
+                self.stats.record("cell-clear", time.perf_counter() - due, type(e).__name__, "errors")
+                return
+        latency = time.perf_counter() - due
+        if response.status_code == 200:
+            self.stats.record("cell-clear", latency, 200, "cleared")
+        else:
+            self.stats.record("cell-clear", latency, response.status_code, "errors", _detail(response))
+
+def _detail(response: httpx.Response) -> str:
+    try:
+        return str(response.json().get("detail", response.text))
+    except ValueError:
+        return response.text
+
+async def create_grids(client: httpx.AsyncClient, count: int, width: int, height: int):
+    if count <= 0:
+        return
+    response = await client.post(f"{API}/create/bulk", json={
+        "grids": [{"name": f"loadgen-{index + 1}", "width": width, "height": height} for index in range(count)]
+    })
+    response.raise_for_status()
+    print(f"created grids {[grid['id'] for grid in response.json()]}")
+
+async def run(args, events: List[Event]) -> dict:
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+            await create_grids(client, args.create_grids, args.width, args.height)
+            runner = Runner(client, args.speed, args.max_in_flight)
+            elapsed = await runner.run(events)
+    else:
+        import main as app_module
+
+        app = app_module.app
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadgen", timeout=args.timeout) as client:
+                await create_grids(client, args.create_grids, args.width, args.height)
+                runner = Runner(client, args.speed, args.max_in_flight)
+                elapsed = await runner.run(events)
+    report = runner.stats.report(elapsed)
+    report["target"] = args.url or "in-process"
+    scans = [event for event in events if event.scan]
+    report["offered_scans_per_second"] = round(len(scans) / (scans[-1].at / args.speed or 1), 1) if scans else 0
+    return report
+
+def print_report(report: dict):
+    print(f"{report['target']}: {report['elapsed_s']}s, offered {report['offered_scans_per_second']} scans/s")
+    print(f"{'endpoint':<16}{'requests':>9}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}  outcomes / status")
+    for endpoint, entry in report["endpoints"].items():
+        outcomes = {key: value for key, value in entry.items() if key not in (
+            "requests", "per_second", "p50_ms", "p95_ms", "p99_ms", "max_ms", "status"
+        )}
+        print(
+            f"{endpoint:<16}{entry['requests']:>9}{entry['per_second']:>8}{entry['p50_ms']:>9}"
+            f"{entry['p95_ms']:>9}{entry['p99_ms']:>9}{entry['max_ms']:>9}  {outcomes} {entry['status']}"
+        )
+    for message, count in report["top_errors"].items():
+        print(f"  {count} x {message}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--synthetic", type=int, metavar="ORDERS", help="synthesize a wave of this many orders")
+    source.add_argument("--log", help="replay this NDJSON scan log")
+    parser.add_argument("--url", help="running server (default: the app of main.py in-process)")
+    parser.add_argument("--rate", type=float, default=20, help="scans per second (synthetic, or log lines without t)")
+    parser.add_argument("--speed", type=float, default=1, help="replay speed multiplier")
+    parser.add_argument("--stations", type=int, default=8, help="synthetic: scanning stations")
+    parser.add_argument("--max-total", type=int, default=12, help="synthetic: largest order")
+    parser.add_argument("--rescan", type=float, default=0.02, help="synthetic: share of products scanned twice")
+    parser.add_argument("--ship-after", type=float, default=30, help="synthetic: seconds from an order's last scan to its clear")
+    parser.add_argument("--areas", default="VA,VB,VC", help="synthetic: production areas")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--record", metavar="FILE", help="write the wave as an NDJSON log")
+    parser.add_argument("--dry-run", action="store_true", help="only build (and --record) the wave")
+    parser.add_argument("--create-grids", type=int, default=0, help="create this many grids before the wave")
+    parser.add_argument("--width", type=int, default=20)
+    parser.add_argument("--height", type=int, default=20)
+    parser.add_argument("--max-in-flight", type=int, default=200, help="requests outstanding at once")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        events = synthetic_wave(
+            args.synthetic, args.stations, args.rate, args.max_total, args.rescan,
+            args.ship_after, args.areas.split(","), args.seed
+        )
+    else:
+        events = read_log(args.log, args.rate)
+    if args.record:
+        write_log(args.record, events)
+    scans = sum(1 for event in events if event.scan)
+    print(f"{scans} scans, {len(events) - scans} clears over {events[-1].at / args.speed:.0f}s" if events else "empty wave")
+    if args.dry_run or not events:
+        return
+
+    report = asyncio.run(run(args, events))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Offline allocation simulator
+
+Replays a scan log against every allocation strategy (grid_management/allocation.py)
+with the real occupancy index, and reports per strategy:
+- failed: scans that found no free cell (orders that could not be placed)
+- util avg / peak: share of cells holding an order while the log is replayed
+- walk/scan: average walk from the packing station to the cell of each scan
+  (ALLOCATION_STATION_X/Y, ALLOCATION_GRID_SPACING)
+- grids used: average number of grids holding at least one order
+- large->large: share of large orders (ALLOCATION_LARGE_ORDER_TOTAL+) placed in large cells
+
+Scan logs (NDJSON, one event per line, in time order):
+    {"productCode": "VA-M-000126-1", "qrData": "101725-VA-M-000126-1", "total": "3"}
+    {"ship": "VA-M-000126-101725"}          # the order's cell is cleared
+or --from-db: products and shipped_products of the database (scan and ship
+times), laid out on its active grids; or --synthetic: a random log.
+
+Usage (from the repository root):
+    python tools/simulate_allocation.py --synthetic 5000 --grids 4 --width 20 --height 20
+    python tools/simulate_allocation.py --log scans.ndjson --grids 10
+    python tools/simulate_allocation.py --from-db
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from grid_management.allocation import STRATEGIES, create_strategy, walk_distance
+from grid_management.occupancy import CellOccupancyIndex
+
+class Event(NamedTuple):
+    order_key: str
+    total: int = 0
+    ship: bool = False
+
+# grid_id -> (width, height)
+Layout = Dict[int, Tuple[int, int]]
+
+def order_key(product_code: str, qr_data: str) -> str:
+    order_code = product_code.rsplit("-", 1)[0]
+    return f"{order_code}-{qr_data.split('-', 1)[0]}"
+
+def read_log(path: str) -> List[Event]:
+    events = []
+    with open(path, encoding="utf-8") as log:
+        for line in log:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "ship" in entry:
+                events.append(Event(entry["ship"], ship=True))
+            else:
+                events.append(Event(order_key(entry["productCode"], entry["qrData"]), int(entry["total"])))
+    return events
+
+def synthetic_log(orders: int, max_total: int, in_flight: int, ship_after: int, seed: Optional[int]) -> List[Event]:
+    """Orders scanned interleaved (in_flight at a time); each ships ship_after events after its last scan"""
+    rng = random.Random(seed)
+    # Mostly small orders, a tail of large ones
+    pending = [
+        (f"SIM-{rng.choice('SML')}-{number:06d}-010125", min(max_total, max(1, int(rng.expovariate(1 / 2.5)) + 1)))
+        for number in range(orders)
+    ]
+    pending.reverse()
+    active: List[list] = []
+    ships: Dict[int, List[str]] = {}
+    events: List[Event] = []
+    while pending or active or ships:
+        for key in ships.pop(len(events), []):
+            events.append(Event(key, ship=True))
+        while pending and len(active) < in_flight:
+            key, total = pending.pop()
+            active.append([key, total, 0])
+        if not active:
+            if ships:
+                # Nothing left to scan: flush the remaining shipments in order
+                for step in sorted(ships):
+                    events.extend(Event(key, ship=True) for key in ships.pop(step))
+            continue
+        order = rng.choice(active)
+        order[2] += 1
+        events.append(Event(order[0], order[1]))
+        if order[2] >= order[1]:
+            active.remove(order)
+            ships.setdefault(len(events) + ship_after, []).append(order[0])
+    return events
+
+def database_log() -> Tuple[Layout, List[Event]]:
+    """Active grids, and every stored/shipped product as scan (+ ship) events in time order"""
+    from sqlalchemy import select
+    from core.core.database import SessionLocal
+    from grid_management import crud, models
+
+    timeline = []
+    with SessionLocal() as db:
+        layout = {
+            grid.id: (grid.width, grid.height)
+            for grid in db.query(models.Grid).filter(models.Grid.is_active == True).order_by(models.Grid.id)
+        }
+        for table, scanned_at in ((models.Product, models.Product.created_at), (models.ShippedProduct, models.ShippedProduct.scanned_at)):
+            for code, order_date, total, at in db.execute(
+                select(table.product_code, table.order_date, table.total, scanned_at).execution_options(yield_per=10000)
+            ):
+                if at is None or total is None:
+                    continue
+                key = crud.create_full_order_key(crud.extract_order_code(code), order_date)
+                timeline.append((at, 1, Event(key, total)))
+        for key, shipped_at in db.execute(
+            select(models.ShippedProduct.full_order_key, models.ShippedProduct.shipped_at).distinct()
+        ):
+            if key:
+                timeline.append((shipped_at, 0, Event(key, ship=True)))
+    timeline.sort(key=lambda entry: (entry[0], entry[1]))
+    return layout, [event for _, _, event in timeline]
+
+def simulate(strategy_name: str, layout: Layout, events: Iterable[Event], large_order_total: int, large_cell_rows: int) -> dict:
+    strategy = create_strategy(strategy_name)
+    index = CellOccupancyIndex(strategy)
+    cells: Dict[int, Tuple[int, int, int]] = {}
+    rows = []
+    for grid_id, (width, height) in layout.items():
+        for y in range(height):
+            for x in range(width):
+                cell_id = len(cells) + 1
+                cells[cell_id] = (grid_id, x, y)
+                rows.append((cell_id, grid_id, x, y, "empty", None))
+    index.load(rows)
+    ranks = {grid_id: rank for rank, grid_id in enumerate(sorted(layout))}
+
+    order_cells: Dict[str, int] = {}
+    counts: Dict[int, int] = {}
+    grid_orders: Dict[int, int] = dict.fromkeys(layout, 0)
+    scans = placed = failed = walk = 0
+    large_orders = large_hits = 0
+    util_sum = grids_sum = peak = samples = 0
+
+    for event in events:
+        if event.ship:
+            cell_id = order_cells.pop(event.order_key, None)
+            if cell_id is not None:
+                grid_id, x, y = cells[cell_id]
+                index.sync_cell(cell_id, grid_id, x, y, "empty", None)
+                counts.pop(cell_id, None)
+                grid_orders[grid_id] -= 1
+        else:
+            scans += 1
+            cell_id = index.find_filling(event.order_key)
+            if cell_id is None:
+                cell_id = index.claim_empty(event.total)
+                if cell_id is None:
+                    failed += 1
+                    continue
+                grid_id, _, y = cells[cell_id]
+                if event.order_key in order_cells:
+                    # More scans than the order total: the old cell stays as it is
+                    grid_orders[cells[order_cells[event.order_key]][0]] -= 1
+                order_cells[event.order_key] = cell_id
+                counts[cell_id] = 0
+                grid_orders[grid_id] += 1
+                if event.total >= large_order_total:
+                    large_orders += 1
+                    large_hits += y < large_cell_rows
+            grid_id, x, y = cells[cell_id]
+            counts[cell_id] += 1
+            index.sync_cell(cell_id, grid_id, x, y, "full" if counts[cell_id] >= event.total else "filling", event.order_key)
+            walk += walk_distance(ranks[grid_id], x, y)
+            placed += 1
+
+        occupied = len(counts)
+        util_sum += occupied
+        peak = max(peak, occupied)
+        grids_sum += sum(1 for orders in grid_orders.values() if orders > 0)
+        samples += 1
+
+    total_cells = max(len(cells), 1)
+    samples = max(samples, 1)
+    return {
+        "strategy": strategy_name,
+        "scans": scans,
+        "placed": placed,
+        "failed": failed,
+        "util_avg": util_sum / samples / total_cells,
+        "util_peak": peak / total_cells,
+        "walk_per_scan": walk / max(placed, 1),
+        "grids_used": grids_sum / samples,
+        "large_in_large": large_hits / large_orders if large_orders else None,
+    }
+
+def print_table(results: List[dict]):
+    print(f"{'strategy':<18}{'scans':>8}{'failed':>8}{'util avg':>10}{'util peak':>11}{'walk/scan':>11}{'grids used':>12}{'large->large':>14}")
+    for result in results:
+        large = "-" if result["large_in_large"] is None else f"{result['large_in_large']:.0%}"
+        print(
+            f"{result['strategy']:<18}{result['scans']:>8}{result['failed']:>8}"
+            f"{result['util_avg']:>10.1%}{result['util_peak']:>11.1%}{result['walk_per_scan']:>11.1f}"
+            f"{result['grids_used']:>12.2f}{large:>14}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--log", help="NDJSON scan log")
+    source.add_argument("--from-db", action="store_true", help="replay the database's products and shipments on its active grids")
+    source.add_argument("--synthetic", type=int, metavar="ORDERS", help="random log with this many orders")
+    parser.add_argument("--grids", type=int, default=4)
+    parser.add_argument("--width", type=int, default=20)
+    parser.add_argument("--height", type=int, default=20)
+    parser.add_argument("--max-total", type=int, default=12, help="synthetic: largest order")
+    parser.add_argument("--in-flight", type=int, default=200, help="synthetic: orders being scanned at the same time")
+    parser.add_argument("--ship-after", type=int, default=2000, help="synthetic: events between an order's last scan and its shipment")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--strategies", default=",".join(STRATEGIES), help="comma-separated strategy names")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    from core.core.config import settings
+
+    if args.from_db:
+        layout, events = database_log()
+    else:
+        layout = {grid_id: (args.width, args.height) for grid_id in range(1, args.grids + 1)}
+        if args.log:
+            events = read_log(args.log)
+        else:
+            events = synthetic_log(args.synthetic, args.max_total, args.in_flight, args.ship_after, args.seed)
+
+    results = [
+        simulate(name.strip(), layout, events, settings.ALLOCATION_LARGE_ORDER_TOTAL, settings.ALLOCATION_LARGE_CELL_ROWS)
+        for name in args.strategies.split(",") if name.strip()
+    ]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{len(layout)} grids, {sum(w * h for w, h in layout.values())} cells, {len(events)} events")
+        print_table(results)
+
+if __name__ == "__main__":
+    main()
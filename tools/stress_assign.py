@@ -0,0 +1,191 @@
+"""
+Concurrency stress test for product allocation
+
+Fires thousands of concurrent scans at a running server (start it with several
+workers so allocation races across processes), then checks the database:
+- no order is split across cells
+- no cell holds products of two orders (double-booked)
+- cell counters and order tracking match the stored products
+
+Usage (from the repository root, same .env as the server):
+    uvicorn main:app --workers 4 --port 8000
+    python tools/stress_assign.py --url http://127.0.0.1:8000 --orders 1000 --concurrency 200
+    python tools/stress_assign.py --bulk-size 20      # exercise /assign-product/bulk too
+
+Every run uses its own random order date and new grids sized for the run,
+so it can be repeated on the same database. Exit code 1 on any violation.
+tests/test_concurrent_assign.py runs the same checks (check_database) after
+concurrent in-process scans on the test database.
+"""
+import argparse
+import asyncio
+import collections
+import math
+import os
+import random
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+API = "/v1/api/grid"
+
+def build_scans(orders: int, max_total: int, order_date: str):
+    scans = []
+    for order in range(orders):
+        total = random.randint(1, max_total)
+        size = random.choice("SML")
+        for number in range(1, total + 1):
+            # Product codes are globally unique: tag them with the run's order date
+            code = f"ST{order_date}-{size}-{order:06d}-{number}"
+            scans.append({
+                "productCode": code,
+                "qrData": f"{order_date}-{code}",
+                "size": size,
+                "color": "stress",
+                "number": str(number),
+                "total": str(total)
+            })
+    random.shuffle(scans)
+    return scans
+
+async def fire(client: httpx.AsyncClient, scans, concurrency: int, bulk_size: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = collections.Counter()
+    messages = collections.Counter()
+    accepted = 0
+
+    async def send(batch):
+        nonlocal accepted
+        async with semaphore:
+            try:
+                if bulk_size:
+                    response = await client.post(f"{API}/assign-product/bulk", json={"products": batch})
+                else:
+                    response = await client.post(f"{API}/assign-product", json=batch[0])
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+                return
+        statuses[response.status_code] += 1
+        if response.status_code != 200:
+            messages[response.text[:120]] += 1
+            return
+        if bulk_size:
+            for result in response.json()["results"]:
+                if result["success"]:
+                    accepted += 1
+                else:
+                    messages[result["message"][:120]] += 1
+        else:
+            accepted += 1
+
+    size = bulk_size or 1
+    batches = [scans[i:i + size] for i in range(0, len(scans), size)]
+    started = time.perf_counter()
+    await asyncio.gather(*(send(batch) for batch in batches))
+    return accepted, statuses, messages, time.perf_counter() - started
+
+def check_database(db, order_date: str, accepted: int) -> list:
+    """Violations among the products stored by the run of order_date (accepted: scans that succeeded)"""
+    from sqlalchemy import func
+    from grid_management import models
+
+    product = models.Product
+    order_of = product.production_area + "-" + product.size_code + "-" + product.order_number
+    violations = []
+
+    run_products = db.query(product).filter(
+        product.order_date == order_date,
+        product.color == "stress"
+    )
+    stored = run_products.count()
+    if stored != accepted:
+        violations.append(f"{accepted} scans accepted but {stored} products stored")
+
+    split = db.query(order_of, func.count(func.distinct(product.cell_id))).filter(
+        product.order_date == order_date
+    ).group_by(order_of).having(func.count(func.distinct(product.cell_id)) > 1).all()
+    for order, cells in split:
+        violations.append(f"order {order} split across {cells} cells")
+
+    cell_ids = [row[0] for row in run_products.with_entities(product.cell_id).distinct()]
+    double_booked = db.query(
+        product.cell_id,
+        func.count(func.distinct(order_of + "-" + product.order_date))
+    ).filter(product.cell_id.in_(cell_ids)).group_by(product.cell_id).having(
+        func.count(func.distinct(order_of + "-" + product.order_date)) > 1
+    ).all() if cell_ids else []
+    for cell_id, orders in double_booked:
+        violations.append(f"cell {cell_id} holds products of {orders} orders")
+
+    counts = dict(db.query(product.cell_id, func.count()).filter(
+        product.cell_id.in_(cell_ids)
+    ).group_by(product.cell_id).all()) if cell_ids else {}
+    for cell in db.query(models.GridCell).filter(models.GridCell.id.in_(cell_ids)).all():
+        if cell.current_product_count != counts.get(cell.id, 0):
+            violations.append(
+                f"cell {cell.cell_name} (id {cell.id}) counter {cell.current_product_count} "
+                f"!= {counts.get(cell.id, 0)} products"
+            )
+
+    received = dict(db.query(order_of + "-" + product.order_date, func.count()).filter(
+        product.order_date == order_date
+    ).group_by(order_of + "-" + product.order_date).all())
+    trackings = db.query(models.OrderTracking).filter(models.OrderTracking.order_date == order_date).all()
+    for tracking in trackings:
+        if tracking.received_products != received.get(tracking.full_order_key, 0):
+            violations.append(
+                f"order {tracking.full_order_key} tracking received_products "
+                f"{tracking.received_products} != {received.get(tracking.full_order_key, 0)} products"
+            )
+    if len(trackings) != len(received):
+        violations.append(f"{len(received)} orders received but {len(trackings)} tracking rows")
+
+    return violations
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--max-total", type=int, default=5, help="products per order: 1..max-total")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--bulk-size", type=int, default=0, help="send batches to /assign-product/bulk (0 = single scans)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    order_date = f"{random.randint(0, 999999):06d}"
+    scans = build_scans(args.orders, args.max_total, order_date)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=120, limits=limits) as client:
+        # Enough 20x20 grids (API maximum) for one cell per order
+        grid_ids = []
+        for index in range(max(1, math.ceil(args.orders / 400))):
+            response = await client.post(f"{API}/create", json={"name": f"stress-{order_date}-{index + 1}", "width": 20, "height": 20})
+            response.raise_for_status()
+            grid_ids.append(response.json()["id"])
+        print(f"grids {grid_ids}, order date {order_date}, {len(scans)} scans for {args.orders} orders")
+
+        accepted, statuses, messages, elapsed = await fire(client, scans, args.concurrency, args.bulk_size)
+
+    print(f"{accepted}/{len(scans)} accepted in {elapsed:.2f}s ({len(scans) / elapsed:.0f} scans/s)")
+    print("HTTP status:", dict(statuses))
+    for message, count in messages.most_common(10):
+        print(f"  {count} x {message}")
+
+    from core.core.database import SessionLocal
+
+    with SessionLocal() as db:
+        violations = check_database(db, order_date, accepted)
+    if violations:
+        print(f"FAILED: {len(violations)} violations")
+        for violation in violations[:50]:
+            print("  " + violation)
+        sys.exit(1)
+    print("OK: no split orders, no double-booked cells, counters consistent")
+
+if __name__ == "__main__":
+    asyncio.run(main())